@@ -0,0 +1,348 @@
+"""
+MAGI System - Headless HTTP API
+Streamlitを介さずにMAGIを呼び出すための非同期REST/SSEサーバー
+
+起動方法:
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+"""
+import os
+import json
+import asyncio
+from dataclasses import asdict
+from typing import AsyncIterator, Dict, List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from job_queue import get_job_queue
+from shared_state import get_shared_state
+
+
+# 同時に処理する審議の上限と、待機できるリクエスト数の上限
+MAX_CONCURRENCY = int(os.environ.get("MAGI_API_MAX_CONCURRENCY", "8"))
+MAX_PENDING = int(os.environ.get("MAGI_API_MAX_PENDING", "32"))
+
+# APIから投入した実行中・待機中のジョブ数の上限（/api/jobs/{kind}は完了を待たずに返るため、ジョブ数で制限する）
+MAX_ACTIVE_JOBS = int(os.environ.get("MAGI_API_MAX_ACTIVE_JOBS", str(MAX_CONCURRENCY + MAX_PENDING)))
+
+# 同期エンドポイントで結果を待つ最大時間（秒）
+REQUEST_TIMEOUT = float(os.environ.get("MAGI_API_REQUEST_TIMEOUT", "240"))
+
+# SSEで進捗を確認する間隔（秒）
+EVENT_POLL_INTERVAL = 0.5
+
+# スケジューラーでAPIからのジョブをまとめて扱うセッション名（事前審議など他のセッションと公平に実行される）
+API_SESSION = "api"
+
+
+app = FastAPI(title="MAGI System API")
+
+
+class AnalyzeRequest(BaseModel):
+    question: str
+    temperature: float = 0.7
+
+
+class AnalyzeDocumentRequest(BaseModel):
+    question: str
+    document: str = Field(..., min_length=1)
+    temperature: float = 0.7
+
+
+class VoteRequest(BaseModel):
+    question: str
+    options: List[str] = Field(..., min_length=2)
+    temperature: float = 0.7
+    samples: int = Field(1, ge=1, le=15)
+
+
+class RankRequest(BaseModel):
+    question: str
+    options: List[str] = Field(..., min_length=2)
+    temperature: float = 0.7
+    batch_size: int = Field(8, ge=2, le=20)
+
+
+class TournamentRequest(BaseModel):
+    question: str
+    candidates: List[str] = Field(..., min_length=2)
+    temperature: float = 0.7
+    max_calls: Optional[int] = Field(None, ge=1)
+
+
+class ApproveRejectRequest(BaseModel):
+    proposal: str
+    temperature: float = 0.7
+    samples: int = Field(1, ge=1, le=15)
+
+
+class DeliberateRequest(BaseModel):
+    proposal: str
+    rounds: int = Field(3, ge=1, le=5)
+    temperature: float = 0.7
+
+
+class JobOptions(BaseModel):
+    """/api/jobs/{kind}で各審議のパラメータと一緒に指定できるオプション（未知のキーは受け付けない）"""
+    model_config = ConfigDict(extra="forbid")
+
+    lane: Literal["interactive", "batch"] = "interactive"
+    trace: bool = False
+
+
+class AnalyzeJob(JobOptions, AnalyzeRequest):
+    pass
+
+
+class AnalyzeDocumentJob(JobOptions, AnalyzeDocumentRequest):
+    pass
+
+
+class VoteJob(JobOptions, VoteRequest):
+    pass
+
+
+class RankJob(JobOptions, RankRequest):
+    pass
+
+
+class TournamentJob(JobOptions, TournamentRequest):
+    pass
+
+
+class ApproveRejectJob(JobOptions, ApproveRejectRequest):
+    pass
+
+
+class DeliberateJob(JobOptions, DeliberateRequest):
+    pass
+
+
+# ジョブ種別 -> /api/jobs/{kind}のパラメータ
+JOB_REQUESTS: Dict[str, type] = {
+    "analyze": AnalyzeJob,
+    "analyze_document": AnalyzeDocumentJob,
+    "vote": VoteJob,
+    "rank": RankJob,
+    "tournament": TournamentJob,
+    "vote_approve_reject": ApproveRejectJob,
+    "deliberate": DeliberateJob,
+}
+
+
+class ConcurrencyLimiter:
+    """
+    リクエスト単位の同時実行制限
+
+    上限を超えたリクエストは待機し、待機数も上限を超えた場合は429を返す
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_waiting = max_concurrency + max_pending
+        self._waiting = 0
+
+    async def __aenter__(self):
+        if self._waiting >= self._max_waiting:
+            raise HTTPException(status_code=429, detail="MAGIシステムが混雑しています。しばらくしてから再試行してください")
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self._waiting -= 1
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+        self._waiting -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"active_or_waiting": self._waiting, "max_waiting": self._max_waiting}
+
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_PENDING)
+
+
+async def _run_job(kind: str, **params) -> Dict:
+    """
+    ジョブを投入して完了を待つ
+
+    同一内容の審議が実行中であれば（このプロセスのJobQueue内で）そのジョブを共有する
+    """
+    queue = get_job_queue()
+    async with limiter:
+        job_id = queue.submit(kind, session=API_SESSION, **params)
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(None, queue.wait, job_id, REQUEST_TIMEOUT)
+
+    if job is not None and job.is_active:
+        # ジョブは継続しているので、/api/jobs/{job_id}で後から結果を取得できる
+        raise HTTPException(status_code=504, detail={"message": "審議がタイムアウトしました", "job_id": job_id})
+    if job is None or job.status != "done":
+        raise HTTPException(status_code=502, detail={"message": job.error if job else "ジョブが見つかりません", "job_id": job_id})
+    return {"job_id": job_id, **job.result}
+
+
+@app.get("/api/health")
+async def health() -> Dict:
+    return {"status": "ok"}
+
+
+@app.get("/api/stats")
+async def stats() -> Dict:
+    """同時実行数・実行中のジョブ数・モデルごとのトークン使用量（見積もりと実際）と応答時間"""
+    queue = get_job_queue()
+    shared = get_shared_state()
+    return {
+        "limiter": limiter.stats(),
+        "api_jobs": {"active": queue.active_count(API_SESSION), "max_active": MAX_ACTIVE_JOBS},
+        "active_jobs": sum(1 for job in queue.list_jobs(limit=1000) if job.is_active),
+        "single_flight": queue.magi.single_flight.stats(),
+        "usage": queue.magi.client.usage_stats(),
+        "latency": queue.magi.client.latency.stats(),
+        "tokens": queue.magi.client.token_budget.stats(),
+        "scheduler": queue.magi.scheduler.stats(),
+        "shared_state": shared.stats() if shared is not None else None,
+    }
+
+
+@app.post("/api/analyze")
+async def analyze(request: AnalyzeRequest) -> Dict:
+    """3つのモデルで質問を分析"""
+    return await _run_job("analyze", question=request.question, temperature=request.temperature)
+
+
+@app.post("/api/analyze_document")
+async def analyze_document(request: AnalyzeDocumentRequest) -> Dict:
+    """長い文書を分割して読み、3つのモデルで質問を分析"""
+    return await _run_job(
+        "analyze_document",
+        question=request.question,
+        document=request.document,
+        temperature=request.temperature
+    )
+
+
+@app.post("/api/vote")
+async def vote(request: VoteRequest) -> Dict:
+    """選択肢に対して投票"""
+    return await _run_job(
+        "vote",
+        question=request.question,
+        options=request.options,
+        temperature=request.temperature,
+        samples=request.samples
+    )
+
+
+@app.post("/api/rank")
+async def rank(request: RankRequest) -> Dict:
+    """選択肢に順位を付けて投票（ボルダ方式、選択肢が多い場合は勝ち抜き方式）"""
+    return await _run_job(
+        "rank",
+        question=request.question,
+        options=request.options,
+        temperature=request.temperature,
+        batch_size=request.batch_size
+    )
+
+
+@app.post("/api/tournament")
+async def tournament(request: TournamentRequest) -> Dict:
+    """候補を1対1で比較するスイス式トーナメントで順位付け"""
+    return await _run_job(
+        "tournament",
+        question=request.question,
+        candidates=request.candidates,
+        temperature=request.temperature,
+        max_calls=request.max_calls
+    )
+
+
+@app.post("/api/vote_approve_reject")
+async def vote_approve_reject(request: ApproveRejectRequest) -> Dict:
+    """提案に対して賛成/反対を投票"""
+    return await _run_job(
+        "vote_approve_reject",
+        proposal=request.proposal,
+        temperature=request.temperature,
+        samples=request.samples
+    )
+
+
+@app.post("/api/jobs/{kind}")
+async def submit_job(kind: str, params: Dict) -> Dict:
+    """
+    ジョブを投入してすぐにジョブIDを返す（結果は/api/jobs/{job_id}か、SSEで取得）
+
+    paramsはジョブ種別ごとのモデルで検証し、未知のキー（sessionを含む）は400を返す。
+    paramsに"lane": "batch"を指定すると、対話的な審議より低い優先度で実行する。
+    APIから投入した実行中・待機中のジョブがMAX_ACTIVE_JOBSに達している場合は429を返す
+    """
+    request_model = JOB_REQUESTS.get(kind)
+    if request_model is None:
+        raise HTTPException(status_code=400, detail=f"未知のジョブ種別です: {kind}")
+    try:
+        request = request_model.model_validate(params)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=json.loads(e.json()))
+    queue = get_job_queue()
+    # 確認から投入までの間にawaitを挟まないため、同時に届いたリクエストも上限を超えない
+    if queue.active_count(API_SESSION) >= MAX_ACTIVE_JOBS:
+        raise HTTPException(status_code=429, detail="MAGIシステムが混雑しています。しばらくしてから再試行してください")
+    job_id = queue.submit(kind, session=API_SESSION, **request.model_dump())
+    return {"job_id": job_id}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict:
+    """ジョブの状態と結果"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return asdict(job)
+
+
+async def _job_events(job_id: str) -> AsyncIterator[str]:
+    """
+    ユニットの結果が届くたびにprogressイベント、完了時にresultイベントを送る
+
+    同じキーの進捗が更新された場合（質問分析の暫定のコンセンサスなど）は再度送る
+    """
+    queue = get_job_queue()
+    sent: Dict[str, Dict] = {}
+    while True:
+        job = queue.get(job_id)
+        if job is None:
+            yield _sse("error", {"message": "ジョブが見つかりません"})
+            return
+
+        for unit, info in list(job.progress.items()):
+            if sent.get(unit) != info:
+                sent[unit] = info
+                yield _sse("progress", {"unit": unit, **info})
+
+        if not job.is_active:
+            yield _sse("result", {"status": job.status, "result": job.result, "error": job.error})
+            return
+
+        await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+
+def _sse(event: str, data: Optional[Dict]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """ジョブの進捗をServer-Sent Eventsで配信"""
+    return StreamingResponse(_job_events(job_id), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Databricks Appsではポート番号がDATABRICKS_APP_PORTで渡される
+    port = int(os.environ.get("DATABRICKS_APP_PORT", "8000"))
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -2,15 +2,58 @@
 MAGI System - Streamlit Web Application
 Databricks Apps対応
 """
+import time
+
+# 実行ごとの所要時間の計測開始（初回の実行ではモジュールの読み込みを含む）
+_RUN_STARTED = time.perf_counter()
+
+import os
+import sys
+import uuid
 import streamlit as st
-import concurrent.futures
+from contextlib import contextmanager
+from typing import Callable, Dict
 from magi_system import MAGISystem, MAGIResponse
+from consensus import CONSENSUS_PROGRESS_KEY
+from job_queue import get_job_queue
+from samples import SAMPLE_PROPOSALS, SAMPLE_QUESTIONS, SAMPLE_VOTES
+from warmup import Warmup
+import timing
+
+_IMPORTED = time.perf_counter()
 
 
 # ============================================================================
 # Streamlit UI
 # ============================================================================
 
+# テーマのCSS（.streamlit/config.tomlのenableStaticServingで/app/static/から配信する）
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "magi.css")
+
+# 再実行のたびにスタイルシート全体（約10KB）を送らず、ブラウザにキャッシュさせたファイルを参照するタグだけを送る
+# （更新日時をクエリに付け、CSSを変更した場合は再読み込みさせる）
+CSS_LINK = f'<link rel="stylesheet" href="app/static/magi.css?v={int(os.path.getmtime(CSS_PATH))}">'
+
+
+@st.cache_resource
+def load_council():
+    """審議に参加するユニット（設定ファイルの読み込みはプロセス内で1度だけ）"""
+    return MAGISystem.default_council()
+
+
+@st.cache_resource
+def start_warmup(temperature: float):
+    """接続の確立とサンプルの事前審議（MAGI_WARMUP=1の場合のみ、プロセス内で1度だけ）"""
+    warmup = Warmup.from_env(get_job_queue(), temperature=temperature)
+    return warmup.start() if warmup is not None else None
+
+
+@st.cache_resource
+def startup_report() -> Dict[str, float]:
+    """プロセス起動後の最初の実行（コールドスタート）の所要時間（秒）"""
+    return {}
+
+
 # ページ設定
 st.set_page_config(
     page_title="MAGI System",
@@ -18,406 +61,463 @@ st.set_page_config(
     layout="wide"
 )
 
-# CSS スタイリング - エヴァンゲリオンMAGI風
-st.markdown("""
-    <style>
-    /* ダークテーマベース - 真っ黒 */
-    .stApp {
-        background-color: #000000;
-        color: #ff6600;
-    }
+# CSS スタイリング - エヴァンゲリオンMAGI風（static/magi.css）
+st.markdown(CSS_LINK, unsafe_allow_html=True)
 
-    /* CRTスキャンライン効果 */
-    .stApp::before {
-        content: "";
-        position: fixed;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 100%;
-        background: repeating-linear-gradient(
-            0deg,
-            rgba(0, 0, 0, 0.15),
-            rgba(0, 0, 0, 0.15) 1px,
-            transparent 1px,
-            transparent 2px
-        );
-        pointer-events: none;
-        z-index: 1000;
-    }
 
-    /* 見出しとテキストの色 - オレンジ */
-    h1, h2, h3, h4, h5, h6 {
-        color: #ff6600 !important;
-        font-family: 'Courier New', monospace;
-        text-transform: uppercase;
-        letter-spacing: 0.1em;
-    }
+# 審議に参加するユニット（MAGI_COUNCIL_CONFIGで変更可能）
+COUNCIL = load_council()
 
-    /* メインヘッダー - MAGIシステムコード風 */
-    .main-header {
-        text-align: center;
-        padding: 1rem 0;
-        background: #000000;
-        color: #ff6600;
-        border: 3px solid #ff6600;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 0 30px rgba(255, 102, 0, 0.5);
-        font-family: 'Courier New', monospace;
-    }
-    .main-header h1 {
-        color: #ff6600;
-        text-shadow: 0 0 10px #ff6600;
-        font-family: 'Courier New', monospace;
-        letter-spacing: 0.3em;
-        font-weight: bold;
-        margin-bottom: 0.3rem;
-    }
-    .main-header p {
-        margin: 0;
-    }
+_SET_UP = time.perf_counter()
 
-    /* モデルカード - エヴァMAGI風の大きなブロック */
-    .model-card {
-        border: 4px solid;
-        padding: 1rem;
-        margin: 1.5rem 0;
-        border-radius: 0;
-        font-family: 'Courier New', monospace;
-        position: relative;
-        min-height: 120px;
-        font-size: 0.85em;
-    }
-    /* MELCHIOR - 赤色ブロック */
-    .melchior {
-        border-color: #ff0000;
-        background: #cc0000;
-        box-shadow: 0 0 30px rgba(255, 0, 0, 0.8);
-    }
-    /* BALTHASAR - 青色ブロック */
-    .balthasar {
-        border-color: #0080ff;
-        background: #0066cc;
-        box-shadow: 0 0 30px rgba(0, 128, 255, 0.8);
-    }
-    /* CASPER - 黄色ブロック */
-    .casper {
-        border-color: #ffff00;
-        background: #cccc00;
-        box-shadow: 0 0 30px rgba(255, 255, 0, 0.8);
-    }
-    /* CONSENSUS - オレンジ */
-    .consensus {
-        border-color: #ff6600;
-        background: #cc5500;
-        box-shadow: 0 0 30px rgba(255, 102, 0, 0.8);
-    }
-    .model-name {
-        font-weight: bold;
-        font-size: 1.3em;
-        margin-bottom: 8px;
-        text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.8);
-        font-family: 'Courier New', monospace;
-        letter-spacing: 0.15em;
-        text-transform: uppercase;
-    }
-    .melchior .model-name {
-        color: #000000;
-    }
-    .balthasar .model-name {
-        color: #000000;
-    }
-    .casper .model-name {
-        color: #000000;
-    }
-    .consensus .model-name {
-        color: #000000;
-    }
-    /* カード内のテキストも黒に */
-    .model-card p,
-    .model-card div,
-    .model-card span {
-        color: #000000 !important;
-    }
+# 既定のユニットの表示設定（ボックスのタイトル, アイコン, 色, 回答カードのCSSクラス）
+UNIT_STYLES = {
+    "MELCHIOR": ("MELCHIOR-1", "🔴", "#ff0000", "melchior"),
+    "BALTHASAR": ("BALTHASAR-2", "🔵", "#0080ff", "balthasar"),
+    "CASPER": ("CASPER-3", "🟡", "#ffff00", "casper"),
+}
+# 設定ファイルで追加されたユニットの表示設定
+DEFAULT_UNIT_STYLE = ("", "🟠", "#ff6600", "consensus")
 
-    /* エヴァMAGI風 - 3つのボックスの横並び配置 */
-    .magi-container {
-        display: flex;
-        gap: 1.5rem;
-        justify-content: space-between;
-        width: 100%;
-        margin: 2rem 0;
-    }
-    .magi-box {
-        flex: 1;
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        justify-content: center;
-        font-family: 'Courier New', monospace;
-        font-weight: bold;
-        font-size: 1em;
-        border: 4px solid;
-        padding: 2rem;
-        min-height: 200px;
-        clip-path: polygon(10% 0%, 90% 0%, 100% 10%, 100% 90%, 90% 100%, 10% 100%, 0% 90%, 0% 10%);
-    }
-    .magi-box-title {
-        font-size: 0.7em;
-        margin-bottom: 0.5rem;
-        letter-spacing: 0.1em;
-        white-space: nowrap;
-        color: #000000 !important;
-    }
-    .magi-box-status {
-        font-size: 1.0em;
-        margin-top: 0.5rem;
-        color: #000000 !important;
-    }
+# 1行に並べるユニット数
+UNITS_PER_ROW = 3
 
-    /* 各MAGIシステムの色（固有色で統一） */
-    .magi-melchior {
-        background: #cc0000 !important;
-        border-color: #ff0000 !important;
-        box-shadow: 0 0 40px rgba(255, 0, 0, 0.8) !important;
-        color: #000000 !important;
-    }
-    .magi-melchior .magi-box-title,
-    .magi-melchior .magi-box-status {
-        color: #000000 !important;
-    }
-    .magi-balthasar {
-        background: #0066cc !important;
-        border-color: #0080ff !important;
-        box-shadow: 0 0 40px rgba(0, 128, 255, 0.8) !important;
-        color: #000000 !important;
-    }
-    .magi-balthasar .magi-box-title,
-    .magi-balthasar .magi-box-status {
-        color: #000000 !important;
-    }
-    .magi-casper {
-        background: #cccc00 !important;
-        border-color: #ffff00 !important;
-        box-shadow: 0 0 40px rgba(255, 255, 0, 0.8) !important;
-        color: #000000 !important;
-    }
-    .magi-casper .magi-box-title,
-    .magi-casper .magi-box-status {
-        color: #000000 !important;
-    }
 
-    /* 投票中の状態 */
-    .magi-pending {
-        opacity: 0.6;
-    }
+def unit_style(name: str):
+    """ユニットの表示設定 (タイトル, アイコン, 色, CSSクラス) を返す"""
+    title, icon, color, card_class = UNIT_STYLES.get(name, DEFAULT_UNIT_STYLE)
+    return title or name, icon, color, card_class
 
-    /* アニメーション定義 */
-    @keyframes fadeInScale {
-        0% {
-            opacity: 0;
-            transform: scale(0.8);
-        }
-        100% {
-            opacity: 1;
-            transform: scale(1);
-        }
-    }
 
-    @keyframes blink {
-        0%, 100% {
-            opacity: 1;
-        }
-        50% {
-            opacity: 0.3;
-        }
-    }
+def unit_columns(gap: str = "small"):
+    """ユニットごとの列を (ユニット名, 列) で返す（1行に最大UNITS_PER_ROWユニット）"""
+    names = COUNCIL.names
+    for start in range(0, len(names), UNITS_PER_ROW):
+        yield from zip(names[start:start + UNITS_PER_ROW], st.columns(UNITS_PER_ROW, gap=gap))
 
-    /* MAGIボックスの表示アニメーション */
-    .magi-box {
-        animation: fadeInScale 0.8s ease-out forwards;
-        opacity: 0;
-    }
 
-    .magi-melchior {
-        animation-delay: 0.1s;
-    }
+# モデルの投票（賛成/反対）と画面上の表記（承認/否定）の対応
+APPROVE_REJECT_LABELS = {"賛成": "承認", "反対": "否定"}
 
-    .magi-balthasar {
-        animation-delay: 0.3s;
-    }
+# 順位付け投票で1回の呼び出しに含める選択肢の最大数
+RANK_BATCH_SIZE = 8
 
-    .magi-casper {
-        animation-delay: 0.5s;
-    }
+# スイス式トーナメントのモデル呼び出し回数の上限
+TOURNAMENT_MAX_CALLS = 300
 
-    /* 投票中の点滅アニメーション */
-    .voting-status {
-        animation: blink 1.5s infinite;
-        color: #000000 !important;
-    }
+# 実行中のジョブの進捗を確認する間隔（秒）
+JOB_POLL_INTERVAL = 1.0
 
-    /* Streamlitアラートボックスの色調整 */
-    .stAlert {
-        background-color: #1a1a1a !important;
-        border: 2px solid #ff6600 !important;
-        color: #ff6600 !important;
-    }
-    .stAlert > div {
-        color: #ff6600 !important;
-    }
-    .stSuccess {
-        background-color: #1a1a1a !important;
-        border-color: #00ff00 !important;
-        color: #00ff00 !important;
-    }
-    .stError {
-        background-color: #1a1a1a !important;
-        border-color: #ff0000 !important;
-        color: #ff0000 !important;
-    }
-    .stWarning {
-        background-color: #1a1a1a !important;
-        border-color: #ffff00 !important;
-        color: #ffff00 !important;
-    }
-    .stInfo {
-        background-color: #1a1a1a !important;
-        border-color: #00ffff !important;
-        color: #00ffff !important;
-    }
 
-    /* その他の白い背景を持つコンポーネントを修正 */
-    .stMarkdown, .stText {
-        background-color: transparent !important;
-    }
-    div[data-testid="stMarkdownContainer"] {
-        background-color: transparent !important;
-    }
-    .element-container {
-        background-color: transparent !important;
-    }
+def render_vote_box(container, name: str, vote: str):
+    """1ユニット分のMAGIボックスを描画"""
+    title = unit_style(name)[0]
+    vote = APPROVE_REJECT_LABELS.get(vote, vote)
+    if vote == "承認":
+        style, status = "magi-vote-approve", vote
+    elif vote == "否定":
+        style, status = "magi-vote-reject", vote
+    else:
+        style, status = "magi-vote-voting", "投票中..."
 
-    .stExpander {
-        background-color: #1a1a1a !important;
-        border: 2px solid #ff6600 !important;
-    }
-    [data-testid="stExpander"] {
-        background-color: #1a1a1a !important;
-        border-color: #ff6600 !important;
-    }
+    container.markdown(f"""
+<div class="magi-vote-box {style}">
+    <div class="magi-vote-title">{title}</div>
+    <div class="magi-vote-status">{status}</div>
+</div>
+""", unsafe_allow_html=True)
 
-    /* Streamlitコンポーネントの色調整 - オレンジベース */
-    .stButton > button {
-        background-color: #000000;
-        color: #ff6600;
-        border: 2px solid #ff6600;
-        font-family: 'Courier New', monospace;
-        text-transform: uppercase;
-    }
-    .stButton > button:hover {
-        background-color: #ff6600;
-        color: #000000 !important;
-        box-shadow: 0 0 20px #ff6600;
-    }
-    .stButton > button:hover p,
-    .stButton > button:hover span,
-    .stButton > button:hover div {
-        color: #000000 !important;
-    }
-    .stTextArea textarea {
-        background-color: #1a1a1a;
-        color: #ff6600;
-        border: 2px solid #ff6600;
-        font-family: 'Courier New', monospace;
-    }
-    .stTextArea textarea::placeholder {
-        color: #cc5500 !important;
-        opacity: 0.7;
-    }
-    .stTextInput input {
-        background-color: #1a1a1a;
-        color: #ff6600;
-        border: 2px solid #ff6600;
-        font-family: 'Courier New', monospace;
-    }
-    .stTextInput input::placeholder {
-        color: #cc5500 !important;
-        opacity: 0.7;
-    }
 
-    /* サイドバー */
-    section[data-testid="stSidebar"] {
-        background-color: #000000;
-        border-right: 3px solid #ff6600;
-    }
-    section[data-testid="stSidebar"] * {
-        color: #ff6600 !important;
-        font-family: 'Courier New', monospace;
-    }
+def render_reason_panel(container, name: str, reason: str):
+    """1ユニット分の判断理由パネルを描画"""
+    _, icon, color, _ = unit_style(name)
+    label = COUNCIL.unit(name).label
+    heading = f"{icon} {name}" + (f" - {label}" if label else "")
+    container.markdown(f"""
+<div class="magi-reason" style="border-color: {color};">
+    <div class="magi-reason-title" style="color: {color};">{heading}</div>
+    <div class="magi-reason-body">{reason}</div>
+</div>
+""", unsafe_allow_html=True)
 
-    /* タブ */
-    .stTabs [data-baseweb="tab-list"] {
-        background-color: #000000;
-        border-bottom: 2px solid #ff6600;
-    }
-    .stTabs [data-baseweb="tab"] {
-        color: #ff6600 !important;
-        border-color: #ff6600 !important;
-        font-family: 'Courier New', monospace;
-        text-transform: uppercase;
-    }
-    .stTabs [data-baseweb="tab"] p {
-        color: #ff6600 !important;
-    }
-    .stTabs [aria-selected="true"] {
-        background-color: #ff6600 !important;
-    }
-    .stTabs [aria-selected="true"] p {
-        color: #000000 !important;
-        font-weight: bold;
-    }
 
-    /* 区切り線 */
-    hr {
-        border-color: #ff6600;
-        opacity: 0.5;
-    }
+def render_vote_boxes(votes: Dict[str, str]):
+    """全ユニットのMAGIボックスを描画"""
+    for name, col in unit_columns(gap="medium"):
+        render_vote_box(col, name, votes.get(name, ""))
+
+
+def approve_reject_decision(votes: Dict[str, str]) -> str:
+    """投票結果を重み付きで集計し、最終決定のテキストを返す"""
+    decision = COUNCIL.decide(votes)
+
+    if decision.outcome == "賛成":
+        return f"✅ 最終決定: 承認 ({decision.approve}/{decision.total})"
+    elif decision.outcome == "反対":
+        return f"❌ 最終決定: 否定 ({decision.reject}/{decision.total})"
+    elif decision.outcome == "不成立":
+        return f"⛔ 最終決定: 不成立（定足数未達） (有効票 {decision.approve + decision.reject}/{decision.total})"
+    else:
+        return f"⚠️ 最終決定: 保留（同数） (承認 {decision.approve} / 否定 {decision.reject})"
+
+
+def follow_approve_reject_job(job_id: str):
+    """
+    投票中の状態を描画し、ユニットの投票が変わった時だけそのユニットのボックスを描き直す
+
+    各ボックスはフラグメントの外に作ったst.empty()に描き、フラグメントの定期的な再実行では
+    描画済みの投票と異なるユニットだけを更新する
+    """
+    placeholders = {name: col.empty() for name, col in unit_columns(gap="medium")}
+    # アプリ全体の再実行ではプレースホルダーが作り直されるため、描画済みの記録もそのたびに作り直す
+    rendered: Dict[str, str] = {}
+
+    def render_progress(job):
+        for name, placeholder in placeholders.items():
+            info = job.progress.get(name) or {}
+            vote = info.get("vote", "")
+            if rendered.get(name) != vote:
+                render_vote_box(placeholder, name, vote)
+                rendered[name] = vote
+
+    render_progress(get_job_queue().get(job_id))
+    follow_job(job_id, render_progress)
+
+
+def render_approve_reject_result(votes: Dict[str, str], reasons: Dict[str, str]):
+    """投票結果・最終決定・判断理由を描画"""
+    render_vote_boxes(votes)
+    st.markdown(
+        f'<div class="magi-decision">{approve_reject_decision(votes)}</div>',
+        unsafe_allow_html=True
+    )
+    for name, col in unit_columns(gap="medium"):
+        render_reason_panel(col, name, reasons.get(name) or "回答なし")
+
+
+def render_vote_confidence(progress: Dict):
+    """複数サンプルで投票した場合の各システムの確信度を表示"""
+    confidences = {name: info for name, info in progress.items() if "confidence" in info}
+    if not confidences:
+        return
+    for name, col in unit_columns(gap="medium"):
+        info = confidences.get(name)
+        if info:
+            tally = " / ".join(
+                f"{APPROVE_REJECT_LABELS.get(vote, vote)} {count}" for vote, count in info["tally"].items()
+            )
+            col.caption(f"確信度 {info['confidence']:.0%}（{tally}）")
+
+
+def render_deliberation_rounds(result: Dict):
+    """討論の各ラウンドの投票の推移を表示"""
+    status = "投票が安定したため終了" if result["converged"] else "最大ラウンド数に到達"
+    with st.expander(f"🗣️ 討論の経過（{len(result['rounds'])}ラウンド・{status}）"):
+        for round_result in result["rounds"]:
+            votes = " / ".join(
+                f"{name}: {APPROVE_REJECT_LABELS.get(vote, vote)}"
+                for name, vote in round_result["votes"].items()
+            )
+            st.markdown(f"**第{round_result['round']}ラウンド** — {votes}")
+
+
+def render_unit_progress(job):
+    """各モデルの処理状況を描画"""
+    icons = {"success": "✅ 完了", "error": "❌ エラー", "timeout": "⏱️ タイムアウト"}
+    with st.spinner("MAGIシステムが審議中..."):
+        for name, col in unit_columns():
+            info = job.progress.get(name)
+            col.markdown(f"**{name}**: {icons.get(info['status'], '✅ 完了') if info else '🔄 処理中'}")
+
+
+def render_analysis_progress(job):
+    """質問分析の処理状況と、届いた回答から決めた暫定のコンセンサスを描画"""
+    render_unit_progress(job)
+    provisional = job.progress.get(CONSENSUS_PROGRESS_KEY)
+    if provisional and provisional["winning_model"] != "NONE":
+        st.markdown(f"### ⏳ 暫定コンセンサス（{provisional['arrived']}/{provisional['total']}ユニットの回答）")
+        st.markdown(f"""
+            <div class="model-card consensus">
+                <div class="model-name">暫定の勝者: {provisional['winning_model']}</div>
+                <div class="model-name">一致度スコア: {provisional['agreement_score']:.2%}</div>
+                <div>{provisional['consensus']}</div>
+            </div>
+        """, unsafe_allow_html=True)
+
+
+def render_document_progress(job):
+    """長い文書の分析の処理状況（部分ごとの要点と各モデルの見解）を描画"""
+    icons = {"success": "✅ 完了", "error": "❌ エラー", "timeout": "⏱️ タイムアウト"}
+    with st.spinner("MAGIシステムが文書を読んでいます..."):
+        for name, col in unit_columns():
+            mapped = [
+                info for key, info in job.progress.items()
+                if info.get("phase") == "map" and key.endswith(f"-{name}")
+            ]
+            reduced = job.progress.get(f"reduce-{name}")
+            if reduced:
+                col.markdown(f"**{name}**: {icons.get(reduced['status'], '✅ 完了')}")
+            else:
+                col.markdown(f"**{name}**: 🔄 要点の抽出 {len(mapped)}件完了")
+
+
+def follow_job(job_id: str, render_progress: Callable):
+    """
+    実行中のジョブの進捗をフラグメントで表示
+
+    スクリプトスレッドはモデルの応答やリトライのバックオフを待たずに終了し、
+    このフラグメントだけが定期的に再実行される。ジョブが完了したらアプリ全体を再実行する
+    """
+    queue = get_job_queue()
+
+    @st.fragment(run_every=JOB_POLL_INTERVAL)
+    def _progress():
+        job = queue.get(job_id)
+        if job is None or not job.is_active:
+            st.rerun()
+        render_progress(job)
+
+    _progress()
+
+
+def show_job_failure(job) -> bool:
+    """
+    ジョブが見つからない・失敗した場合にメッセージを表示
+
+    Returns:
+        メッセージを表示した場合True
+    """
+    if job is None:
+        st.warning("ジョブが見つかりません")
+    elif job.status == "interrupted":
+        st.warning("このジョブは完了前に中断されました。再度実行してください")
+    elif job.status == "error":
+        st.error(f"エラーが発生しました: {job.error}")
+    else:
+        return False
+    return True
+
+
+def render_option_vote_result(votes: Dict[str, int]):
+    """選択肢投票の結果を表示"""
+    st.success("✅ 投票完了")
+
+    # 投票結果を表示
+    st.markdown("### 📊 投票結果")
+
+    total = COUNCIL.total_weight
+    for option, count in votes.items():
+        percentage = (count / total) * 100
+        st.progress(percentage / 100, text=f"{option}: {count}/{total}票 ({percentage:.0f}%)")
+
+    # 最多得票を表示
+    winner = max(votes.items(), key=lambda x: x[1])
+    st.markdown(f"""
+        <div class="model-card consensus">
+            <div class="model-name">🏆 最多得票: {winner[0]}</div>
+            <div>{winner[1]}/{total}票</div>
+        </div>
+    """, unsafe_allow_html=True)
 
-    /* Streamlitヘッダーとツールバーを真っ黒に */
-    header[data-testid="stHeader"] {
-        background-color: #000000 !important;
-        border-bottom: 2px solid #ff6600;
-    }
-    .stDeployButton {
-        visibility: hidden;
-    }
-    #MainMenu {
-        visibility: hidden;
-    }
-    footer {
-        visibility: hidden;
-    }
 
-    /* ツールバーボタンの色 - オレンジ */
-    header[data-testid="stHeader"] button {
-        color: #ff6600 !important;
-    }
-    header[data-testid="stHeader"] svg {
-        fill: #ff6600 !important;
-    }
-    </style>
-""", unsafe_allow_html=True)
+def render_rank_progress(job):
+    """順位付け投票・トーナメントの進捗（ラウンドごとに届いた結果の数）を描画"""
+    unit = "対戦" if job.kind == "tournament" else "件の順位"
+    with st.spinner("MAGIシステムが順位付け中..."):
+        rounds: Dict[int, int] = {}
+        for info in job.progress.values():
+            rounds[info["round"]] = rounds.get(info["round"], 0) + 1
+        if not rounds:
+            st.markdown("🔄 第1ラウンドを処理中")
+        for round_no, done in sorted(rounds.items()):
+            st.markdown(f"**第{round_no}ラウンド**: {done}{unit}が完了")
+
+
+def render_ranked_vote_result(result: Dict):
+    """順位付け投票の結果を表示"""
+    st.success("✅ 投票完了")
+
+    st.markdown("### 📊 順位付け投票の結果（ボルダ方式）")
+    st.caption(f"{result['rounds']}ラウンド・モデル呼び出し{result['calls']}回")
+
+    scores = result["scores"]
+    top_score = max(scores.values()) or 1
+    for rank, option in enumerate(result["ranking"], start=1):
+        if option in scores:
+            st.progress(scores[option] / top_score, text=f"{rank}位 {option}: {scores[option]:g}点")
+        else:
+            # 決勝ラウンドまでに敗退した選択肢
+            st.markdown(f"{rank}位 {option}（予選で敗退）")
+
+    st.markdown(f"""
+        <div class="model-card consensus">
+            <div class="model-name">🏆 1位: {result['ranking'][0]}</div>
+        </div>
+    """, unsafe_allow_html=True)
+
+    with st.expander("各システムの順位（決勝ラウンド）"):
+        for name, ballot in result["ballots"].items():
+            st.markdown(f"**{name}**: " + (" > ".join(ballot) if ballot else "順位を読み取れませんでした"))
+
+
+def render_tournament_result(result: Dict):
+    """スイス式トーナメントの結果を表示"""
+    st.success("✅ 投票完了")
+
+    st.markdown("### 📊 トーナメントの結果（スイス式）")
+    caption = (
+        f"{result['rounds']}ラウンド・{len(result['matches'])}対戦・"
+        f"モデル呼び出し{result['calls']}回（キャッシュ利用{result['cached']}対戦）"
+    )
+    if result["capped"]:
+        caption += "・呼び出し回数の上限で打ち切り"
+    st.caption(caption)
+
+    points = result["points"]
+    top_points = max(points.values()) or 1
+    for rank, candidate in enumerate(result["ranking"], start=1):
+        st.progress(points[candidate] / top_points, text=f"{rank}位 {candidate}: 勝ち点{points[candidate]:g}")
 
+    st.markdown(f"""
+        <div class="model-card consensus">
+            <div class="model-name">🏆 1位: {result['ranking'][0]}</div>
+        </div>
+    """, unsafe_allow_html=True)
+
+    with st.expander("対戦結果"):
+        for match in result["matches"]:
+            winner = match["winner"] or "引き分け"
+            votes = " / ".join(f"{name}: {vote}" for name, vote in match["votes"].items())
+            st.markdown(f"**{match['a']}** vs **{match['b']}** → {winner}（{votes}）")
+
+
+def render_analysis_result(response: MAGIResponse):
+    """質問分析の結果を表示"""
+    st.success("✅ 分析完了")
 
-def initialize_magi():
-    """MAGIシステムを初期化（環境変数から自動取得）"""
-    try:
-        # Databricks Appsでは環境変数から自動取得
-        return MAGISystem()
-    except Exception as e:
-        st.error(f"MAGIシステムの初期化に失敗しました: {str(e)}")
-        return None
+    # コンセンサス表示
+    st.markdown("### 🎯 コンセンサス結果")
+    st.markdown(f"""
+        <div class="model-card consensus">
+            <div class="model-name">勝者: {response.winning_model}</div>
+            <div class="model-name">一致度スコア: {response.agreement_score:.2%}</div>
+            <div>{response.consensus}</div>
+        </div>
+    """, unsafe_allow_html=True)
+
+    st.divider()
+
+    # 各モデルの回答を表示
+    st.markdown("### 📊 各モデルの回答")
+
+    for name, col in unit_columns():
+        _, icon, _, card_class = unit_style(name)
+        with col:
+            st.markdown(f"""
+                <div class="model-card {card_class}">
+                    <div class="model-name">{icon} {name}</div>
+                    <small>{COUNCIL.unit(name).label}</small>
+                </div>
+            """, unsafe_allow_html=True)
+            st.markdown(response.answers.get(name, "回答なし"))
+
+
+# 所要時間の内訳の区間の表示名と色
+PHASE_STYLES = {
+    timing.QUEUE: ("実行枠の待機", "#666666"),
+    timing.CACHE: ("キャッシュ", "#00cc66"),
+    timing.COALESCED: ("同一クエリの待機", "#339999"),
+    timing.RATE_LIMIT: ("レート上限の待機", "#9933cc"),
+    timing.TTFB: ("応答待ち（接続・生成）", "#ff6600"),
+    timing.DOWNLOAD: ("受信", "#ffcc00"),
+    timing.RETRY: ("リトライ", "#ff0000"),
+    timing.PARSE: ("解析", "#0080ff"),
+}
+
+# 審議の対象となる各タブのジョブ
+SESSION_JOB_KEYS = ("approve_job", "analysis_job", "option_vote_job")
+
+
+@contextmanager
+def measure_render(job_id: str):
+    """ジョブの結果の描画時間を記録（診断パネルで表示）"""
+    started = time.perf_counter()
+    yield
+    st.session_state.setdefault("render_times", {})[job_id] = time.perf_counter() - started
+
+
+def timing_bar(phase: Dict, total: float) -> str:
+    """ウォーターフォールの1区間のバー（審議全体に対する位置と幅で描く）"""
+    label, color = PHASE_STYLES.get(phase["phase"], (phase["phase"], "#999999"))
+    duration = phase["end"] - phase["start"]
+    return (
+        f'<div title="{label}: {duration * 1000:.0f}ms" style="position:absolute; '
+        f'left:{phase["start"] / total * 100:.2f}%; width:{max(duration / total * 100, 0.5):.2f}%; '
+        f'height:100%; background:{color};"></div>'
+    )
+
+
+def render_timing_panel(queue):
+    """サイドバーに直近の審議の所要時間の内訳（モデル呼び出しごとのウォーターフォール）を表示"""
+    jobs = [queue.get(st.session_state[key]) for key in SESSION_JOB_KEYS if st.session_state.get(key)]
+    traced = [job for job in jobs if job is not None and job.trace]
+
+    with st.sidebar.expander("診断: 所要時間の内訳", expanded=True):
+        if not traced:
+            st.caption("計測した審議はまだありません（診断パネルを有効にした後に投入した審議が対象です）")
+            return
+        job = max(traced, key=lambda j: j.created_at)
+        if job.timings is None:
+            st.caption("審議の完了後に表示します")
+            return
+
+        total = max(job.timings["total"], 1e-6)
+        rows = []
+        for call in job.timings["calls"]:
+            phases = call["phases"]
+            elapsed = max((p["end"] for p in phases), default=0) - min((p["start"] for p in phases), default=0)
+            bars = "".join(timing_bar(p, total) for p in phases)
+            rows.append(
+                f'<div style="font-size:0.75em; margin-top:4px;">{call["label"]} ({elapsed:.2f}s)</div>'
+                f'<div style="position:relative; height:10px; background:#1a1a1a;">{bars}</div>'
+            )
+        legend = " ".join(
+            f'<span style="color:{color};">■</span>{label}' for label, color in PHASE_STYLES.values()
+        )
+        st.markdown(
+            f"**{job.kind}** 全体 {job.timings['total']:.2f}s / 呼び出し {len(job.timings['calls'])}回"
+            + "".join(rows)
+            + f'<div style="font-size:0.7em; margin-top:8px;">{legend}</div>',
+            unsafe_allow_html=True
+        )
+
+        render_time = st.session_state.get("render_times", {}).get(job.job_id)
+        if render_time is not None:
+            st.caption(f"描画: {render_time * 1000:.0f}ms")
+
+        # 送信前の入力トークン数の見積もりと実際（プロセス全体の累計）
+        tokens = queue.magi.client.token_budget.stats()
+        if tokens:
+            st.markdown("**入力トークン（見積もり / 実際）**")
+            for model_id, stats in tokens.items():
+                adjusted = "".join([
+                    f"・詰めた入力 {stats['trimmed']}件" if stats["trimmed"] else "",
+                    f"・max_tokens調整 {stats['clamped']}件" if stats["clamped"] else "",
+                ])
+                st.caption(
+                    f"{model_id}: {stats['estimated_input_tokens']:,} / {stats['actual_input_tokens']:,}"
+                    f"（誤差 {stats['estimate_error']:+.1%}）{adjusted}"
+                )
+
+
+def render_warmup_status(warmup: Warmup):
+    """サイドバーにウォームアップの状況を表示"""
+    stats = warmup.stats()
+    with st.sidebar.expander("ウォームアップ"):
+        for model_id, value in stats["connections"].items():
+            st.markdown(f"- {model_id}: " + (f"接続 {value * 1000:.0f}ms" if isinstance(value, float) else value))
+        state = "完了" if stats["finished"] and stats["ready"] == stats["prefetched"] else "実行中"
+        st.caption(f"{state} - サンプルの事前審議 {stats['ready']}/{stats['prefetched']}件（{stats['calls']}回の呼び出し）")
 
 
 def main():
@@ -432,20 +532,41 @@ def main():
     # サイドバー設定
     with st.sidebar:
         st.header("MAGI SYSTEM INFO")
-        st.markdown("""
-        **MAGI SYSTEM** - Multiple AI General Intelligence
+        units = "\n".join(
+            f"- **{unit_style(unit.name)[0]}** {unit.label}" + (f" ×{unit.weight}" if unit.weight != 1 else "")
+            for unit in COUNCIL.units
+        )
+        st.markdown(f"""
+**MAGI SYSTEM** - Multiple AI General Intelligence
 
-        3つの異なるAIモデルによる多数決型意思決定システム
+{len(COUNCIL.units)}つの異なるAIモデルによる多数決型意思決定システム
 
-        **3 SYSTEMS:**
-        - **MELCHIOR-1** (GPT-5) - SCIENTIST
-        - **BALTHASAR-2** (Claude Opus 4.1) - MOTHER
-        - **CASPER-3** (Gemini 2.5 Pro) - WOMAN
-        """)
+**{len(COUNCIL.units)} SYSTEMS:**
+{units}
+""")
 
     # デフォルトのtemperature値
     temperature = 0.7
 
+    # 審議はすべてプロセス共有のジョブキューで実行する
+    queue = get_job_queue()
+    warmup = start_warmup(temperature)
+    if warmup is not None:
+        render_warmup_status(warmup)
+
+    # モデル呼び出しはブラウザのセッションごとに公平に順番が回るよう、セッションにIDを振る
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    session = st.session_state.session_id
+
+    # 診断パネル（有効にした後に投入した審議の所要時間の内訳を表示）
+    diagnostics = st.sidebar.toggle(
+        "診断パネル",
+        key="diagnostics",
+        help="次の審議から、各モデル呼び出しの待機・応答待ち・受信・リトライ・解析の所要時間を計測して表示します"
+    )
+    job_options = {"session": session, "trace": diagnostics}
+
     # メインコンテンツ
 
     # タブ作成
@@ -453,37 +574,15 @@ def main():
 
     with tab1:
         st.header("提案の承認/却下")
-        st.markdown("提案を入力すると、3つのMAGIシステムが承認/否定を投票し、多数決で決定します")
+        st.markdown(f"提案を入力すると、{len(COUNCIL.units)}つのMAGIシステムが承認/否定を投票し、多数決で決定します")
 
         # サンプル提案ボタン
         st.subheader("💡 サンプル提案")
-        sample_col1, sample_col2, sample_col3 = st.columns(3)
-
-        with sample_col1:
-            if st.button("💼 リモートワーク全面導入", use_container_width=True):
-                st.session_state.proposal = "全社員を対象にリモートワークを全面導入すべきか？"
-
-        with sample_col2:
-            if st.button("🤖 AI採用選考導入", use_container_width=True):
-                st.session_state.proposal = "採用選考プロセスにAIによる一次スクリーニングを導入すべきか？"
-
-        with sample_col3:
-            if st.button("📅 週休3日制導入", use_container_width=True):
-                st.session_state.proposal = "従業員の生産性向上のため、週休3日制を試験的に導入すべきか？"
-
-        sample_col4, sample_col5, sample_col6 = st.columns(3)
-
-        with sample_col4:
-            if st.button("🌱 完全ペーパーレス化", use_container_width=True):
-                st.session_state.proposal = "環境保護のため、社内の紙資料を完全に廃止しペーパーレス化すべきか？"
-
-        with sample_col5:
-            if st.button("🎓 社内教育プログラム必須化", use_container_width=True):
-                st.session_state.proposal = "全社員に対して月10時間以上の社内教育プログラム受講を必須化すべきか？"
-
-        with sample_col6:
-            if st.button("💰 成果報酬制度導入", use_container_width=True):
-                st.session_state.proposal = "固定給与の一部を成果報酬型に変更し、個人の業績に応じた報酬体系を導入すべきか？"
+        for row in (SAMPLE_PROPOSALS[:3], SAMPLE_PROPOSALS[3:]):
+            for col, sample in zip(st.columns(3), row):
+                with col:
+                    if st.button(sample.label, use_container_width=True, key=sample.key):
+                        st.session_state.proposal = sample.text
 
         st.divider()
 
@@ -500,237 +599,62 @@ def main():
         col1, col2, col3 = st.columns([1, 1, 2])
         with col1:
             vote_button = st.button("⚖️ 投票開始", type="primary", use_container_width=True)
+        with col2:
+            rounds = st.number_input(
+                "討論ラウンド数",
+                min_value=1,
+                max_value=5,
+                value=1,
+                help="2以上にすると、各システムが他のシステムの立場を見て投票を見直します（投票が安定した時点で終了）"
+            )
+        with col3:
+            samples = st.number_input(
+                "サンプル数（各システム）",
+                min_value=1,
+                max_value=9,
+                value=1,
+                step=2,
+                # 討論は各ラウンドで1回ずつ問い合わせるため、サンプル数は指定できない
+                disabled=rounds > 1,
+                help="各システムから複数の回答を並列に取得し、多数決で投票を決めます（過半数が確定した時点で打ち切り）。"
+                     "討論（ラウンド数2以上）では使用できません"
+            )
 
         if vote_button and proposal:
-            magi = initialize_magi()
-            if magi is None:
-                return
-
-            # MAGIボックスをプレースホルダーで管理
-            magi_container = st.empty()
-
-            # MAGIボックスを描画する関数
-            def render_magi_boxes(balthasar_vote, casper_vote, melchior_vote, show_decision=False, decision_text="", melchior_reason="", balthasar_reason="", casper_reason=""):
-                # 投票結果に応じてステータステキストを決定
-                def get_status_text(vote):
-                    if vote == "承認" or vote == "否定":
-                        return vote
-                    else:
-                        return '投票中...'
-
-                # 投票結果に応じて背景色とテキスト色を決定
-                def get_box_style(vote):
-                    if vote == "承認":
-                        return "background: #0099cc; border-color: #00ccff; box-shadow: 0 0 40px rgba(0, 204, 255, 0.8);", "#000000"
-                    elif vote == "否定":
-                        return "background: #cc0000; border-color: #ff0000; box-shadow: 0 0 40px rgba(255, 0, 0, 0.8);", "#000000"
-                    else:
-                        return "background: #555555; border-color: #888888; box-shadow: 0 0 40px rgba(136, 136, 136, 0.5); opacity: 0.6;", "#ffffff"
-
-                melchior_style, melchior_color = get_box_style(melchior_vote)
-                balthasar_style, balthasar_color = get_box_style(balthasar_vote)
-                casper_style, casper_color = get_box_style(casper_vote)
-
-                melchior_status = get_status_text(melchior_vote)
-                balthasar_status = get_status_text(balthasar_vote)
-                casper_status = get_status_text(casper_vote)
-
-                decision_html = ""
-                if show_decision:
-                    decision_html = f'<div style="text-align: center; margin-top: 2rem; font-size: 1.5em; color: #ff6600; font-weight: bold;">{decision_text}</div>'
-
-                # 判断理由のHTML
-                reason_html = ""
-                if melchior_reason or balthasar_reason or casper_reason:
-                    reason_html = f"""
-<div style="display: flex; gap: 1.5rem; justify-content: space-between; width: 100%; margin-top: 2rem;">
-    <div style="flex: 1; background: #1a1a1a; border: 2px solid #ff0000; padding: 1rem; font-size: 0.85em;">
-        <div style="color: #ff0000; font-weight: bold; margin-bottom: 0.5rem;">🔴 MELCHIOR (GPT-5)</div>
-        <div style="color: #ff6600;">{melchior_reason}</div>
-    </div>
-    <div style="flex: 1; background: #1a1a1a; border: 2px solid #0080ff; padding: 1rem; font-size: 0.85em;">
-        <div style="color: #0080ff; font-weight: bold; margin-bottom: 0.5rem;">🔵 BALTHASAR (Claude Opus 4)</div>
-        <div style="color: #ff6600;">{balthasar_reason}</div>
-    </div>
-    <div style="flex: 1; background: #1a1a1a; border: 2px solid #ffff00; padding: 1rem; font-size: 0.85em;">
-        <div style="color: #ffff00; font-weight: bold; margin-bottom: 0.5rem;">🟡 CASPER (Gemini 2.5 Pro)</div>
-        <div style="color: #ff6600;">{casper_reason}</div>
-    </div>
-</div>
-"""
-
-                with magi_container.container():
-                    st.markdown(f"""
-<div style="display: flex; gap: 1.5rem; justify-content: space-between; width: 100%; margin: 2rem 0;">
-    <div style="flex: 1; display: flex; flex-direction: column; align-items: center; justify-content: center; font-family: 'Courier New', monospace; font-weight: bold; border: 4px solid; padding: 2rem; min-height: 200px; clip-path: polygon(10% 0%, 90% 0%, 100% 10%, 100% 90%, 90% 100%, 10% 100%, 0% 90%, 0% 10%); {melchior_style}">
-        <div style="font-size: 1.0em; margin-bottom: 0.5rem; letter-spacing: 0.05em; white-space: nowrap; color: {melchior_color};">MELCHIOR-1</div>
-        <div style="font-size: 1.5em; margin-top: 0.5rem; color: {melchior_color};">{melchior_status}</div>
-    </div>
-    <div style="flex: 1; display: flex; flex-direction: column; align-items: center; justify-content: center; font-family: 'Courier New', monospace; font-weight: bold; border: 4px solid; padding: 2rem; min-height: 200px; clip-path: polygon(10% 0%, 90% 0%, 100% 10%, 100% 90%, 90% 100%, 10% 100%, 0% 90%, 0% 10%); {balthasar_style}">
-        <div style="font-size: 1.0em; margin-bottom: 0.5rem; letter-spacing: 0.05em; white-space: nowrap; color: {balthasar_color};">BALTHASAR-2</div>
-        <div style="font-size: 1.5em; margin-top: 0.5rem; color: {balthasar_color};">{balthasar_status}</div>
-    </div>
-    <div style="flex: 1; display: flex; flex-direction: column; align-items: center; justify-content: center; font-family: 'Courier New', monospace; font-weight: bold; border: 4px solid; padding: 2rem; min-height: 200px; clip-path: polygon(10% 0%, 90% 0%, 100% 10%, 100% 90%, 90% 100%, 10% 100%, 0% 90%, 0% 10%); {casper_style}">
-        <div style="font-size: 1.0em; margin-bottom: 0.5rem; letter-spacing: 0.05em; white-space: nowrap; color: {casper_color};">CASPER-3</div>
-        <div style="font-size: 1.5em; margin-top: 0.5rem; color: {casper_color};">{casper_status}</div>
-    </div>
-</div>
-{decision_html}
-{reason_html}
-                    """, unsafe_allow_html=True)
-
-            # 初期状態のMAGIボックスを表示
-            render_magi_boxes("", "", "")
-
-            try:
-                # 承認/否定投票用のプロンプトを作成
-                voting_prompt = f"""{proposal}
-
-この提案について、あなたの人格（科学者/母/女性）の観点から判断してください。
-
-回答は以下の形式で必ず記載してください：
-【投票】承認 または 【投票】否定
-
-その後に、判断の理由を詳しく説明してください。"""
-
-                # 3つのモデルに並列で投票させる
-                results = {}
-                votes = {}
-                reasons = {}
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                    futures = {
-                        executor.submit(
-                            magi.query_model,
-                            name,
-                            magi.models[name],
-                            voting_prompt,
-                            temperature
-                        ): name
-                        for name in magi.models.keys()
-                    }
-
-                    # 完了したものから順次処理し、リアルタイムで更新
-                    try:
-                        for future in concurrent.futures.as_completed(futures, timeout=180):
-                            try:
-                                model_name, answer, status = future.result()
-                                results[model_name] = {"answer": answer, "status": status}
-
-                                # 承認/否定を抽出
-                                if "【投票】承認" in answer or "承認" in answer[:100]:
-                                    vote_result = "承認"
-                                    votes[model_name] = "承認"
-                                elif "【投票】否定" in answer or "否定" in answer[:100]:
-                                    vote_result = "否定"
-                                    votes[model_name] = "否定"
-                                else:
-                                    vote_result = "不明"
-                                    votes[model_name] = "不明"
-
-                                reasons[model_name] = answer
-
-                                # 投票が完了するたびにMAGIボックスを更新
-                                balthasar_vote = votes.get("BALTHASAR", "")
-                                casper_vote = votes.get("CASPER", "")
-                                melchior_vote = votes.get("MELCHIOR", "")
-                                render_magi_boxes(balthasar_vote, casper_vote, melchior_vote)
-
-                            except Exception as e:
-                                model_name = futures[future]
-                                results[model_name] = {"answer": f"エラー: {str(e)}", "status": "error"}
-                                votes[model_name] = "不明"
-                                reasons[model_name] = f"エラー: {str(e)}"
-
-                                # エラー時も更新
-                                balthasar_vote = votes.get("BALTHASAR", "")
-                                casper_vote = votes.get("CASPER", "")
-                                melchior_vote = votes.get("MELCHIOR", "")
-                                render_magi_boxes(balthasar_vote, casper_vote, melchior_vote)
-
-                    except concurrent.futures.TimeoutError:
-                        for future, model_name in futures.items():
-                            if model_name not in results:
-                                results[model_name] = {"answer": "タイムアウト: 応答時間を超過しました", "status": "timeout"}
-                                votes[model_name] = "不明"
-                                reasons[model_name] = "タイムアウト: 応答時間を超過しました"
-
-                # すべての投票が完了
-                import time
-                time.sleep(0.5)
-
-                # 投票結果を集計
-                approve_count = sum(1 for v in votes.values() if v == "承認")
-                reject_count = sum(1 for v in votes.values() if v == "否定")
-                unknown_count = sum(1 for v in votes.values() if v == "不明")
-
-                # 決定結果
-                if approve_count > reject_count:
-                    decision = "承認"
-                    decision_icon = "✅"
-                    decision_text = f"{decision_icon} 最終決定: {decision} ({approve_count}/3)"
-                elif reject_count > approve_count:
-                    decision = "否定"
-                    decision_icon = "❌"
-                    decision_text = f"{decision_icon} 最終決定: {decision} ({reject_count}/3)"
-                else:
-                    decision = "保留（同数）"
-                    decision_icon = "⚠️"
-                    decision_text = f"{decision_icon} 最終決定: {decision} (承認 {approve_count} / 否定 {reject_count})"
-
-                # 最終決定をMAGIボックスと同じコンテナに表示
-                balthasar_vote = votes.get("BALTHASAR", "不明")
-                casper_vote = votes.get("CASPER", "不明")
-                melchior_vote = votes.get("MELCHIOR", "不明")
-
-                melchior_reason = reasons.get("MELCHIOR", "回答なし")
-                balthasar_reason = reasons.get("BALTHASAR", "回答なし")
-                casper_reason = reasons.get("CASPER", "回答なし")
-
-                render_magi_boxes(
-                    balthasar_vote, casper_vote, melchior_vote,
-                    show_decision=True, decision_text=decision_text,
-                    melchior_reason=melchior_reason,
-                    balthasar_reason=balthasar_reason,
-                    casper_reason=casper_reason
+            # 投票はバックグラウンドのワーカーで実行し、スクリプトスレッドは待機しない
+            if rounds > 1:
+                st.session_state.approve_job = queue.submit(
+                    "deliberate", **job_options, proposal=proposal, rounds=int(rounds), temperature=temperature
+                )
+            else:
+                st.session_state.approve_job = queue.submit(
+                    "vote_approve_reject", **job_options, proposal=proposal, temperature=temperature,
+                    samples=int(samples)
                 )
 
-            except Exception as e:
-                st.error(f"エラーが発生しました: {str(e)}")
+        approve_job = st.session_state.get("approve_job")
+        if approve_job:
+            job = queue.get(approve_job)
+            if job is not None and job.is_active:
+                follow_approve_reject_job(approve_job)
+            elif not show_job_failure(job):
+                with measure_render(approve_job):
+                    render_approve_reject_result(job.result["votes"], job.result["reasons"])
+                    render_vote_confidence(job.progress)
+                    if "rounds" in job.result:
+                        render_deliberation_rounds(job.result)
 
     with tab2:
         st.header("質問分析モード")
-        st.markdown("質問を入力すると、3つの異なる視点から回答を分析します")
+        st.markdown(f"質問を入力すると、{len(COUNCIL.units)}つの異なる視点から回答を分析します")
 
         # サンプル質問ボタン
         st.subheader("💡 サンプル質問")
-        analysis_sample_col1, analysis_sample_col2, analysis_sample_col3 = st.columns(3)
-
-        with analysis_sample_col1:
-            if st.button("🤖 AIの未来", use_container_width=True, key="analysis_ai"):
-                st.session_state.analysis_q = "人工知能の未来について、技術的・社会的観点から分析してください"
-
-        with analysis_sample_col2:
-            if st.button("🌍 気候変動", use_container_width=True, key="analysis_climate"):
-                st.session_state.analysis_q = "気候変動に対する最も効果的な対策は何ですか？"
-
-        with analysis_sample_col3:
-            if st.button("💼 リモートワーク", use_container_width=True, key="analysis_remote"):
-                st.session_state.analysis_q = "リモートワークとオフィスワークのそれぞれの利点と欠点を比較してください"
-
-        analysis_sample_col4, analysis_sample_col5, analysis_sample_col6 = st.columns(3)
-
-        with analysis_sample_col4:
-            if st.button("🏥 医療とテクノロジー", use_container_width=True, key="analysis_health"):
-                st.session_state.analysis_q = "AIやIoT技術が医療業界にもたらす革新について教えてください"
-
-        with analysis_sample_col5:
-            if st.button("📚 教育改革", use_container_width=True, key="analysis_education"):
-                st.session_state.analysis_q = "現代の教育システムが抱える課題と、その解決策について論じてください"
-
-        with analysis_sample_col6:
-            if st.button("🚀 宇宙開発", use_container_width=True, key="analysis_space"):
-                st.session_state.analysis_q = "民間企業による宇宙開発が人類にもたらす影響について分析してください"
+        for row in (SAMPLE_QUESTIONS[:3], SAMPLE_QUESTIONS[3:]):
+            for col, sample in zip(st.columns(3), row):
+                with col:
+                    if st.button(sample.label, use_container_width=True, key=sample.key):
+                        st.session_state.analysis_q = sample.text
 
         st.divider()
 
@@ -744,123 +668,65 @@ def main():
             key="analysis_question_input"
         )
 
+        # 長い文書の添付（分割して読み、変更のない部分の要点はキャッシュを再利用する）
+        with st.expander("📎 長い文書を添付"):
+            analysis_document = st.text_area(
+                "文書",
+                height=200,
+                placeholder="規程や提案書などの本文を貼り付けてください",
+                key="analysis_document_input"
+            )
+            uploaded = st.file_uploader("またはテキストファイル", type=["txt", "md"], key="analysis_document_file")
+            if uploaded is not None:
+                analysis_document = uploaded.getvalue().decode("utf-8")
+
         analyze_button = st.button("🚀 分析開始", type="primary", use_container_width=True, key="analyze_btn")
 
         if analyze_button and analysis_question:
-            magi = initialize_magi()
-            if magi is None:
-                return
-
-            with st.spinner("MAGIシステムが分析中..."):
-                try:
-                    response = magi.analyze(analysis_question, temperature=temperature)
-
-                    st.success("✅ 分析完了")
-
-                    # コンセンサス表示
-                    st.markdown("### 🎯 コンセンサス結果")
-                    st.markdown(f"""
-                        <div class="model-card consensus">
-                            <div class="model-name">勝者: {response.winning_model}</div>
-                            <div class="model-name">一致度スコア: {response.agreement_score:.2%}</div>
-                            <div>{response.consensus}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-
-                    st.divider()
-
-                    # 各モデルの回答を表示
-                    st.markdown("### 📊 各モデルの回答")
-
-                    col1, col2, col3 = st.columns(3)
-
-                    with col1:
-                        st.markdown(f"""
-                            <div class="model-card melchior">
-                                <div class="model-name">🔴 MELCHIOR</div>
-                                <small>GPT-5 (科学者)</small>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        st.markdown(response.melchior)
-
-                    with col2:
-                        st.markdown(f"""
-                            <div class="model-card balthasar">
-                                <div class="model-name">🔵 BALTHASAR</div>
-                                <small>Claude Opus 4 (母)</small>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        st.markdown(response.balthasar)
-
-                    with col3:
-                        st.markdown(f"""
-                            <div class="model-card casper">
-                                <div class="model-name">🟡 CASPER</div>
-                                <small>Gemini 2.5 Pro (女性)</small>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        st.markdown(response.casper)
-
-                except Exception as e:
-                    st.error(f"エラーが発生しました: {str(e)}")
+            # 審議はバックグラウンドで実行し、ジョブIDをURLに残して再接続できるようにする
+            if analysis_document.strip():
+                job_id = queue.submit(
+                    "analyze_document", **job_options,
+                    question=analysis_question, document=analysis_document, temperature=temperature
+                )
+            else:
+                job_id = queue.submit("analyze", **job_options, question=analysis_question, temperature=temperature)
+            st.session_state.analysis_job = job_id
+            st.query_params["job"] = job_id
+
+        # 実行中・完了済みのジョブに再接続（リロード後や別セッションからも可能）
+        job_id = st.session_state.get("analysis_job") or st.query_params.get("job")
+        if job_id:
+            st.caption(f"ジョブID: `{job_id}`（このURLを開けば別のセッションからも結果を参照できます）")
+
+            job = queue.get(job_id)
+            if job is not None and job.is_active:
+                follow_job(
+                    job_id, render_document_progress if job.kind == "analyze_document" else render_analysis_progress
+                )
+            elif not show_job_failure(job):
+                with measure_render(job_id):
+                    if job.kind == "analyze_document":
+                        st.caption(
+                            f"📎 文書を{job.result['chunks']}個に分割して分析"
+                            f"（要点のキャッシュ再利用: {job.result['cached']}件・モデル呼び出し: {job.result['calls']}回）"
+                        )
+                        render_analysis_result(MAGIResponse.from_dict(job.result["response"]))
+                    else:
+                        render_analysis_result(MAGIResponse.from_dict(job.result))
 
     with tab3:
         st.header("選択肢投票システム")
-        st.markdown("質問と選択肢を入力すると、3つのモデルが投票します")
+        st.markdown(f"質問と選択肢を入力すると、{len(COUNCIL.units)}つのモデルが投票します")
 
         # サンプル投票ボタン
         st.subheader("💡 サンプル投票")
-        vote_sample_col1, vote_sample_col2, vote_sample_col3 = st.columns(3)
-
-        with vote_sample_col1:
-            if st.button("💻 技術選定", use_container_width=True, key="sample_tech"):
-                st.session_state.vote_q = "次のWebプロジェクトで使うべきフレームワークは？"
-                st.session_state.vote_opt1 = "React"
-                st.session_state.vote_opt2 = "Vue.js"
-                st.session_state.vote_opt3 = "Angular"
-                st.session_state.vote_opt4 = "Svelte"
-
-        with vote_sample_col2:
-            if st.button("🍕 ランチ選び", use_container_width=True, key="sample_lunch"):
-                st.session_state.vote_q = "チームランチで行くべきお店は？"
-                st.session_state.vote_opt1 = "イタリアン"
-                st.session_state.vote_opt2 = "和食"
-                st.session_state.vote_opt3 = "中華"
-                st.session_state.vote_opt4 = "カフェ"
-
-        with vote_sample_col3:
-            if st.button("📚 学習言語", use_container_width=True, key="sample_lang"):
-                st.session_state.vote_q = "プログラミング初心者が最初に学ぶべき言語は？"
-                st.session_state.vote_opt1 = "Python"
-                st.session_state.vote_opt2 = "JavaScript"
-                st.session_state.vote_opt3 = "Java"
-                st.session_state.vote_opt4 = "Go"
-
-        vote_sample_col4, vote_sample_col5, vote_sample_col6 = st.columns(3)
-
-        with vote_sample_col4:
-            if st.button("☁️ クラウド選定", use_container_width=True, key="sample_cloud"):
-                st.session_state.vote_q = "新規プロジェクトで使うべきクラウドプラットフォームは？"
-                st.session_state.vote_opt1 = "AWS"
-                st.session_state.vote_opt2 = "Azure"
-                st.session_state.vote_opt3 = "GCP"
-                st.session_state.vote_opt4 = "Oracle Cloud"
-
-        with vote_sample_col5:
-            if st.button("🎬 週末の過ごし方", use_container_width=True, key="sample_weekend"):
-                st.session_state.vote_q = "今週末のチームビルディングで何をすべき？"
-                st.session_state.vote_opt1 = "映画鑑賞"
-                st.session_state.vote_opt2 = "スポーツ"
-                st.session_state.vote_opt3 = "BBQ"
-                st.session_state.vote_opt4 = "ボードゲーム"
-
-        with vote_sample_col6:
-            if st.button("🗄️ データベース選定", use_container_width=True, key="sample_db"):
-                st.session_state.vote_q = "新しいアプリケーションで使うべきデータベースは？"
-                st.session_state.vote_opt1 = "PostgreSQL"
-                st.session_state.vote_opt2 = "MongoDB"
-                st.session_state.vote_opt3 = "MySQL"
-                st.session_state.vote_opt4 = "Redis"
+        for row in (SAMPLE_VOTES[:3], SAMPLE_VOTES[3:]):
+            for col, sample in zip(st.columns(3), row):
+                with col:
+                    if st.button(sample.label, use_container_width=True, key=sample.key):
+                        st.session_state.vote_q = sample.text
+                        st.session_state.vote_opts = "\n".join(sample.options)
 
         st.divider()
 
@@ -872,49 +738,94 @@ def main():
             key="vote_question"
         )
 
-        st.markdown("**選択肢（1つずつ入力）**")
-        option1 = st.text_input("選択肢 1", value=st.session_state.get('vote_opt1', ''), placeholder="例: React", key="opt1")
-        option2 = st.text_input("選択肢 2", value=st.session_state.get('vote_opt2', ''), placeholder="例: Vue.js", key="opt2")
-        option3 = st.text_input("選択肢 3", value=st.session_state.get('vote_opt3', ''), placeholder="例: Angular", key="opt3")
-        option4 = st.text_input("選択肢 4（オプション）", value=st.session_state.get('vote_opt4', ''), placeholder="例: Svelte", key="opt4")
+        options_text = st.text_area(
+            "選択肢（1行に1つ、個数の上限なし）",
+            value=st.session_state.get('vote_opts', ''),
+            height=150,
+            placeholder="例:\nReact\nVue.js\nAngular\nSvelte",
+            key="vote_options"
+        )
+
+        vote_mode = st.radio(
+            "投票方式",
+            ["単一選択", "順位付け（ボルダ方式）", "1対1の比較（スイス式トーナメント）"],
+            horizontal=True,
+            help=(
+                f"順位付けでは選択肢が{RANK_BATCH_SIZE}個を超えると、グループごとの勝ち抜き方式で絞り込みます。"
+                "1対1の比較は選択肢が多い場合や、選択肢の説明が長い場合に向いています"
+            )
+        )
 
         vote_button = st.button("🗳️ 投票開始", type="primary")
 
         if vote_button and vote_question:
-            options = [opt for opt in [option1, option2, option3, option4] if opt]
+            options = list(dict.fromkeys(line.strip() for line in options_text.splitlines() if line.strip()))
 
             if len(options) < 2:
                 st.error("最低2つの選択肢が必要です")
+            elif vote_mode == "単一選択":
+                st.session_state.option_vote_job = queue.submit(
+                    "vote", **job_options, question=vote_question, options=options, temperature=temperature
+                )
+            elif vote_mode == "順位付け（ボルダ方式）":
+                st.session_state.option_vote_job = queue.submit(
+                    "rank", **job_options, question=vote_question, options=options, temperature=temperature,
+                    batch_size=RANK_BATCH_SIZE
+                )
             else:
-                magi = initialize_magi()
-                if magi is None:
-                    return
-
-                with st.spinner("MAGIシステムが投票中..."):
-                    try:
-                        votes = magi.vote(vote_question, options, temperature=temperature)
-
-                        st.success("✅ 投票完了")
-
-                        # 投票結果を表示
-                        st.markdown("### 📊 投票結果")
-
-                        for option, count in votes.items():
-                            percentage = (count / 3) * 100
-                            st.progress(percentage / 100, text=f"{option}: {count}/3票 ({percentage:.0f}%)")
+                st.session_state.option_vote_job = queue.submit(
+                    "tournament", **job_options, question=vote_question, candidates=options,
+                    temperature=temperature, max_calls=TOURNAMENT_MAX_CALLS
+                )
 
-                        # 最多得票を表示
-                        winner = max(votes.items(), key=lambda x: x[1])
-                        st.markdown(f"""
-                            <div class="model-card consensus">
-                                <div class="model-name">🏆 最多得票: {winner[0]}</div>
-                                <div>{winner[1]}/3票</div>
-                            </div>
-                        """, unsafe_allow_html=True)
+        option_vote_job = st.session_state.get("option_vote_job")
+        if option_vote_job:
+            job = queue.get(option_vote_job)
+            if job is not None and job.is_active:
+                follow_job(
+                    option_vote_job,
+                    render_rank_progress if job.kind in ("rank", "tournament") else render_unit_progress
+                )
+            elif not show_job_failure(job):
+                with measure_render(option_vote_job):
+                    if job.kind == "rank":
+                        render_ranked_vote_result(job.result)
+                    elif job.kind == "tournament":
+                        render_tournament_result(job.result)
+                    else:
+                        render_option_vote_result(job.result["votes"])
+
+    if diagnostics:
+        render_timing_panel(queue)
+
+
+def report_timings(rendered: float):
+    """
+    実行の所要時間を記録し、サイドバーに表示する
+
+    プロセスで最初の実行はコールドスタートとして保持し、標準エラーにも出力する
+    """
+    timings = {
+        "imports": _IMPORTED - _RUN_STARTED,
+        "setup": _SET_UP - _IMPORTED,
+        "render": rendered - _SET_UP,
+        "total": rendered - _RUN_STARTED,
+    }
+    cold_start = startup_report()
+    if not cold_start:
+        cold_start.update(timings)
+        print(
+            "MAGI cold start: " + ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()),
+            file=sys.stderr
+        )
 
-                    except Exception as e:
-                        st.error(f"エラーが発生しました: {str(e)}")
+    with st.sidebar.expander("起動時間"):
+        st.markdown("\n".join(
+            f"- {name}: コールドスタート {cold_start[name] * 1000:.0f}ms / 今回 {timings[name] * 1000:.0f}ms"
+            for name in timings
+        ))
 
 
 if __name__ == "__main__":
     main()
+    report_timings(time.perf_counter())
@@ -0,0 +1,293 @@
+"""
+MAGI System - JSONLバッチランナー
+大量の提案・質問をオフラインで審議し、結果をJSONLに逐次書き出す
+
+使い方:
+    python batch_runner.py proposals.jsonl results.jsonl --concurrency 4
+
+入力の各行はJSONオブジェクトで、以下のいずれかのキーを持つ:
+    {"id": "...", "proposal": "..."}                  -> 賛成/反対投票
+    {"id": "...", "question": "...", "options": [...]} -> 選択肢投票（--kind rank / tournamentで順位付け）
+    {"id": "...", "question": "...", "document": "..."} -> 長い文書を踏まえた質問分析
+    {"id": "...", "question": "..."}                  -> 質問分析
+idがない場合は request_id、それもなければ行番号をIDとして使う（解析できない行は行番号をIDとしてエラーを記録する）
+
+出力ファイルがチェックポイントを兼ねており、再実行時は出力済みのIDをスキップする（過半数のユニットが有効な回答を返さなかった件はエラーとして記録し、再実行時に審議し直す）
+モデル呼び出しはスケジューラーのbatchレーンで実行し、同じプロセスの対話的な審議を待たせない
+"""
+import sys
+import json
+import time
+import argparse
+import concurrent.futures
+from dataclasses import asdict
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from document_analysis import DocumentAnalyzer
+from consensus import is_valid_answer
+from magi_system import MAGISystem
+from response_cache import ResponseCache
+from scheduler import BATCH, scheduling, submit_in_context
+from shared_state import get_shared_state
+from tournament import Tournament
+from vote_parser import UNKNOWN
+
+# スケジューラーでバッチ全体をまとめて扱うセッション名
+BATCH_SESSION = "batch"
+
+
+def iter_records(input_path: str) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """
+    入力JSONLを1行ずつ読み込む（ファイル全体はメモリに載せない）
+
+    Yields:
+        (ID, レコード, エラー) 解析できない行はレコードがNoneで、行番号をIDとしてエラーを返す
+    """
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield str(line_no), None, f"{line_no}行目のJSONを解析できません: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield str(line_no), None, f"{line_no}行目がJSONオブジェクトではありません"
+                continue
+            item_id = str(record.get("id") or record.get("request_id") or line_no)
+            yield item_id, record, None
+
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """
+    出力済みのIDを読み込む（クラッシュ時に書きかけだった最終行は無視する）
+
+    Args:
+        output_path: 出力JSONLファイル
+
+    Returns:
+        完了済みIDの集合
+    """
+    completed = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("error") is None:
+                    completed.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def detect_kind(record: Dict, default_kind: Optional[str] = None) -> str:
+    """レコードの内容から審議の種類を判定"""
+    if record.get("kind"):
+        return record["kind"]
+    if default_kind:
+        return default_kind
+    if "proposal" in record:
+        return "vote_approve_reject"
+    if "options" in record:
+        return "vote"
+    if "document" in record:
+        return "analyze_document"
+    return "analyze"
+
+
+def answered_share(magi: MAGISystem, kind: str, result: Dict) -> float:
+    """
+    有効な回答（判別できた投票）を返したユニットの重みが全体に占める割合
+
+    Args:
+        magi: MAGISystem
+        kind: 審議の種類
+        result: process_recordの結果
+
+    Returns:
+        0.0〜1.0
+    """
+    weights = {unit.name: unit.weight for unit in magi.council.units}
+    total = sum(weights.values())
+    if kind == "vote_approve_reject":
+        answered = {name for name, vote in result["votes"].items() if vote != UNKNOWN}
+    elif kind == "vote":
+        # 得票数は判別できた投票のユニットの重みの合計
+        return sum(result["votes"].values()) / total
+    elif kind == "rank":
+        answered = set(result["ballots"])
+    elif kind == "tournament":
+        answered = {
+            name for match in result["matches"] for name, vote in match["votes"].items() if vote != UNKNOWN
+        }
+    elif kind == "analyze":
+        answered = {name for name, answer in result["answers"].items() if is_valid_answer(answer)}
+    elif kind == "analyze_document":
+        answered = {name for name, answer in result["response"]["answers"].items() if is_valid_answer(answer)}
+    else:
+        return 1.0
+    return sum(weights.get(name, 0) for name in answered) / total
+
+
+def process_record(
+    magi: MAGISystem,
+    item_id: str,
+    record: Dict,
+    kind: str,
+    temperature: float,
+    samples: int = 1
+) -> Dict:
+    """
+    1件を審議して出力レコードを返す
+
+    Returns:
+        {"id", "kind", "result", "error", "elapsed"}
+    """
+    started = time.time()
+    output = {"id": item_id, "kind": kind, "result": None, "error": None}
+    try:
+        if kind == "vote_approve_reject":
+            proposal = record.get("proposal") or record.get("body") or record["question"]
+            votes, reasons = magi.vote_approve_reject(proposal, temperature=temperature, samples=samples)
+            output["result"] = {"votes": votes, "reasons": reasons}
+        elif kind == "vote":
+            votes = magi.vote(record["question"], record["options"], temperature=temperature, samples=samples)
+            output["result"] = {"votes": votes}
+        elif kind == "rank":
+            output["result"] = asdict(magi.rank_vote(record["question"], record["options"], temperature=temperature))
+        elif kind == "tournament":
+            tournament = Tournament(magi, record["question"], temperature=temperature)
+            output["result"] = asdict(tournament.run(record["options"]))
+        elif kind == "analyze":
+            question = record.get("question") or record.get("body") or record["proposal"]
+            output["result"] = asdict(magi.analyze(question, temperature=temperature))
+        elif kind == "analyze_document":
+            analyzer = DocumentAnalyzer(magi, temperature=temperature)
+            output["result"] = asdict(analyzer.analyze(record["question"], record["document"]))
+        else:
+            raise ValueError(f"未知の審議種別です: {kind}")
+
+        # 過半数（カウンシルの定足数がそれより大きい場合は定足数）のユニットが有効な回答を返さなかった場合は
+        # エラーとして記録し、再実行時に審議し直す（ちょうど半数は過半数に含めない）
+        required = max(magi.council.quorum, 0.5)
+        share = answered_share(magi, kind, output["result"])
+        if share <= 0.5:
+            output["error"] = f"有効な回答を返したユニットが過半数に達しませんでした（{share:.0%}）"
+        elif share < required:
+            output["error"] = f"有効な回答を返したユニットが定足数に達しませんでした（{share:.0%} < {required:.0%}）"
+    except Exception as e:
+        output["error"] = str(e)
+    output["elapsed"] = round(time.time() - started, 3)
+    return output
+
+
+def run_batch(
+    magi: MAGISystem,
+    input_path: str,
+    output_path: str,
+    concurrency: int = 4,
+    kind: Optional[str] = None,
+    temperature: float = 0.7,
+    samples: int = 1
+) -> Dict[str, int]:
+    """
+    入力JSONLを審議し、完了したものから出力JSONLに追記する
+
+    Args:
+        magi: MAGISystem
+        input_path: 入力JSONLファイル
+        output_path: 出力JSONLファイル（チェックポイントを兼ねる）
+        concurrency: 同時に審議する件数
+        kind: 審議の種類（Noneの場合はレコードから判定）
+        temperature: 温度パラメータ
+        samples: 投票時に各モデルから取得するサンプル数の上限
+
+    Returns:
+        処理件数の集計
+    """
+    completed = load_completed_ids(output_path)
+    stats = {"processed": 0, "skipped": 0, "errors": 0}
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def write(output):
+            out.write(json.dumps(output, ensure_ascii=False) + "\n")
+            # クラッシュしても完了分が失われないよう1件ごとにフラッシュする
+            out.flush()
+            stats["processed"] += 1
+            if output["error"] is not None:
+                stats["errors"] += 1
+            print(f"[{stats['processed']}] {output['id']} ({output['elapsed']}s)"
+                  + (f" エラー: {output['error']}" if output["error"] else ""), file=sys.stderr)
+
+        pending = set()
+        for item_id, record, error in iter_records(input_path):
+            if item_id in completed:
+                stats["skipped"] += 1
+                continue
+            if error is not None:
+                # 解析できない行は審議せずにエラーとして記録し、残りの行の処理を続ける
+                write({"id": item_id, "kind": None, "result": None, "error": error, "elapsed": 0.0})
+                continue
+
+            # 投入済みの件数を制限し、巨大な入力でもメモリ使用量を一定に保つ
+            if len(pending) >= concurrency * 2:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    write(future.result())
+
+            completed.add(item_id)
+            with scheduling(BATCH, BATCH_SESSION):
+                pending.add(submit_in_context(
+                    executor,
+                    process_record, magi, item_id, record, detect_kind(record, kind), temperature, samples
+                ))
+
+        for future in concurrent.futures.as_completed(pending):
+            write(future.result())
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSONLファイルの提案・質問をMAGIシステムで一括審議")
+    parser.add_argument("input", help="入力JSONLファイル")
+    parser.add_argument("output", help="出力JSONLファイル（既存の場合は未完了分のみ再開）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に審議する件数（既定: 4）")
+    parser.add_argument("--kind", choices=["vote_approve_reject", "vote", "rank", "tournament", "analyze",
+                                           "analyze_document"],
+                        help="審議の種類（省略時は各レコードから判定）")
+    parser.add_argument("--temperature", type=float, default=0.7, help="温度パラメータ（既定: 0.7）")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="投票時に各モデルから取得するサンプル数の上限（既定: 1）")
+    parser.add_argument("--cache", default=".magi_cache.jsonl",
+                        help="回答キャッシュのファイル（既定: .magi_cache.jsonl、空文字で無効）")
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(path=args.cache, shared=get_shared_state()) if args.cache else None
+    magi = MAGISystem(response_cache=cache)
+
+    stats = run_batch(
+        magi,
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        kind=args.kind,
+        temperature=args.temperature,
+        samples=args.samples
+    )
+    if cache is not None:
+        stats.update({f"cache_{k}": v for k, v in cache.stats().items()})
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
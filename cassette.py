@@ -0,0 +1,165 @@
+"""
+Cassette - モデル呼び出しの記録と再生
+DatabricksClientのリクエストとレスポンス（応答時間を含む）をファイルに記録し、
+後から同じリクエストに対して記録したレスポンスを返す。ベンチマークや回帰確認をオフラインで再現できる
+
+環境変数:
+    MAGI_CASSETTE_MODE: record（記録）/ replay（再生）。未設定の場合は無効
+    MAGI_CASSETTE_PATH: 記録ファイル（既定: .magi_cassette.jsonl.gz）
+    MAGI_CASSETTE_LATENCY: 再生時に記録した応答時間に掛ける倍率（既定: 1.0、0で待たずに返す）
+"""
+import os
+import gzip
+import json
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+
+from shared_state import digest
+
+RECORD = "record"
+REPLAY = "replay"
+
+DEFAULT_PATH = ".magi_cassette.jsonl.gz"
+
+
+class CassetteMiss(RuntimeError):
+    """再生モードで記録にないリクエストが送られた"""
+
+
+class Cassette:
+    """
+    リクエストとレスポンスの記録
+
+    - 記録はgzip圧縮したJSONLに1件ずつ追記する（中断しても記録済みの分は残る）
+    - 記録モードではレスポンス本文をメモリに保持しない（件数だけ数える）
+    - 同じリクエストを複数回記録した場合（複数サンプルの投票など）は、再生時に記録した順に返す
+    - 再生時は呼び出し側の期限を守り、記録した応答時間が期限を超える場合は期限まで待ってタイムアウトにする
+    - 再生モードでは認証情報もネットワークも使わない
+    """
+
+    def __init__(self, mode: str, path: str = DEFAULT_PATH, latency_scale: float = 1.0):
+        """
+        Args:
+            mode: record / replay
+            path: 記録ファイル
+            latency_scale: 再生時に記録した応答時間に掛ける倍率（0で待たずに返す）
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"未知のカセットモードです: {mode}")
+
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Tuple[bytes, float]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        # 記録モードの集計（本文は保持しない）
+        self._recorded_keys: Set[str] = set()
+        self._recorded = 0
+
+        if mode == REPLAY:
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """環境変数の設定からカセットを作る（MAGI_CASSETTE_MODEが未設定の場合はNone）"""
+        mode = os.environ.get("MAGI_CASSETTE_MODE")
+        if not mode:
+            return None
+        return cls(
+            mode,
+            path=os.environ.get("MAGI_CASSETTE_PATH", DEFAULT_PATH),
+            latency_scale=float(os.environ.get("MAGI_CASSETTE_LATENCY", "1.0"))
+        )
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @staticmethod
+    def make_key(model: str, payload: Dict) -> str:
+        """モデル名とリクエスト本文からキーを作る"""
+        return digest({"model": model, "payload": payload})
+
+    def record(self, model: str, payload: Dict, body: bytes, latency: float):
+        """
+        成功したレスポンスを記録する
+
+        Args:
+            model: モデル名
+            payload: リクエスト本文
+            body: レスポンス本文
+            latency: 応答時間（秒）
+        """
+        key = self.make_key(model, payload)
+        line = json.dumps({
+            "key": key,
+            "model": model,
+            "latency": round(latency, 4),
+            "body": body.decode("utf-8"),
+        }, ensure_ascii=False)
+        with self._lock:
+            self._recorded_keys.add(key)
+            self._recorded += 1
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def play(self, model: str, payload: Dict, deadline: Optional[float] = None) -> bytes:
+        """
+        記録したレスポンスを返す（latency_scaleに応じて記録時の応答時間だけ待つ）
+
+        Args:
+            model: モデル名
+            payload: リクエスト本文
+            deadline: 期限（time.monotonic()の時刻、Noneの場合は期限なし）
+
+        Returns:
+            レスポンス本文
+
+        Raises:
+            requests.exceptions.Timeout: 記録した応答時間が期限を超える場合（期限まで待ってから送出する）
+        """
+        key = self.make_key(model, payload)
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"カセットに記録されていないリクエストです（モデル: {model}）")
+            body, latency = recorded[self._cursor[key] % len(recorded)]
+            self._cursor[key] += 1
+
+        wait = latency * self.latency_scale
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            if wait > remaining:
+                time.sleep(remaining)
+                raise requests.exceptions.Timeout("期限までに応答がありませんでした")
+        if wait > 0:
+            time.sleep(wait)
+        return body
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            if self.mode == RECORD:
+                return {"requests": len(self._recorded_keys), "responses": self._recorded}
+            return {
+                "requests": len(self._entries),
+                "responses": sum(len(recorded) for recorded in self._entries.values()),
+            }
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で中断された行は無視する
+                        continue
+                    self._entries[entry["key"]].append((entry["body"].encode("utf-8"), entry["latency"]))
+        except EOFError:
+            # 圧縮ストリームの末尾が途切れている場合も、読み込めた分は使う
+            pass
@@ -0,0 +1,134 @@
+"""
+MAGI Consensus - 回答の類似度によるコンセンサス
+各ユニットの回答が届くたびに、その回答の特徴（文字bigramの頻度）を1回だけ計算し、
+すでに届いている回答との類似度だけを追加で求めて、暫定のコンセンサスと一致度スコアを更新する
+（最後の回答が届いた時点で必要なのは、その回答の分の計算だけ）
+"""
+import math
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# ジョブの進捗で暫定のコンセンサスを渡すキー
+CONSENSUS_PROGRESS_KEY = "consensus"
+
+# 有効な回答として扱わない回答の先頭
+INVALID_PREFIXES = ("エラー:", "タイムアウト:", "回答なし")
+
+
+@dataclass(frozen=True, slots=True)
+class ConsensusSnapshot:
+    """その時点で届いている回答から決めたコンセンサス"""
+    consensus: str
+    agreement_score: float
+    winning_model: str
+    arrived: int  # 届いた回答の数（エラーを含む）
+    total: int  # 全ユニット数
+
+
+def is_valid_answer(answer: str) -> bool:
+    """エラー・タイムアウト・空の回答でないか"""
+    return not answer.startswith(INVALID_PREFIXES)
+
+
+def _features(text: str) -> Tuple[Dict[str, int], float]:
+    """
+    回答の特徴（空白を除いた文字bigramの頻度とそのノルム）
+
+    日本語は単語の区切りがないため、分かち書きの代わりに文字bigramを使う
+    """
+    normalized = "".join(text.lower().split())
+    grams = Counter(normalized[i:i + 2] for i in range(len(normalized) - 1))
+    return grams, math.sqrt(sum(count * count for count in grams.values()))
+
+
+def _similarity(a: Tuple[Dict[str, int], float], b: Tuple[Dict[str, int], float]) -> float:
+    """2つの回答の特徴のコサイン類似度（0.0〜1.0）"""
+    (grams_a, norm_a), (grams_b, norm_b) = a, b
+    if not norm_a or not norm_b:
+        return 0.0
+    if len(grams_a) > len(grams_b):
+        grams_a, grams_b = grams_b, grams_a
+    dot = sum(count * grams_b.get(gram, 0) for gram, count in grams_a.items())
+    return dot / (norm_a * norm_b)
+
+
+class ConsensusTracker:
+    """
+    回答が届くたびにコンセンサスを更新する
+
+    - コンセンサス: 他の有効な回答との類似度（相手のユニットの重み付き）の合計が最も大きい回答。
+      同点の場合はより長い（詳細な）回答を選ぶ
+    - 一致度スコア: 有効な回答どうしの類似度の平均 × 有効な回答の割合（全ユニット数に対する割合のため、
+      回答が届くにつれて上がる。有効な回答が1つの場合は 1 / 全ユニット数）
+    """
+
+    def __init__(self, total: int, weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            total: 全ユニット数
+            weights: ユニット名 -> 重み（Noneの場合はすべて1）
+        """
+        self.total = total
+        self.weights = weights or {}
+        self._lock = threading.Lock()
+        self._answers: Dict[str, str] = {}
+        self._features: Dict[str, Tuple[Dict[str, int], float]] = {}
+        self._similarities: Dict[Tuple[str, str], float] = {}
+
+    def add(self, name: str, answer: str) -> ConsensusSnapshot:
+        """
+        ユニットの回答を追加する（すでに届いている回答との類似度だけを計算する）
+
+        Args:
+            name: ユニット名
+            answer: 回答
+
+        Returns:
+            追加後のConsensusSnapshot
+        """
+        # 回答の特徴はロックの外で計算し、類似度は届いている回答との組だけを求める
+        features = _features(answer) if is_valid_answer(answer) else None
+        with self._lock:
+            self._answers[name] = answer
+            self._features.pop(name, None)
+            for key in [key for key in self._similarities if name in key]:
+                del self._similarities[key]
+            if features is not None:
+                for other, other_features in self._features.items():
+                    similarity = _similarity(features, other_features)
+                    self._similarities[(name, other)] = self._similarities[(other, name)] = similarity
+                self._features[name] = features
+            return self._snapshot()
+
+    def snapshot(self) -> ConsensusSnapshot:
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> ConsensusSnapshot:
+        valid: List[str] = [name for name in self._answers if name in self._features]
+        arrived = len(self._answers)
+
+        if not valid:
+            return ConsensusSnapshot("すべてのモデルがエラーを返しました", 0.0, "NONE", arrived, self.total)
+
+        if len(valid) == 1:
+            name = valid[0]
+            return ConsensusSnapshot(self._answers[name], 1 / self.total, name, arrived, self.total)
+
+        def support(name: str) -> Tuple[float, int]:
+            score = sum(
+                self.weights.get(other, 1) * self._similarities.get((name, other), 0.0)
+                for other in valid if other != name
+            )
+            return score, len(self._answers[name])
+
+        winning_model = max(valid, key=support)
+        pairs = [(a, b) for i, a in enumerate(valid) for b in valid[i + 1:]]
+        mean_similarity = sum(self._similarities.get(pair, 0.0) for pair in pairs) / len(pairs)
+        agreement_score = mean_similarity * len(valid) / self.total
+
+        return ConsensusSnapshot(
+            self._answers[winning_model], agreement_score, winning_model, arrived, self.total
+        )
@@ -0,0 +1,141 @@
+"""
+MAGI Council - 審議に参加するユニットの構成
+人格 × エンドポイントの組み合わせを任意の数だけ定義し、重み付き投票と定足数で決定する
+"""
+import json
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass(frozen=True, slots=True)
+class CouncilUnit:
+    """審議に参加する1ユニット"""
+    name: str  # ユニット名（例: MELCHIOR）
+    model_id: str  # サービングエンドポイント名
+    persona: str  # システムプロンプト
+    weight: int = 1  # 投票の重み
+    label: str = ""  # 表示用の説明（例: GPT-5 (科学者)）
+
+
+@dataclass(frozen=True, slots=True)
+class CouncilDecision:
+    """賛成/反対投票の集計結果"""
+    outcome: str  # 賛成 / 反対 / 保留 / 不成立
+    approve: int  # 賛成の重みの合計
+    reject: int  # 反対の重みの合計
+    abstain: int  # 判別できなかった投票の重みの合計
+    total: int  # 全ユニットの重みの合計
+    quorum_met: bool
+
+
+class Council:
+    """
+    審議に参加するユニットの集合
+
+    - 重み付き多数決（賛成と反対の重みを比較）
+    - 定足数: 有効票（賛成+反対）の重みが全体のquorumの割合に満たない場合は「不成立」
+    """
+
+    def __init__(self, units: List[CouncilUnit], quorum: float = 0.0, max_workers: int = 8):
+        """
+        Args:
+            units: ユニットのリスト
+            quorum: 決定に必要な有効票の割合（0.0〜1.0）
+            max_workers: モデルへ同時に送信するリクエスト数の上限
+        """
+        if not units:
+            raise ValueError("ユニットが1つもありません")
+        names = [unit.name for unit in units]
+        if len(set(names)) != len(names):
+            raise ValueError(f"ユニット名が重複しています: {names}")
+
+        self.units = list(units)
+        self.quorum = quorum
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_config(cls, path: str, personas: Dict[str, str]) -> "Council":
+        """
+        JSONファイルから構成を読み込む
+
+        {"quorum": 0.5, "max_workers": 8,
+         "units": [{"name": "MELCHIOR-A", "model_id": "databricks-gpt-5",
+                    "persona": "MELCHIOR", "weight": 2, "label": "GPT-5 (科学者)"}, ...]}
+
+        personaにpersonasのキー（MELCHIORなど）を指定するとその人格設定を使い、
+        それ以外の文字列はシステムプロンプトとしてそのまま使う
+
+        Args:
+            path: 設定ファイルのパス
+            personas: 人格名 -> システムプロンプト
+
+        Returns:
+            Council
+        """
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+
+        units = [
+            CouncilUnit(
+                name=unit["name"],
+                model_id=unit["model_id"],
+                persona=personas.get(unit["persona"], unit["persona"]),
+                weight=int(unit.get("weight", 1)),
+                label=unit.get("label", "")
+            )
+            for unit in config["units"]
+        ]
+        return cls(units, quorum=config.get("quorum", 0.0), max_workers=config.get("max_workers", 8))
+
+    @property
+    def names(self) -> List[str]:
+        return [unit.name for unit in self.units]
+
+    @property
+    def total_weight(self) -> int:
+        return sum(unit.weight for unit in self.units)
+
+    def unit(self, name: str) -> CouncilUnit:
+        for unit in self.units:
+            if unit.name == name:
+                return unit
+        raise KeyError(name)
+
+    def decide(self, votes: Dict[str, str]) -> CouncilDecision:
+        """
+        賛成/反対の投票を重み付きで集計
+
+        Args:
+            votes: ユニット名 -> 賛成 / 反対 / 不明
+
+        Returns:
+            CouncilDecision
+        """
+        approve = reject = 0
+        for unit in self.units:
+            vote = votes.get(unit.name)
+            if vote == "賛成":
+                approve += unit.weight
+            elif vote == "反対":
+                reject += unit.weight
+
+        total = self.total_weight
+        quorum_met = approve + reject >= self.quorum * total
+
+        if not quorum_met:
+            outcome = "不成立"
+        elif approve > reject:
+            outcome = "賛成"
+        elif reject > approve:
+            outcome = "反対"
+        else:
+            outcome = "保留"
+
+        return CouncilDecision(
+            outcome=outcome,
+            approve=approve,
+            reject=reject,
+            abstain=total - approve - reject,
+            total=total,
+            quorum_met=quorum_met
+        )
@@ -1,96 +1,327 @@
 """
 Databricks Foundation Model API Client
 """
+import json
 import requests
 import time
-from typing import Dict, List
-from databricks.sdk.core import Config
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from cassette import Cassette
+from latency import LatencyTracker
+from shared_state import RateBudget
+from token_budget import TokenBudget
+import timing
+
+try:
+    # 利用できる場合は高速なJSONパーサーを使う
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(frozen=True, slots=True)
+class ChatResult:
+    """
+    チャットレスポンスから必要な項目だけを取り出した結果
+
+    レスポンス全体のdictは解析後すぐに破棄し、回答テキストと集計用のトークン数のみ保持する
+    """
+    content: Optional[str]
+    finish_reason: Optional[str] = None
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    error: Optional[str] = None  # レスポンスの解析に失敗した場合のメッセージ
+    continuations: int = 0  # max_tokensで途切れた回答を続けさせた回数（予算を増やした再試行を含む）
+
+
+def parse_chat_response(body: bytes) -> ChatResult:
+    """
+    レスポンス本文を解析し、choices[0]の回答・finish_reason・usageだけを取り出す
+
+    Args:
+        body: レスポンス本文
+
+    Returns:
+        ChatResult
+    """
+    data = orjson.loads(body) if orjson is not None else json.loads(body)
+
+    if "error" in data:
+        return ChatResult(content=None, error=f"エラー: {data['error']}")
+
+    usage = data.get("usage") or {}
+    # キャッシュされた入力トークン数はプロバイダーによってフィールド名が異なる
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = (
+        details.get("cached_tokens")
+        or usage.get("cache_read_input_tokens")
+        or usage.get("cached_tokens")
+        or 0
+    )
+    tokens = {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+    }
+
+    try:
+        # Databricks Foundation Model APIのレスポンス形式に対応
+        if "choices" in data:
+            choice = data["choices"][0]
+            return ChatResult(
+                content=choice["message"]["content"],
+                finish_reason=choice.get("finish_reason", "unknown"),
+                **tokens
+            )
+        elif "predictions" in data:
+            return ChatResult(content=data["predictions"][0], **tokens)
+        else:
+            return ChatResult(content=str(data), **tokens)
+    except (KeyError, IndexError) as e:
+        return ChatResult(
+            content=None,
+            error=f"レスポンスの解析に失敗: {str(e)}\n生データ: {str(data)[:200]}"
+        )
+
+
+# chat_completionの既定の最大試行回数（リトライを含む）
+MAX_RETRIES = 3
+
+# max_tokensで途切れた回答の続きを求めるプロンプト
+CONTINUE_PROMPT = "回答が途中で途切れました。直前の回答の続きから、すでに書いた内容を繰り返さずに書き続けてください。"
 
 
 class DatabricksClient:
     """Databricksのモデルにアクセスするためのクライアント"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        pool_size: int = 16,
+        prompt_caching: bool = True,
+        cassette: Optional[Cassette] = None,
+        rate_budget: Optional[RateBudget] = None
+    ):
         """
         Databricks SDKを使って環境変数から自動的に認証情報を取得
+
+        Args:
+            pool_size: エンドポイントごとに保持するHTTP接続数
+            prompt_caching: システムプロンプトにプロンプトキャッシュの指定を付けるか
+            cassette: リクエストの記録/再生（Noneの場合は環境変数MAGI_CASSETTE_MODEの設定に従う）
+            rate_budget: エンドポイントごとのリクエスト数の上限（Noneの場合は環境変数MAGI_ENDPOINT_RATEの設定に従う）
+        """
+        self.cassette = cassette or Cassette.from_env()
+
+        if self.cassette is not None and self.cassette.replaying:
+            # 再生モードではワークスペースに接続しないため認証情報は不要
+            self.cfg = None
+            self.workspace_url = ""
+        else:
+            # Databricks SDKのConfigを使用して認証情報を自動取得
+            # SDKの読み込みは重いため、モジュールの読み込み時ではなくクライアントの生成時に行う
+            from databricks.sdk.core import Config
+            self.cfg = Config()
+            self.workspace_url = self.cfg.host.rstrip('/')
+
+        # 接続を使い回すためのセッション（Streamlit・APIサーバーの全リクエストで共有）
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # モデルごとの入力・出力トークン数（キャッシュされた入力トークンを区別して集計）
+        self.prompt_caching = prompt_caching
+        self._usage_lock = threading.Lock()
+        self._usage: Dict[str, Dict[str, int]] = {}
+
+        # エンドポイントごとの応答時間（リクエストごとのタイムアウトを決める）
+        self.latency = LatencyTracker()
+
+        # エンドポイントごとのリクエスト数の上限（MAGI_ENDPOINT_RATEが未設定の場合は上限なし）
+        self.rate_budget = rate_budget or RateBudget.from_env()
+
+        # 送信前の入力トークン数の見積もりとコンテキストの予算（見積もりと実際のトークン数も集計する）
+        self.token_budget = TokenBudget()
+
+    @property
+    def headers(self) -> Dict[str, str]:
         """
-        # Databricks SDKのConfigを使用して認証情報を自動取得
-        self.cfg = Config()
-        self.workspace_url = self.cfg.host.rstrip('/')
+        リクエストごとの認証ヘッダー
 
-        # 認証ヘッダーを取得
-        auth_headers = self.cfg.authenticate()
-        self.headers = {
-            **auth_headers,
+        クライアントはジョブキューなどで長時間共有されるため、
+        OAuthトークンの期限切れに備えて毎回SDKから取得する（SDK側でキャッシュ・更新される）
+        """
+        return {
+            **self.cfg.authenticate(),
             'Content-Type': 'application/json'
         }
 
+    def preflight(self, model: str, timeout: float = 10.0) -> float:
+        """
+        エンドポイントへの接続（DNS・TLS・認証）を事前に確立する
+
+        サービングエンドポイントの情報を取得するだけで推論は行わない。
+        確立した接続は接続プールに残り、最初の審議で再利用される
+
+        Args:
+            model: モデル名
+            timeout: タイムアウト（秒）
+
+        Returns:
+            所要時間（秒）
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return 0.0
+        started = time.perf_counter()
+        response = self.session.get(
+            f"{self.workspace_url}/api/2.0/serving-endpoints/{model}",
+            headers=self.headers,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return time.perf_counter() - started
+
     def chat_completion(
         self,
         model: str,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         max_tokens: int = 4000,
-        max_retries: int = 3
-    ) -> Dict:
+        max_retries: int = MAX_RETRIES,
+        deadline: Optional[float] = None
+    ) -> ChatResult:
         """
         モデルにチャットリクエストを送信（リトライ機能付き）
 
+        各リクエストのタイムアウトはエンドポイントの応答時間の分布から決める。
+        deadlineを指定した場合は、リトライを含めてその時刻までに終わらせる。
+        送信前に入力トークン数を見積もり、モデルのコンテキスト長に収まるよう入力とmax_tokensを調整する
+        （詰めても収まらない場合は送信せずにValueErrorを送出する）
+
         Args:
             model: モデル名 (e.g., "databricks-gpt-5")
             messages: チャットメッセージのリスト
             temperature: 温度パラメータ
             max_tokens: 最大トークン数
             max_retries: 最大リトライ回数
+            deadline: 全体の期限（time.monotonic()の時刻、Noneの場合は期限なし）
 
         Returns:
-            APIレスポンス
+            ChatResult
         """
         endpoint = f"{self.workspace_url}/serving-endpoints/{model}/invocations"
 
+        plan = self.token_budget.fit(model, messages, max_tokens)
         payload = {
-            "messages": messages,
-            "max_tokens": max_tokens
+            "messages": self._with_cache_control(model, plan.messages),
+            "max_tokens": plan.max_tokens
         }
 
         # GPT-5はtemperatureをサポートしていないので、それ以外のモデルのみ指定
         if "gpt-5" not in model:
             payload["temperature"] = temperature
 
+        # 診断パネル用の区間の記録（計測が無効の場合はNone）
+        call = timing.current_call()
+
+        if self.cassette is not None and self.cassette.replaying:
+            started = time.perf_counter()
+            body = self.cassette.play(model, payload, deadline)
+            received = time.perf_counter()
+            result = parse_chat_response(body)
+            if call is not None:
+                call.add(timing.TTFB, started, received)
+                call.add(timing.PARSE, received, time.perf_counter())
+            self._record_usage(model, result, plan.estimated_tokens)
+            return result
+
         # リトライロジック
         last_error = None
+        retry_started = None
         for attempt in range(max_retries):
+            if call is not None and retry_started is not None:
+                call.add(timing.RETRY, retry_started, time.perf_counter())
+                retry_started = None
+
+            timeout = self.latency.timeout_for(model, plan.estimated_tokens)
+            clipped = False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    last_error = last_error or requests.exceptions.Timeout("期限までに応答がありませんでした")
+                    break
+                clipped = remaining < timeout
+                timeout = min(timeout, remaining)
+
+            if self.rate_budget is not None:
+                # 期限までに送れない場合は予約しない（枠を消費したまま諦めない）
+                wait = self.rate_budget.reserve(
+                    model, deadline - time.monotonic() if deadline is not None else None
+                )
+                if wait is None:
+                    last_error = requests.exceptions.Timeout("レート上限の待機が期限を超えます")
+                    break
+                if wait > 0:
+                    waited = time.perf_counter()
+                    time.sleep(wait)
+                    if call is not None:
+                        call.add(timing.RATE_LIMIT, waited, time.perf_counter())
+
             try:
-                response = requests.post(
+                started = time.perf_counter()
+                response = self.session.post(
                     endpoint,
                     headers=self.headers,
                     json=payload,
-                    timeout=120
+                    timeout=timeout,
+                    # 計測中はヘッダーの受信時点で戻り、応答待ちと本文の受信を分けて記録する
+                    stream=call is not None
                 )
+                if call is not None and not response.ok:
+                    # 本文を読まないまま送出するため、先に接続を解放する
+                    response.close()
                 response.raise_for_status()
-                return response.json()
+                headers_at = time.perf_counter()
+                body = response.content
+                received = time.perf_counter()
+                elapsed = received - started
+                self.latency.record(model, elapsed, plan.estimated_tokens)
+                if self.cassette is not None:
+                    self.cassette.record(model, payload, body, elapsed)
+                result = parse_chat_response(body)
+                if call is not None:
+                    call.add(timing.TTFB, started, headers_at)
+                    call.add(timing.DOWNLOAD, headers_at, received)
+                    call.add(timing.PARSE, received, time.perf_counter())
+                self._record_usage(model, result, plan.estimated_tokens)
+                return result
             except requests.exceptions.RequestException as e:
                 last_error = e
+                retry_started = started
+                # 期限に合わせて短くしたタイムアウトは応答時間の下限として小さすぎるため、分布に含めない
+                if isinstance(e, requests.exceptions.Timeout) and not clipped:
+                    self.latency.record_timeout(model, timeout, plan.estimated_tokens)
 
                 # 502, 503, 504などの一時的なエラーの場合はリトライ
                 if hasattr(e, 'response') and e.response is not None:
                     status_code = e.response.status_code
-                    # 一時的なエラーの場合のみリトライ
+                    # 一時的なエラーの場合のみリトライ（指数バックオフで待機）
                     if status_code in [502, 503, 504, 429]:
-                        if attempt < max_retries - 1:
-                            # 指数バックオフで待機
-                            wait_time = (2 ** attempt) * 1
-                            time.sleep(wait_time)
+                        if attempt < max_retries - 1 and self._wait(2 ** attempt, deadline):
                             continue
                     # 400エラーなどの恒久的なエラーはリトライしない
-                    else:
-                        break
+                    break
                 else:
                     # ネットワークエラーなどもリトライ
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 1
-                        time.sleep(wait_time)
+                    if attempt < max_retries - 1 and self._wait(2 ** attempt, deadline):
                         continue
+                    break
+
+        if call is not None and retry_started is not None:
+            call.add(timing.RETRY, retry_started, time.perf_counter())
 
         # 最終的にエラーを返す
         if last_error:
@@ -98,35 +329,169 @@ class DatabricksClient:
         else:
             raise Exception("Unknown error occurred")
 
-    def get_response_text(self, response: Dict) -> str:
+    def chat_completion_with_continuation(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 4000,
+        max_continuations: int = 2,
+        max_tokens_cap: Optional[int] = None,
+        deadline: Optional[float] = None
+    ) -> ChatResult:
         """
-        APIレスポンスからテキストを抽出
+        max_tokensで途切れた回答を捨てずに完成させる
+
+        finish_reasonがlengthの場合:
+        - 途中までの回答がある: その回答をassistantメッセージとして渡し、続きを書かせて連結する
+        - 回答が空（推論モデルが推論だけでmax_tokensを使い切った）: max_tokensを2倍（max_tokens_capまで）にして再試行する
 
         Args:
-            response: APIレスポンス
+            model: モデル名
+            messages: チャットメッセージのリスト
+            temperature: 温度パラメータ
+            max_tokens: 最大トークン数
+            max_continuations: 続きを求める・再試行する最大回数
+            max_tokens_cap: 再試行時のmax_tokensの上限（Noneの場合はmax_tokensの2倍）
+            deadline: 全体の期限（time.monotonic()の時刻）
 
         Returns:
-            レスポンステキスト
+            ChatResult（続きを連結した回答。トークン数は全リクエストの合計）
         """
-        if "error" in response:
-            return f"エラー: {response['error']}"
-
-        try:
-            # Databricks Foundation Model APIのレスポンス形式に対応
-            if "choices" in response:
-                content = response["choices"][0]["message"]["content"]
-                # contentが空またはNoneの場合の処理
-                if not content:
-                    # finish_reasonを確認
-                    finish_reason = response["choices"][0].get("finish_reason", "unknown")
-                    if finish_reason == "length":
-                        return "回答なし（max_tokensに達しました）"
-                    else:
-                        return f"回答なし（finish_reason: {finish_reason}）"
-                return content
-            elif "predictions" in response:
-                return response["predictions"][0]
+        max_tokens_cap = max_tokens_cap or max_tokens * 2
+        result = self.chat_completion(model, messages, temperature, max_tokens, deadline=deadline)
+
+        parts: List[str] = []
+        tokens = [result.prompt_tokens, result.cached_tokens, result.completion_tokens]
+        continuations = 0
+        budget = max_tokens
+
+        while continuations < max_continuations and result.error is None and result.finish_reason == "length":
+            if result.content:
+                parts.append(result.content)
+                messages = [
+                    *messages,
+                    {"role": "assistant", "content": result.content},
+                    {"role": "user", "content": CONTINUE_PROMPT}
+                ]
+            elif budget < max_tokens_cap:
+                budget = min(budget * 2, max_tokens_cap)
             else:
-                return str(response)
-        except (KeyError, IndexError) as e:
-            return f"レスポンスの解析に失敗: {str(e)}\n生データ: {str(response)[:200]}"
+                break
+
+            continuations += 1
+            try:
+                result = self.chat_completion(model, messages, temperature, budget, deadline=deadline)
+            except (requests.exceptions.RequestException, ValueError):
+                if not parts:
+                    raise
+                # 続きの取得に失敗しても（続きを求める入力がコンテキスト長を超える場合を含む）、途中までの回答は返す
+                result = ChatResult(content="", finish_reason="length")
+                break
+            tokens = [
+                total + used for total, used in
+                zip(tokens, (result.prompt_tokens, result.cached_tokens, result.completion_tokens))
+            ]
+
+        if not parts and not continuations:
+            return result
+
+        return ChatResult(
+            content="".join(parts) + (result.content or "") if parts else result.content,
+            finish_reason=result.finish_reason,
+            prompt_tokens=tokens[0],
+            cached_tokens=tokens[1],
+            completion_tokens=tokens[2],
+            error=result.error if not parts else None,
+            continuations=continuations
+        )
+
+    @staticmethod
+    def _wait(wait_time: float, deadline: Optional[float]) -> bool:
+        """リトライのために待機する（待機すると期限を過ぎる場合は待たずにFalseを返す）"""
+        if deadline is not None and time.monotonic() + wait_time >= deadline:
+            return False
+        time.sleep(wait_time)
+        return True
+
+    def _with_cache_control(self, model: str, messages: List[Dict[str, str]]) -> List[Dict]:
+        """
+        システムプロンプトをプロンプトキャッシュの対象にする
+
+        人格設定のシステムプロンプトは全リクエストで共通の先頭部分なので、キャッシュされれば
+        入力処理の時間とトークンを節約できる。
+        - Claude: 明示的なcache_controlマーカーが必要
+        - GPT / Gemini: 共通の先頭部分は自動でキャッシュされるため、メッセージの順序を保つだけでよい
+        """
+        if not self.prompt_caching or "claude" not in model:
+            return messages
+
+        cached = []
+        for message in messages:
+            if message["role"] == "system" and isinstance(message["content"], str):
+                message = {
+                    "role": "system",
+                    "content": [{
+                        "type": "text",
+                        "text": message["content"],
+                        "cache_control": {"type": "ephemeral"}
+                    }]
+                }
+            cached.append(message)
+        return cached
+
+    def _record_usage(self, model: str, result: ChatResult, estimated_tokens: int):
+        """レスポンスのusageからトークン数を集計（送信前の入力トークン数の見積もりと並べて記録する）"""
+        if not (result.prompt_tokens or result.completion_tokens):
+            return
+        self.token_budget.record(model, estimated_tokens, result.prompt_tokens)
+
+        with self._usage_lock:
+            stats = self._usage.setdefault(model, {
+                "requests": 0,
+                "input_tokens": 0,
+                "cached_input_tokens": 0,
+                "output_tokens": 0
+            })
+            stats["requests"] += 1
+            stats["input_tokens"] += result.prompt_tokens
+            stats["cached_input_tokens"] += result.cached_tokens
+            stats["output_tokens"] += result.completion_tokens
+
+    def usage_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        モデルごとのトークン使用量
+
+        Returns:
+            モデル名 -> {"requests", "input_tokens", "cached_input_tokens",
+                         "uncached_input_tokens", "output_tokens", "cache_hit_rate"}
+        """
+        with self._usage_lock:
+            snapshot = {model: dict(stats) for model, stats in self._usage.items()}
+
+        for stats in snapshot.values():
+            stats["uncached_input_tokens"] = stats["input_tokens"] - stats["cached_input_tokens"]
+            stats["cache_hit_rate"] = (
+                stats["cached_input_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+            )
+        return snapshot
+
+    def get_response_text(self, result: ChatResult) -> str:
+        """
+        ChatResultから表示用のテキストを取り出す
+
+        Args:
+            result: chat_completionの結果
+
+        Returns:
+            レスポンステキスト
+        """
+        if result.error is not None:
+            return result.error
+
+        # contentが空またはNoneの場合はfinish_reasonを確認
+        if not result.content:
+            if result.finish_reason == "length":
+                return "回答なし（max_tokensに達しました）"
+            return f"回答なし（finish_reason: {result.finish_reason or 'unknown'}）"
+        return result.content
@@ -0,0 +1,318 @@
+"""
+MAGI Document Analysis - 長い文書のmap-reduce分析
+文書を分割し、各ユニットが部分ごとに要点をまとめ（map）、ユニットごとに要点を統合して最終的な見解を出す（reduce）
+"""
+import re
+import hashlib
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from magi_system import MAGIResponse
+from response_cache import ResponseCache
+from scheduler import submit_in_context
+from shared_state import get_shared_state
+
+# 1つの部分の最大文字数
+DEFAULT_CHUNK_CHARS = 6000
+
+# 1回のreduceに渡す要点の最大文字数（超える場合は要点を段階的にまとめる）
+DEFAULT_REDUCE_CHARS = 12000
+
+# 関係する内容がない部分の回答
+NOT_RELEVANT = "該当なし"
+
+# 部分ごとの要点のキャッシュ（キーは部分の内容のハッシュのため、文書を編集しても変わっていない部分は再利用される）
+_chunk_cache = ResponseCache(max_entries=4096, shared=get_shared_state())
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[。．！？!?])|(?<=\. )|\n")
+
+
+@dataclass(frozen=True, slots=True)
+class DocumentAnalysisResult:
+    """長い文書の分析結果"""
+    response: MAGIResponse  # ユニットごとの最終的な見解とコンセンサス
+    chunks: int  # 文書を分割した数
+    cached: int  # キャッシュから得た要点の数（部分×ユニット）
+    calls: int  # モデルの呼び出し回数
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _split_long(paragraph: str, chunk_chars: int) -> List[str]:
+    """1つの部分に収まらない段落を文の区切りで分ける（文も収まらない場合は文字数で切る）"""
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > chunk_chars:
+            pieces.append(sentence[:chunk_chars])
+            sentence = sentence[chunk_chars:]
+        if current and len(current) + len(sentence) > chunk_chars:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def split_chunks(document: str, chunk_chars: int = DEFAULT_CHUNK_CHARS) -> List[str]:
+    """
+    文書を段落の区切りで部分に分ける
+
+    区切る位置は段落の内容のハッシュで決める（最小サイズを超えた後、ハッシュが条件を満たす段落の後で区切る）。
+    文字数だけで詰めると1か所の編集で以降の区切りがすべてずれるが、内容で決めれば編集の影響は前後の部分に留まる
+
+    Args:
+        document: 文書
+        chunk_chars: 1つの部分の最大文字数
+
+    Returns:
+        部分のリスト
+    """
+    pieces: List[str] = []
+    for paragraph in _PARAGRAPH_BREAK.split(document):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces.extend(_split_long(paragraph, chunk_chars) if len(paragraph) > chunk_chars else [paragraph])
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) > chunk_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+        if size >= chunk_chars // 2 and int(_digest(piece)[:8], 16) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class DocumentAnalyzer:
+    """
+    長い文書のmap-reduce分析
+
+    - map: 全部分×全ユニットを並列に問い合わせる（同時実行数はcouncil.max_workersとスケジューラーで抑える）
+    - reduce: ユニットごとに部分の要点を統合し、そのユニットの人格で最終的な見解を出す
+      （要点がreduce_charsを超える場合は、まとめた要点をさらにまとめる）
+    - 各ユニットの最終的な見解からMAGISystemと同じ方法でコンセンサスを決める
+    """
+
+    def __init__(
+        self,
+        magi,
+        temperature: float = 0.7,
+        chunk_chars: int = DEFAULT_CHUNK_CHARS,
+        reduce_chars: int = DEFAULT_REDUCE_CHARS
+    ):
+        """
+        Args:
+            magi: MAGISystem
+            temperature: 温度パラメータ
+            chunk_chars: 1つの部分の最大文字数
+            reduce_chars: 1回のreduceに渡す要点の最大文字数
+        """
+        self.magi = magi
+        self.temperature = temperature
+        self.chunk_chars = chunk_chars
+        self.reduce_chars = reduce_chars
+
+    def analyze(
+        self,
+        question: str,
+        document: str,
+        on_progress: Optional[Callable[[str, Dict], None]] = None
+    ) -> DocumentAnalysisResult:
+        """
+        文書を踏まえて質問を分析する
+
+        Args:
+            question: 質問
+            document: 文書
+            on_progress: 部分の要点・ユニットの見解が出るたびに
+                         ("map-部分番号-ユニット名", {"phase", "status"}) /
+                         ("reduce-ユニット名", {"phase", "answer", "status"}) で呼ばれる
+
+        Returns:
+            DocumentAnalysisResult
+        """
+        chunks = split_chunks(document, self.chunk_chars)
+        if not chunks:
+            raise ValueError("文書が空です")
+
+        notes, cached, calls = self._map(question, chunks, on_progress)
+
+        names = list(self.magi.models)
+        answers: Dict[str, str] = {}
+        max_workers = min(len(names), self.magi.council.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                submit_in_context(executor, self._reduce, name, question, notes[name]): name
+                for name in names
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                answer, status, reduce_calls = future.result()
+                answers[name] = answer
+                calls += reduce_calls
+                if on_progress is not None:
+                    on_progress(f"reduce-{name}", {"phase": "reduce", "answer": answer, "status": status})
+
+        answers = {name: answers[name] for name in names}
+        consensus, agreement_score, winning_model = self.magi._analyze_consensus(answers)
+        return DocumentAnalysisResult(
+            response=MAGIResponse(
+                answers=answers,
+                consensus=consensus,
+                agreement_score=agreement_score,
+                winning_model=winning_model
+            ),
+            chunks=len(chunks),
+            cached=cached,
+            calls=calls
+        )
+
+    def _map(
+        self,
+        question: str,
+        chunks: List[str],
+        on_progress: Optional[Callable[[str, Dict], None]]
+    ) -> Tuple[Dict[str, List[str]], int, int]:
+        """
+        全部分×全ユニットの要点を集める（キャッシュにあるものは問い合わせない）
+
+        Returns:
+            (ユニット名 -> 部分の順に並べた要点（失敗・該当なしは除く）, キャッシュから得た数, 呼び出し回数)
+        """
+        names = list(self.magi.models)
+        results: Dict[Tuple[int, str], Optional[str]] = {}
+        pending = []
+        for index, chunk in enumerate(chunks):
+            for name in names:
+                key = self._cache_key(name, question, chunk)
+                hit = _chunk_cache.get(key)
+                if hit is not None:
+                    results[(index, name)] = hit[1]
+                    if on_progress is not None:
+                        on_progress(f"map-{index + 1}-{name}", {"phase": "map", "status": "cached"})
+                else:
+                    pending.append((index, name, key))
+
+        if pending:
+            max_workers = min(len(pending), self.magi.council.max_workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    submit_in_context(
+                        executor,
+                        self.magi.query_model,
+                        name,
+                        self.magi.models[name],
+                        self._map_prompt(question, chunks[index]),
+                        self.temperature
+                    ): (index, name, key)
+                    for index, name, key in pending
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    index, name, key = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = (name, f"エラー: {e}", "error")
+                    ok = result[2] == "success" and not result[1].startswith("回答なし")
+                    results[(index, name)] = result[1] if ok else None
+                    if ok:
+                        _chunk_cache.put(key, result)
+                    if on_progress is not None:
+                        on_progress(f"map-{index + 1}-{name}", {"phase": "map", "status": result[2]})
+
+        notes = {
+            name: [
+                results[(index, name)] for index in range(len(chunks))
+                if results[(index, name)] is not None and results[(index, name)].strip() != NOT_RELEVANT
+            ]
+            for name in names
+        }
+        return notes, len(chunks) * len(names) - len(pending), len(pending)
+
+    def _reduce(self, name: str, question: str, notes: List[str]) -> Tuple[str, str, int]:
+        """
+        1つのユニットの要点を統合して最終的な見解を出す
+
+        Returns:
+            (回答, ステータス, 呼び出し回数)
+        """
+        if not notes:
+            return "エラー: 文書のどの部分からも要点を得られませんでした", "error", 0
+
+        calls = 0
+        # 要点が多すぎる場合は、reduce_charsに収まる組ごとにまとめる
+        while sum(len(note) for note in notes) > self.reduce_chars and len(notes) > 1:
+            groups: List[List[str]] = [[]]
+            size = 0
+            for note in notes:
+                if groups[-1] and size + len(note) > self.reduce_chars:
+                    groups.append([])
+                    size = 0
+                groups[-1].append(note)
+                size += len(note)
+            if len(groups) == len(notes):
+                # 1つずつでも収まらない場合はこれ以上まとめられない
+                break
+            merged = []
+            for group in groups:
+                _, answer, status = self.magi.query_model(
+                    name, self.magi.models[name], self._merge_prompt(question, group), self.temperature
+                )
+                calls += 1
+                merged.append(answer if status == "success" else "\n\n".join(group))
+            notes = merged
+
+        _, answer, status = self.magi.query_model(
+            name, self.magi.models[name], self._reduce_prompt(question, notes), self.temperature
+        )
+        return answer, status, calls + 1
+
+    def _cache_key(self, name: str, question: str, chunk: str) -> Tuple:
+        return (
+            "document-map", name, self.magi.models[name], self.magi.personas[name],
+            question, chunk, self.temperature
+        )
+
+    @staticmethod
+    def _map_prompt(question: str, chunk: str) -> str:
+        # 部分の位置（何番目か）はプロンプトに含めない（文書の前方を編集しても後方の部分の回答を再利用できる）
+        return f"""{question}
+
+以下は長い文書の一部です。上の質問に答えるために必要な要点を、この部分に書かれている内容だけから箇条書きで簡潔にまとめてください。
+質問に関係する内容がなければ「{NOT_RELEVANT}」とだけ答えてください。
+
+---
+{chunk}
+---"""
+
+    @staticmethod
+    def _merge_prompt(question: str, notes: List[str]) -> str:
+        joined = "\n\n".join(notes)
+        return f"""{question}
+
+以下は文書の各部分から抜き出した要点です。上の質問に関係する要点を、重複を除いて箇条書きで1つにまとめてください。
+
+{joined}"""
+
+    @staticmethod
+    def _reduce_prompt(question: str, notes: List[str]) -> str:
+        joined = "\n\n".join(f"【部分{i}】\n{note}" for i, note in enumerate(notes, start=1))
+        return f"""{question}
+
+以下は添付された文書を分割して読んだ、各部分の要点です。これらを踏まえて、上の質問に対するあなた自身の見解を述べてください。
+
+{joined}"""
@@ -0,0 +1,473 @@
+"""
+MAGI Job Queue - バックグラウンドでの審議ジョブ実行
+Streamlitの再実行やブラウザのリロードで処理中の審議が失われないよう、
+ワーカープールで実行し、結果をディスクに永続化する
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import concurrent.futures
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional
+
+from scheduler import BATCH, INTERACTIVE, LANES, scheduling
+from shared_state import digest
+from timing import Trace, tracing
+
+
+# ジョブのステータス
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+INTERRUPTED = "interrupted"  # プロセス再起動などで実行が途切れたジョブ
+
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+# 事前審議（ウォームアップ）のジョブをスケジューラーでまとめて扱うセッション名
+PREFETCH_SESSION = "prefetch"
+
+
+@dataclass
+class Job:
+    """審議ジョブ"""
+    job_id: str
+    kind: str  # analyze / vote / rank / tournament / vote_approve_reject / deliberate / analyze_document
+    params: Dict
+    dedupe_key: str
+    status: str = PENDING
+    progress: Dict = field(default_factory=dict)  # ユニット名 -> 途中結果
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    attached: int = 1  # このジョブを共有している投入数
+    lane: str = INTERACTIVE  # モデル呼び出しの優先度（interactive / batch）
+    session: str = "default"  # スケジューラーで公平に扱う単位（投入元のセッション）
+    trace: bool = False  # モデル呼び出しの所要時間の内訳を計測するか
+    timings: Optional[Dict] = None  # 所要時間の内訳（timing.Trace.to_dict()）
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+
+def _run_analyze(magi, progress, question: str, temperature: float = 0.7) -> Dict:
+    return asdict(magi.analyze(question, temperature=temperature, on_progress=progress))
+
+
+def _run_vote(
+    magi, progress, question: str, options: List[str], temperature: float = 0.7, samples: int = 1
+) -> Dict:
+    votes = magi.vote(question, options, temperature=temperature, on_progress=progress, samples=samples)
+    return {"votes": votes}
+
+
+def _run_rank(
+    magi, progress, question: str, options: List[str], temperature: float = 0.7, batch_size: int = 8
+) -> Dict:
+    return asdict(magi.rank_vote(
+        question, options, temperature=temperature, batch_size=batch_size, on_progress=progress
+    ))
+
+
+def _run_tournament(
+    magi, progress, question: str, candidates: List[str], temperature: float = 0.7,
+    max_calls: Optional[int] = None
+) -> Dict:
+    from tournament import Tournament
+
+    tournament = Tournament(magi, question, temperature=temperature, max_calls=max_calls)
+    return asdict(tournament.run(candidates, on_progress=progress))
+
+
+def _run_vote_approve_reject(
+    magi, progress, proposal: str, temperature: float = 0.7, samples: int = 1
+) -> Dict:
+    votes, reasons = magi.vote_approve_reject(
+        proposal, temperature=temperature, on_progress=progress, samples=samples
+    )
+    return {"votes": votes, "reasons": reasons}
+
+
+def _run_deliberate(magi, progress, proposal: str, rounds: int = 3, temperature: float = 0.7) -> Dict:
+    return asdict(magi.deliberate(proposal, rounds=rounds, temperature=temperature, on_progress=progress))
+
+
+def _run_analyze_document(magi, progress, question: str, document: str, temperature: float = 0.7) -> Dict:
+    # document_analysisはmagi_systemを読み込むため、get_job_queueと同様に実行時まで読み込まない
+    from document_analysis import DocumentAnalyzer
+
+    analyzer = DocumentAnalyzer(magi, temperature=temperature)
+    return asdict(analyzer.analyze(question, document, on_progress=progress))
+
+
+# ジョブ種別ごとの実行関数
+# (MAGISystem, 進捗コールバック, **params) を受け取り、JSONに永続化できるdictを返す
+JOB_HANDLERS: Dict[str, Callable[..., Dict]] = {
+    "analyze": _run_analyze,
+    "vote": _run_vote,
+    "rank": _run_rank,
+    "tournament": _run_tournament,
+    "vote_approve_reject": _run_vote_approve_reject,
+    "deliberate": _run_deliberate,
+    "analyze_document": _run_analyze_document,
+}
+
+
+class JobQueue:
+    """
+    審議ジョブをバックグラウンドのワーカープールで実行するキュー
+
+    - ジョブIDで結果を参照でき、別セッションからも再接続できる
+    - 同一内容の実行中ジョブは重複排除され、モデル呼び出しを共有する
+    - 結果はstore_dirにJSONとして保存される
+    - prefetchで事前に実行したジョブの結果は、prefetch_ttlの間は同じ内容の投入に再利用される
+    - ワーカープールはレーンごとに分け、batchレーンのジョブ（事前審議など）が詰まっていても
+      interactiveレーンのジョブはその後ろに並ばずに開始する
+    """
+
+    def __init__(
+        self,
+        magi_factory: Callable[[], object],
+        max_workers: int = 4,
+        batch_workers: int = 2,
+        store_dir: Optional[str] = None,
+        max_jobs_in_memory: int = 200,
+        prefetch_ttl: float = 3600.0,
+        progress_persist_interval: float = 2.0
+    ):
+        """
+        Args:
+            magi_factory: MAGISystemを生成する関数（最初のジョブ実行時に1度だけ呼ばれる）
+            max_workers: interactiveレーンのジョブを同時に実行する数
+            batch_workers: batchレーンのジョブを同時に実行する数
+            store_dir: 結果の保存先ディレクトリ
+            max_jobs_in_memory: メモリ上に保持する完了済みジョブの上限
+            prefetch_ttl: 事前に実行したジョブの結果を再利用する期間（秒）
+            progress_persist_interval: 途中経過をディスクに書き出す最小間隔（秒）。
+                                       ステータスの変化（開始・完了・失敗）は常に書き出す
+        """
+        self._magi_factory = magi_factory
+        self._magi = None
+        self._executors = {
+            INTERACTIVE: concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="magi-job"
+            ),
+            BATCH: concurrent.futures.ThreadPoolExecutor(
+                max_workers=batch_workers,
+                thread_name_prefix="magi-batch-job"
+            ),
+        }
+        self._store_dir = store_dir or os.environ.get("MAGI_JOB_DIR", ".magi_jobs")
+        os.makedirs(self._store_dir, exist_ok=True)
+        self._max_jobs_in_memory = max_jobs_in_memory
+        self._prefetch_ttl = prefetch_ttl
+        self._progress_persist_interval = progress_persist_interval
+
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[str, str] = {}  # dedupe_key -> job_id
+        self._done_events: Dict[str, threading.Event] = {}
+        self._prefetched: Dict[str, str] = {}  # dedupe_key -> 事前に実行したジョブのjob_id
+
+    # ------------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------------
+
+    def submit(
+        self,
+        kind: str,
+        lane: str = INTERACTIVE,
+        session: str = "default",
+        trace: bool = False,
+        **params
+    ) -> str:
+        """
+        ジョブを投入する
+
+        同じ内容のジョブが実行中であれば新しいジョブは作らず、そのジョブIDを返す
+        （batchのジョブにinteractiveで相乗りした場合は、そのジョブをinteractiveに引き上げる。
+        開始前であればinteractiveのワーカープールで開始し、実行中であれば以降のモデル呼び出しをinteractiveで行う）
+
+        Args:
+            kind: ジョブ種別（analyze / vote / rank / tournament / vote_approve_reject / deliberate / analyze_document）
+            lane: モデル呼び出しの優先度（interactive / batch）
+            session: スケジューラーで公平に扱う単位（Streamlitのセッションなど）
+            trace: モデル呼び出しの所要時間の内訳を計測するか（診断パネル用）
+            **params: 実行関数に渡すパラメータ
+
+        Returns:
+            ジョブID
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"未知のジョブ種別です: {kind}")
+        if lane not in LANES:
+            raise ValueError(f"未知のレーンです: {lane}")
+
+        dedupe_key = self._dedupe_key(kind, params)
+
+        start_interactive = False
+        with self._lock:
+            job_id = self._inflight.get(dedupe_key) or self._reusable_prefetch(dedupe_key)
+            attached = job_id is not None
+            if attached:
+                job = self._jobs[job_id]
+                job.attached += 1
+                if lane == INTERACTIVE and job.lane == BATCH and job.is_active:
+                    job.lane = INTERACTIVE
+                    start_interactive = job.status == PENDING
+            else:
+                job_id = uuid.uuid4().hex[:16]
+                job = Job(
+                    job_id=job_id, kind=kind, params=params, dedupe_key=dedupe_key,
+                    lane=lane, session=session, trace=trace
+                )
+                self._jobs[job_id] = job
+                self._inflight[dedupe_key] = job_id
+                self._done_events[job_id] = threading.Event()
+
+        if attached:
+            if start_interactive:
+                # batchのワーカープールに投入済みの分は、_runが開始済みであることを確認して何もしない
+                self._executors[INTERACTIVE].submit(self._run, job_id)
+            return job_id
+
+        self._persist(job)
+        self._executors[lane].submit(self._run, job_id)
+        return job_id
+
+    def prefetch(self, kind: str, **params) -> str:
+        """
+        ジョブをbatchレーンで事前に実行する
+
+        完了後prefetch_ttlの間は、同じ内容のジョブを投入すると新たに実行せずにこのジョブIDを返す
+        （サンプルの提案など、よく使われる審議の最初のクリックを即座に返すため）
+
+        Args:
+            kind: ジョブ種別
+            **params: 実行関数に渡すパラメータ（アプリから投入されるものと同じ値にする）
+
+        Returns:
+            ジョブID
+        """
+        job_id = self.submit(kind, lane=BATCH, session=PREFETCH_SESSION, **params)
+        with self._lock:
+            self._prefetched[self._dedupe_key(kind, params)] = job_id
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        ジョブを取得する（メモリになければ保存済みの結果を読み込む）
+
+        Args:
+            job_id: ジョブID
+
+        Returns:
+            Job（存在しない場合はNone）
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return self._load(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        ジョブの完了を待つ
+
+        Args:
+            job_id: ジョブID
+            timeout: 最大待機時間（秒）
+
+        Returns:
+            Job（存在しない場合はNone）
+        """
+        with self._lock:
+            event = self._done_events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get(job_id)
+
+    def active_count(self, session: Optional[str] = None) -> int:
+        """
+        実行中・待機中のジョブ数
+
+        Args:
+            session: 投入元のセッション（Noneの場合はすべて）
+
+        Returns:
+            ジョブ数
+        """
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if job.is_active and (session is None or job.session == session)
+            )
+
+    def list_jobs(self, limit: int = 20) -> List[Job]:
+        """
+        メモリ上のジョブを新しい順に返す
+
+        Args:
+            limit: 最大件数
+
+        Returns:
+            Jobのリスト
+        """
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return jobs[:limit]
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _dedupe_key(kind: str, params: Dict) -> str:
+        return digest({"kind": kind, "params": params})
+
+    def _reusable_prefetch(self, dedupe_key: str) -> Optional[str]:
+        """再利用できる事前実行の結果のジョブID（self._lockを取得した状態で呼ぶ）"""
+        job = self._jobs.get(self._prefetched.get(dedupe_key, ""))
+        if job is None or job.status != DONE or time.time() - job.finished_at > self._prefetch_ttl:
+            return None
+        return job.job_id
+
+    @property
+    def magi(self):
+        """ジョブの実行に使うMAGISystem（最初のアクセス時に生成）"""
+        with self._lock:
+            if self._magi is None:
+                self._magi = self._magi_factory()
+            return self._magi
+
+    def _run(self, job_id: str):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job.status != PENDING:
+                # 優先度を引き上げたジョブは両方のワーカープールに投入されるため、先に開始した方だけが実行する
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        self._persist(job)
+
+        # 途中経過は同じプロセスからはメモリ上のジョブで参照できるため、ディスクへは間隔を空けて書き出す
+        # （長い文書の分析などで進捗のたびにparamsを含むジョブ全体を書き出さない）
+        last_persisted = time.monotonic()
+
+        def progress(unit: str, info: Dict):
+            nonlocal last_persisted
+            with self._lock:
+                job.progress[unit] = info
+                now = time.monotonic()
+                due = now - last_persisted >= self._progress_persist_interval
+                if due:
+                    last_persisted = now
+            if due:
+                self._persist(job)
+
+        try:
+            magi = self.magi
+            # レーンはモデル呼び出しのたびに参照し、実行中にinteractiveへ引き上げられた場合も反映する
+            with scheduling(lambda: job.lane, job.session), tracing(Trace() if job.trace else None) as trace:
+                try:
+                    result = JOB_HANDLERS[job.kind](magi, progress, **job.params)
+                finally:
+                    if trace is not None:
+                        job.timings = trace.to_dict()
+            with self._lock:
+                job.result = result
+                job.status = DONE
+        except Exception as e:
+            with self._lock:
+                job.error = str(e)
+                job.status = ERROR
+        finally:
+            with self._lock:
+                job.finished_at = time.time()
+                self._inflight.pop(job.dedupe_key, None)
+                event = self._done_events.pop(job_id, None)
+            self._persist(job)
+            if event is not None:
+                event.set()
+            self._prune()
+
+    def _prune(self):
+        """完了済みジョブをメモリから追い出す（ディスクには残る）"""
+        with self._lock:
+            if len(self._jobs) <= self._max_jobs_in_memory:
+                return
+            finished = sorted(
+                (j for j in self._jobs.values() if not j.is_active),
+                key=lambda j: j.created_at
+            )
+            for job in finished[:len(self._jobs) - self._max_jobs_in_memory]:
+                del self._jobs[job.job_id]
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self._store_dir, f"{job_id}.json")
+
+    def _persist(self, job: Job):
+        """ジョブをアトミックに書き出す"""
+        with self._lock:
+            data = asdict(job)
+        path = self._path(job.job_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            # 永続化の失敗でジョブ自体は失敗させない
+            pass
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        # ジョブIDはURLなど外部から渡されるため、パスとして安全な値のみ受け付ける
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        job = Job(**data)
+        # メモリにない実行中ジョブは、別プロセスか再起動前のプロセスで途切れたもの
+        if job.is_active:
+            job.status = INTERRUPTED
+        return job
+
+
+_default_queue: Optional[JobQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    プロセス全体で共有するJobQueueを取得
+
+    Returns:
+        JobQueue
+    """
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            from magi_system import MAGISystem
+            from response_cache import ResponseCache
+            from shared_state import get_shared_state
+            max_workers = int(os.environ.get("MAGI_JOB_WORKERS", "4"))
+            batch_workers = int(os.environ.get("MAGI_JOB_BATCH_WORKERS", "2"))
+            shared = get_shared_state()
+            if shared is None:
+                factory = MAGISystem
+            else:
+                # 複数のワーカープロセスで回答キャッシュを共有する
+                def factory():
+                    return MAGISystem(response_cache=ResponseCache(shared=shared))
+            _default_queue = JobQueue(factory, max_workers=max_workers, batch_workers=batch_workers)
+        return _default_queue
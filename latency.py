@@ -0,0 +1,227 @@
+"""
+Latency - エンドポイントごとの応答時間の分布と適応的なタイムアウト
+HDRヒストグラムと同様の対数-線形バケットで応答時間を集計し（メモリ使用量は一定）、
+観測した分布の上位パーセンタイルからリクエストごとのタイムアウトを決める
+"""
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+
+# 2のべき乗ごとのバケット数（相対誤差は約1/32 = 3%）
+SUB_BUCKETS = 32
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+
+# 記録できる最大値（ミリ秒、約70分）。これを超える値は最大値として記録する
+MAX_MS = (1 << 22) - 1
+
+# 入力トークン数の区分（上限, 名前）。応答時間は入力の長さで大きく変わるため、区分ごとに分布を分ける
+SIZE_CLASSES: Tuple[Tuple[int, str], ...] = ((1024, "<1k"), (4096, "<4k"), (16384, "<16k"), (65536, "<64k"))
+LARGEST_SIZE_CLASS = "64k+"
+
+
+def _index(ms: int) -> int:
+    """ミリ秒の値をバケット番号に変換"""
+    if ms < SUB_BUCKETS:
+        return ms
+    shift = ms.bit_length() - _SUB_BITS - 1
+    return SUB_BUCKETS * shift + (ms >> shift)
+
+
+def size_class(input_tokens: int) -> str:
+    """入力トークン数の区分名"""
+    for limit, name in SIZE_CLASSES:
+        if input_tokens < limit:
+            return name
+    return LARGEST_SIZE_CLASS
+
+
+def _upper(index: int) -> int:
+    """バケットに入る最大の値（ミリ秒）"""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    sub = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((sub + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    応答時間のヒストグラム（対数-線形バケット、スレッドセーフ）
+
+    記録数がdecay_atに達するたびに全バケットを半分にし、古い観測の影響を徐々に減らす
+    """
+
+    def __init__(self, decay_at: int = 10000):
+        self._counts: List[int] = [0] * (_index(MAX_MS) + 1)
+        self._total = 0
+        self._decay_at = decay_at
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return self._total
+
+    def record(self, seconds: float):
+        ms = min(max(int(seconds * 1000), 0), MAX_MS)
+        with self._lock:
+            self._counts[_index(ms)] += 1
+            self._total += 1
+            if self._total >= self._decay_at:
+                self._counts = [count // 2 for count in self._counts]
+                self._total = sum(self._counts)
+
+    def percentile(self, q: float) -> float:
+        """
+        Args:
+            q: パーセンタイル（0〜100）
+
+        Returns:
+            応答時間（秒、記録がない場合は0.0）
+        """
+        with self._lock:
+            if self._total == 0:
+                return 0.0
+            target = max(1, int(self._total * q / 100 + 0.5))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return _upper(index) / 1000
+        return MAX_MS / 1000
+
+
+class LatencyTracker:
+    """
+    エンドポイントと入力トークン数の区分ごとに応答時間を集計し、タイムアウトを決める
+
+    - 観測数がmin_samplesに満たない間は既定のタイムアウトを使う
+    - 十分な観測があれば p99 × multiplier を [min_timeout, max_timeout] に収めた値を使う
+      （速いモデルは応答が止まった時に早く失敗し、遅い推論モデルは途中で打ち切られない）
+    - タイムアウトしたリクエストは打ち切った時間で分布に含める（実際の応答時間はそれ以上のため、
+      タイムアウトが続くとp99が打ち切った時間に近づき、次のタイムアウトが延びる）
+    - 短い投票と長い文書の要約で分布を分け、短いリクエストの分布で長いリクエストを打ち切らない
+    """
+
+    def __init__(
+        self,
+        default_timeout: float = 120.0,
+        min_timeout: float = 15.0,
+        max_timeout: float = 300.0,
+        multiplier: float = 2.0,
+        min_samples: int = 20
+    ):
+        """
+        Args:
+            default_timeout: 観測が少ない間のタイムアウト（秒）
+            min_timeout: タイムアウトの下限（秒）
+            max_timeout: タイムアウトの上限（秒）
+            multiplier: p99に掛ける余裕の倍率
+            min_samples: 観測した分布を使い始める観測数
+        """
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._timeouts: Dict[Tuple[str, str], int] = {}
+
+    def _histogram(self, endpoint: str, input_tokens: int) -> LatencyHistogram:
+        key = (endpoint, size_class(input_tokens))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            return histogram
+
+    def record(self, endpoint: str, seconds: float, input_tokens: int = 0):
+        """
+        成功したリクエストの応答時間を記録
+
+        Args:
+            endpoint: エンドポイント名
+            seconds: 応答時間（秒）
+            input_tokens: 入力トークン数（の見積もり）
+        """
+        self._histogram(endpoint, input_tokens).record(seconds)
+
+    def record_timeout(self, endpoint: str, seconds: float, input_tokens: int = 0):
+        """
+        タイムアウトしたリクエストを記録
+
+        Args:
+            endpoint: エンドポイント名
+            seconds: 打ち切った時間（秒、分布にはこの値で含める）
+            input_tokens: 入力トークン数（の見積もり）
+        """
+        self._histogram(endpoint, input_tokens).record(seconds)
+        key = (endpoint, size_class(input_tokens))
+        with self._lock:
+            self._timeouts[key] = self._timeouts.get(key, 0) + 1
+
+    def timeout_for(self, endpoint: str, input_tokens: int = 0) -> float:
+        """
+        1回のリクエストのタイムアウト
+
+        Args:
+            endpoint: エンドポイント名
+            input_tokens: 入力トークン数（の見積もり）
+
+        Returns:
+            タイムアウト（秒）
+        """
+        return self._timeout(self._histogram(endpoint, input_tokens))
+
+    def _timeout(self, histogram: LatencyHistogram) -> float:
+        if histogram.count < self.min_samples:
+            return self.default_timeout
+        timeout = histogram.percentile(99) * self.multiplier
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def deadline_for(self, requests: Iterable[Tuple[str, int]], default: float, retries: int = 1) -> float:
+        """
+        複数のエンドポイントに並列に問い合わせる場合の全体の期限
+
+        最も遅いリクエストに合わせる。1回目がタイムアウトしても、バックオフ（1秒, 2秒, ...）の後の
+        リトライがp99の応答時間で終わるだけの余裕を加える。いずれかの観測が少ない場合はdefaultを使う
+
+        Args:
+            requests: (エンドポイント名, 入力トークン数) のリスト
+            default: 観測が少ない場合の期限（秒）
+            retries: 1リクエストあたりの最大試行回数（chat_completionのmax_retries）
+
+        Returns:
+            期限（秒）
+        """
+        deadlines = []
+        for endpoint, input_tokens in requests:
+            histogram = self._histogram(endpoint, input_tokens)
+            if histogram.count < self.min_samples:
+                return default
+            p99 = histogram.percentile(99)
+            deadlines.append(
+                self._timeout(histogram) + sum(2 ** attempt + p99 for attempt in range(retries - 1))
+            )
+        return max(deadlines, default=default)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Returns:
+            エンドポイント名 -> 入力トークン数の区分 -> {"count", "timeouts", "p50", "p90", "p99", "timeout"}
+            （countはタイムアウトを含む）
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            timeouts = dict(self._timeouts)
+        stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (endpoint, size), histogram in histograms.items():
+            stats.setdefault(endpoint, {})[size] = {
+                "count": histogram.count,
+                "timeouts": timeouts.get((endpoint, size), 0),
+                "p50": histogram.percentile(50),
+                "p90": histogram.percentile(90),
+                "p99": histogram.percentile(99),
+                "timeout": self._timeout(histogram),
+            }
+        return stats
@@ -2,23 +2,113 @@
 MAGI System - Multiple AI General Intelligence
 3つのAIモデルによる多数決型意思決定システム
 """
-import re
+import os
+import math
+import time
 import concurrent.futures
-from typing import Dict, List, Tuple
-from dataclasses import dataclass
-from databricks_client import DatabricksClient
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from dataclasses import asdict, dataclass
+from databricks_client import MAX_RETRIES, DatabricksClient
+from single_flight import SingleFlight
+from response_cache import ResponseCache
+from council import Council, CouncilDecision, CouncilUnit
+from vote_parser import parse_approve_reject, parse_option, parse_ranking
+from scheduler import Scheduler, SchedulerBusy, submit_in_context
+from consensus import CONSENSUS_PROGRESS_KEY, ConsensusTracker, is_valid_answer
+from shared_state import get_shared_state
+import timing
 
 
-@dataclass
+# 応答時間の観測が少ない間の、全ユニットへの問い合わせの期限（秒）
+DEFAULT_FAN_OUT_TIMEOUT = 180.0
+
+# プロセス内で共有するsingle-flight（複数ユーザーの同一クエリを1回の呼び出しにまとめる）
+# MAGI_SHARED_STATE_PATHが設定されていれば他のプロセスの同一クエリもまとめる
+_query_flight = SingleFlight(shared=get_shared_state())
+
+# プロセス内で共有するスケジューラー（対話的な呼び出しをバッチより優先し、セッションごとに公平に実行する）
+_scheduler = Scheduler.from_env()
+
+
+@dataclass(frozen=True, slots=True)
 class MAGIResponse:
     """MAGIシステムからの回答"""
-    melchior: str  # GPT-5
-    balthasar: str  # Claude Opus 4.1
-    casper: str  # Gemini 2.5 Pro
+    answers: Dict[str, str]  # ユニット名 -> 回答
     consensus: str
     agreement_score: float
     winning_model: str
 
+    @classmethod
+    def from_dict(cls, data: Dict) -> "MAGIResponse":
+        """
+        保存した回答（asdictの結果）から復元する
+
+        ユニットごとの回答をmelchior / balthasar / casperのキーで持っていた以前の形式も読み込む
+        """
+        if "answers" not in data:
+            data = dict(data)
+            data["answers"] = {
+                name: data.pop(name.lower()) for name in ("MELCHIOR", "BALTHASAR", "CASPER") if name.lower() in data
+            }
+        return cls(**data)
+
+    @property
+    def melchior(self) -> str:
+        return self.answers.get("MELCHIOR", "")  # GPT-5
+
+    @property
+    def balthasar(self) -> str:
+        return self.answers.get("BALTHASAR", "")  # Claude Opus 4.1
+
+    @property
+    def casper(self) -> str:
+        return self.answers.get("CASPER", "")  # Gemini 2.5 Pro
+
+
+@dataclass(frozen=True, slots=True)
+class UnitResult:
+    """1ユニットの回答"""
+    answer: str
+    status: str  # success / error / timeout
+
+
+@dataclass(frozen=True, slots=True)
+class UnitVote:
+    """1ユニットの複数サンプルを集計した投票"""
+    vote: str  # 多数派の投票（判別できない場合は「不明」）
+    confidence: float  # 全サンプルに占める多数派の割合
+    tally: Dict[str, int]  # 投票ごとのサンプル数
+    draws: int  # 実際に取得したサンプル数
+    answer: str  # 多数派の回答の1つ（判断理由として表示する）
+
+
+@dataclass(frozen=True, slots=True)
+class RankedVoteResult:
+    """順位付け投票（ボルダ方式）の結果"""
+    ranking: List[str]  # 全選択肢の最終順位（上位から）
+    scores: Dict[str, float]  # 決勝ラウンドの各選択肢のボルダ得点（ユニットの重み付き）
+    ballots: Dict[str, List[str]]  # 決勝ラウンドの各ユニットの順位
+    rounds: int  # 実施したラウンド数
+    calls: int  # モデルの呼び出し回数
+
+
+@dataclass(frozen=True, slots=True)
+class DeliberationRound:
+    """討論の1ラウンド分の投票と理由"""
+    round: int
+    votes: Dict[str, str]
+    reasons: Dict[str, str]
+
+
+@dataclass(frozen=True, slots=True)
+class DeliberationResult:
+    """複数ラウンドの討論の結果"""
+    votes: Dict[str, str]  # 最終ラウンドの投票
+    reasons: Dict[str, str]  # 最終ラウンドの理由
+    rounds: List[DeliberationRound]
+    converged: bool  # 投票が安定して早期終了したか
+
 
 class MAGISystem:
     """
@@ -60,193 +150,311 @@ class MAGISystem:
 回答の中でMAGIシステムの名前を言及する必要はありません。"""
     }
 
-    def __init__(self):
+    def __init__(
+        self,
+        response_cache: Optional[ResponseCache] = None,
+        council: Optional[Council] = None
+    ):
         """
         Databricks SDKを使って環境変数から自動的に認証情報を取得
+
+        Args:
+            response_cache: 回答キャッシュ（Noneの場合は毎回モデルに問い合わせる）
+            council: 審議に参加するユニットの構成（Noneの場合はdefault_council()）
         """
         self.client = DatabricksClient()
-        self.models = {
-            "MELCHIOR": self.MELCHIOR,
-            "BALTHASAR": self.BALTHASAR,
-            "CASPER": self.CASPER
-        }
+        self.response_cache = response_cache
+        self.council = council or self.default_council()
+        self.models = {unit.name: unit.model_id for unit in self.council.units}
+        self.personas = {unit.name: unit.persona for unit in self.council.units}
+        self.single_flight = _query_flight
+        self.scheduler = _scheduler
+
+    @classmethod
+    def default_council(cls) -> Council:
+        """
+        既定のユニット構成
+
+        環境変数MAGI_COUNCIL_CONFIGに設定ファイルが指定されていればそれを読み込み、
+        なければMELCHIOR・BALTHASAR・CASPERの3ユニットで構成する
+
+        Returns:
+            Council
+        """
+        config_path = os.environ.get("MAGI_COUNCIL_CONFIG")
+        if config_path:
+            return Council.from_config(config_path, cls.PERSONALITIES)
+
+        return Council([
+            CouncilUnit("MELCHIOR", cls.MELCHIOR, cls.PERSONALITIES["MELCHIOR"], label="GPT-5 (科学者)"),
+            CouncilUnit("BALTHASAR", cls.BALTHASAR, cls.PERSONALITIES["BALTHASAR"], label="Claude Opus 4 (母)"),
+            CouncilUnit("CASPER", cls.CASPER, cls.PERSONALITIES["CASPER"], label="Gemini 2.5 Pro (女性)"),
+        ])
+
+    @property
+    def coalesced_requests(self) -> int:
+        """実行中の同一クエリに相乗りしたリクエスト数"""
+        return self.single_flight.coalesced
 
     def query_model(
         self,
         model_name: str,
         model_id: str,
         question: str,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        sample: int = 0,
+        deadline: Optional[float] = None
     ) -> Tuple[str, str, str]:
         """
         単一のモデルにクエリを送信
 
         Args:
-            model_name: モデルの名前（MELCHIOR/BALTHASAR/CASPER）
+            model_name: ユニット名（MELCHIOR/BALTHASAR/CASPERなど）
             model_id: モデルのID
             question: 質問
             temperature: 温度パラメータ
+            sample: サンプル番号（同じ質問から複数の回答を得る場合に、
+                    まとめ実行やキャッシュで同じ回答が返らないよう区別する）
+            deadline: リトライを含めた期限（time.monotonic()の時刻）
 
         Returns:
             (モデル名, 回答テキスト, ステータス)
         """
-        # 各モデルに人格設定を追加
-        messages = [
-            {"role": "system", "content": self.PERSONALITIES[model_name]},
+        # GPT-5はreasoning modelなので推論トークンを多く消費するため大きなmax_tokensが必要
+        max_tokens = 16000 if "gpt-5" in model_id.lower() else 4000
+
+        key = (model_id, model_name, question, temperature, max_tokens, sample)
+
+        # 診断パネル用の区間の記録（計測が無効の場合はcallがNoneで何も記録しない）
+        with timing.timed_call(f"{model_name} #{sample + 1}" if sample else model_name) as call:
+            started = time.perf_counter()
+            if self.response_cache is not None:
+                cached = self.response_cache.get(key + (self.personas[model_name],))
+                if cached is not None:
+                    if call is not None:
+                        call.add(timing.CACHE, started, time.perf_counter())
+                    return cached
+
+            def run():
+                # 実行枠を得るまでの待ち時間を記録してからモデルへ送信する
+                if call is not None:
+                    call.add(timing.QUEUE, started, time.perf_counter())
+                return self._query_model(model_name, model_id, question, temperature, max_tokens, deadline)
+
+            # 同じ(モデル, 人格, プロンプト, パラメータ)のクエリが実行中であれば、その結果を共有する
+            # 実際にモデルへ送信する呼び出しだけがスケジューラーの実行枠を使う
+            try:
+                result = self.single_flight.do(key, lambda: self.scheduler.run(run))
+            except SchedulerBusy as e:
+                return (model_name, f"エラー: {e}", "error")
+            if call is not None and not call.phases:
+                # 他の呼び出しの結果を受け取った（このスレッドではモデルへ送信していない）
+                call.add(timing.COALESCED, started, time.perf_counter())
+            # 他のプロセスから受け取った結果はJSONから復元したリストのため、タプルに揃える
+            result = tuple(result)
+
+            # エラーや空の回答は再試行できるようにキャッシュしない
+            if self.response_cache is not None and result[2] == "success" and not result[1].startswith("回答なし"):
+                self.response_cache.put(key + (self.personas[model_name],), result)
+            return result
+
+    def _messages(self, model_name: str, question: str) -> List[Dict[str, str]]:
+        """各モデルに人格設定を追加したチャットメッセージ"""
+        return [
+            {"role": "system", "content": self.personas[model_name]},
             {"role": "user", "content": question}
         ]
 
-        # GPT-5はreasoning modelなので推論トークンを多く消費するため大きなmax_tokensが必要
-        max_tokens = 16000 if "gpt-5" in model_id.lower() else 4000
+    def _query_model(
+        self,
+        model_name: str,
+        model_id: str,
+        question: str,
+        temperature: float,
+        max_tokens: int,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, str, str]:
+        """query_modelの実処理（single-flightを経由せずにモデルへ送信）"""
+        messages = self._messages(model_name, question)
 
         try:
-            response = self.client.chat_completion(
+            # max_tokensで途切れた場合は、途中までの回答を使って続きを書かせる
+            response = self.client.chat_completion_with_continuation(
                 model=model_id,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                deadline=deadline
             )
             answer = self.client.get_response_text(response)
-            status = "success" if "error" not in response else "error"
+            status = "success" if response.error is None else "error"
             return (model_name, answer, status)
         except Exception as e:
             return (model_name, f"エラー: {str(e)}", "error")
 
-    def analyze(
+    def _fan_out(
         self,
-        question: str,
-        temperature: float = 0.7,
-        timeout: int = 180
-    ) -> MAGIResponse:
+        question: Union[str, Dict[str, str]],
+        temperature: float,
+        timeout: Optional[float] = None,
+        on_result: Optional[Callable[[str, UnitResult], None]] = None
+    ) -> Dict[str, UnitResult]:
         """
-        3つのモデルに同時にクエリを送信し、結果を分析
+        全ユニットに並列でクエリを送信し、完了したものから結果を集める
 
         Args:
-            question: 質問
+            question: 質問（モデル名 -> 質問のdictを渡すとモデルごとに異なる質問を送る）
             temperature: 温度パラメータ
-            timeout: タイムアウト（秒）
+            timeout: タイムアウト（秒、Noneの場合は各エンドポイントの応答時間の分布から決める）
+            on_result: 各モデルの結果が届くたびに (モデル名, UnitResult) で呼ばれる
 
         Returns:
-            MAGIResponse
+            モデル名 -> UnitResult
         """
         results = {}
+        questions = question if isinstance(question, dict) else {name: question for name in self.models}
+
+        if timeout is None:
+            # 応答時間は入力の長さで変わるため、各ユニットの入力トークン数の見積もりごとの分布から決める
+            timeout = self.client.latency.deadline_for(
+                (
+                    (
+                        self.models[name],
+                        self.client.token_budget.estimate(self.models[name], self._messages(name, unit_question))
+                    )
+                    for name, unit_question in questions.items()
+                ),
+                DEFAULT_FAN_OUT_TIMEOUT,
+                retries=MAX_RETRIES
+            )
+        # 各リクエストのリトライも同じ期限で打ち切り、タイムアウト後にワーカーが残り続けないようにする
+        deadline = time.monotonic() + timeout
 
-        # 3つのモデルに並列でクエリを送信
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        def record(model_name: str, answer: str, status: str):
+            results[model_name] = UnitResult(answer, status)
+            if on_result is not None:
+                on_result(model_name, results[model_name])
+
+        # ユニット数が増えても同時リクエスト数はcouncil.max_workersで抑える
+        max_workers = min(len(questions), self.council.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = {
-                executor.submit(
+                submit_in_context(
+                    executor,
                     self.query_model,
                     name,
-                    model_id,
-                    question,
-                    temperature
+                    self.models[name],
+                    unit_question,
+                    temperature,
+                    deadline=deadline
                 ): name
-                for name, model_id in self.models.items()
+                for name, unit_question in questions.items()
             }
 
             try:
                 for future in concurrent.futures.as_completed(futures, timeout=timeout):
                     try:
                         model_name, answer, status = future.result()
-                        results[model_name] = {"answer": answer, "status": status}
+                        record(model_name, answer, status)
                     except Exception as e:
                         # 個別のfutureでエラーが発生した場合
-                        model_name = futures[future]
-                        results[model_name] = {"answer": f"エラー: {str(e)}", "status": "error"}
+                        record(futures[future], f"エラー: {str(e)}", "error")
             except concurrent.futures.TimeoutError:
                 # タイムアウトした場合、未完了のfutureを処理
                 for future, model_name in futures.items():
                     if model_name not in results:
-                        results[model_name] = {"answer": "タイムアウト: 応答時間を超過しました", "status": "timeout"}
-
-        # 回答の取得（デフォルト値を設定）
-        melchior_answer = results.get("MELCHIOR", {}).get("answer", "回答なし（エラー）")
-        balthasar_answer = results.get("BALTHASAR", {}).get("answer", "回答なし（エラー）")
-        casper_answer = results.get("CASPER", {}).get("answer", "回答なし（エラー）")
-
-        # コンセンサスの分析
-        consensus, agreement_score, winning_model = self._analyze_consensus(
-            melchior_answer,
-            balthasar_answer,
-            casper_answer
-        )
+                        record(model_name, "タイムアウト: 応答時間を超過しました", "timeout")
 
-        return MAGIResponse(
-            melchior=melchior_answer,
-            balthasar=balthasar_answer,
-            casper=casper_answer,
-            consensus=consensus,
-            agreement_score=agreement_score,
-            winning_model=winning_model
-        )
+        return results
 
-    def _analyze_consensus(
+    def analyze(
         self,
-        melchior: str,
-        balthasar: str,
-        casper: str
-    ) -> Tuple[str, float, str]:
+        question: str,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        on_progress: Optional[Callable[[str, Dict[str, str]], None]] = None
+    ) -> MAGIResponse:
         """
-        3つの回答からコンセンサスを分析
+        全ユニットに同時にクエリを送信し、結果を分析
 
         Args:
-            melchior: Melchiorの回答
-            balthasar: Balthasarの回答
-            casper: Casperの回答
+            question: 質問
+            temperature: 温度パラメータ
+            timeout: タイムアウト（秒、Noneの場合は各エンドポイントの応答時間の分布から決める）
+            on_progress: 各モデルの回答が届くたびに (モデル名, {"answer", "status"}) で呼ばれ、続けて
+                         ("consensus", {"consensus", "agreement_score", "winning_model", "arrived", "total"})
+                         で暫定のコンセンサスが渡される
 
         Returns:
-            (コンセンサステキスト, 一致度スコア, 選択されたモデル名)
+            MAGIResponse
         """
-        answers = [
-            ("MELCHIOR", melchior),
-            ("BALTHASAR", balthasar),
-            ("CASPER", casper)
-        ]
+        # 回答が届くたびに暫定のコンセンサスを更新する（全回答の到着後に必要なのは最後の回答の分の計算だけ）
+        tracker = self._consensus_tracker()
 
-        # エラー回答を除外
-        valid_answers = [
-            (name, ans) for name, ans in answers
-            if not ans.startswith("エラー:")
-            and not ans.startswith("タイムアウト:")
-            and not ans.startswith("回答なし")
-        ]
+        def on_result(model_name: str, result: UnitResult):
+            snapshot = tracker.add(model_name, result.answer)
+            if on_progress is not None:
+                on_progress(model_name, asdict(result))
+                on_progress(CONSENSUS_PROGRESS_KEY, asdict(snapshot))
 
-        if not valid_answers:
-            return "すべてのモデルがエラーを返しました", 0.0, "NONE"
+        results = self._fan_out(question, temperature, timeout, on_result)
 
-        if len(valid_answers) == 1:
-            return valid_answers[0][1], 0.33, valid_answers[0][0]
+        # 回答の取得（デフォルト値を設定）
+        answers = {
+            name: results[name].answer if name in results else "回答なし（エラー）"
+            for name in self.models
+        }
+        for name in self.models:
+            if name not in results:
+                tracker.add(name, answers[name])
 
-        # 回答の長さに基づく簡易的な評価
-        # より高度な評価には、別のLLMを使った評価や類似度計算が必要
-        lengths = [(name, ans, len(ans)) for name, ans in valid_answers]
-        lengths.sort(key=lambda x: x[2], reverse=True)
+        snapshot = tracker.snapshot()
+        return MAGIResponse(
+            answers=answers,
+            consensus=snapshot.consensus,
+            agreement_score=snapshot.agreement_score,
+            winning_model=snapshot.winning_model
+        )
 
-        # 最も詳細な回答を選択（今後、より高度な評価ロジックに置き換え可能）
-        winning_model = lengths[0][0]
-        winning_answer = lengths[0][1]
+    def _consensus_tracker(self) -> ConsensusTracker:
+        return ConsensusTracker(len(self.models), {unit.name: unit.weight for unit in self.council.units})
 
-        # 一致度スコアの計算（簡易版）
-        agreement_score = len(valid_answers) / 3.0
+    def _analyze_consensus(self, answers: Dict[str, str]) -> Tuple[str, float, str]:
+        """
+        各ユニットの回答からコンセンサスを分析（consensus.ConsensusTrackerにまとめて渡す）
 
-        return winning_answer, agreement_score, winning_model
+        Args:
+            answers: ユニット名 -> 回答
+
+        Returns:
+            (コンセンサステキスト, 一致度スコア, 選択されたモデル名)
+        """
+        tracker = self._consensus_tracker()
+        for name, answer in answers.items():
+            tracker.add(name, answer)
+        snapshot = tracker.snapshot()
+        return snapshot.consensus, snapshot.agreement_score, snapshot.winning_model
 
     def vote(
         self,
         question: str,
         options: List[str],
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        on_progress: Optional[Callable[[str, Dict[str, str]], None]] = None,
+        samples: int = 1
     ) -> Dict[str, int]:
         """
-        選択肢に対して3つのモデルに投票させる
+        選択肢に対して全ユニットに投票させる
 
         Args:
             question: 質問
             options: 選択肢のリスト
             temperature: 温度パラメータ
+            on_progress: 各モデルの回答が届くたびに (モデル名, {"answer", "status"}) で呼ばれる
+            samples: 各モデルから取得するサンプル数の上限（2以上で多数決により各モデルの投票を決める）
 
         Returns:
-            各選択肢の得票数
+            各選択肢の得票数（ユニットの重み付き）
         """
         # 投票用のプロンプトを作成
         options_text = "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)])
@@ -260,26 +468,298 @@ class MAGISystem:
 回答（番号のみ）:
 """
 
-        # 3つのモデルに投票させる
-        response = self.analyze(voting_prompt, temperature=temperature)
-
         # 投票結果を集計
         votes = {opt: 0 for opt in options}
 
-        for answer in [response.melchior, response.balthasar, response.casper]:
-            # 回答から番号を抽出
-            match = re.search(r'\b([1-9])\b', answer)
-            if match:
-                vote_num = int(match.group(1))
-                if 1 <= vote_num <= len(options):
-                    votes[options[vote_num - 1]] += 1
+        def extract_option(answer: str) -> str:
+            # 回答から番号（または選択肢の文言）を抽出
+            return parse_option(answer, options).vote
+
+        if samples > 1:
+            unit_votes = self.sample_votes(voting_prompt, extract_option, samples, temperature, on_progress)
+            unit_choices = {name: unit_vote.vote for name, unit_vote in unit_votes.items()}
+        else:
+            def on_result(model_name: str, result: UnitResult):
+                if on_progress is not None:
+                    on_progress(model_name, asdict(result))
+
+            # 全ユニットに投票させる（エラー・タイムアウトのユニットは投票に数えない）
+            results = self._fan_out(voting_prompt, temperature, on_result=on_result)
+            unit_choices = {
+                name: extract_option(result.answer)
+                for name, result in results.items() if result.status == "success"
+            }
+
+        # 各ユニットの重みで集計
+        for name, option in unit_choices.items():
+            if option in votes:
+                votes[option] += self.council.unit(name).weight
 
         return votes
 
+    def rank_vote(
+        self,
+        question: str,
+        options: List[str],
+        temperature: float = 0.7,
+        batch_size: int = 8,
+        on_progress: Optional[Callable[[str, Dict], None]] = None
+    ) -> RankedVoteResult:
+        """
+        選択肢に順位を付けて投票させ、ボルダ方式で集計する
+
+        選択肢がbatch_sizeを超える場合は勝ち抜き方式にする。各ラウンドで選択肢をbatch_size以下の
+        グループに分け、全グループ×全ユニットを並列に順位付けし、各グループの上位半分が次のラウンドへ進む。
+        選択肢がbatch_size以下になったラウンドを決勝とする。
+        選択肢がn個の場合、呼び出し回数はおよそ ユニット数 × 2n / batch_size 回に収まる
+
+        Args:
+            question: 質問
+            options: 選択肢のリスト（個数の上限なし）
+            temperature: 温度パラメータ
+            batch_size: 1回の呼び出しで順位を付けさせる選択肢の最大数
+            on_progress: 各ユニットの順位が届くたびに
+                         ("ラウンド-グループ-モデル名", {"round", "batch", "unit", "ranking", "status"}) で呼ばれる
+
+        Returns:
+            RankedVoteResult
+        """
+        if batch_size < 2:
+            raise ValueError("batch_sizeは2以上を指定してください")
+        remaining = list(dict.fromkeys(options))
+        if len(remaining) < 2:
+            raise ValueError("最低2つの選択肢が必要です")
+
+        # 敗退した選択肢（後のラウンドで敗退したものほど上位）
+        eliminated: List[List[str]] = []
+        round_no = 0
+        calls = 0
+
+        while True:
+            round_no += 1
+            # 各グループの大きさが揃うよう、選択肢を順番に振り分ける
+            group_count = math.ceil(len(remaining) / batch_size)
+            batches = [remaining[i::group_count] for i in range(group_count)]
+            results = self._rank_batches(question, batches, temperature, round_no, on_progress)
+            calls += len(batches) * len(self.models)
+
+            if len(batches) == 1:
+                scores, ballots = results[0]
+                break
+
+            advancing = []
+            dropped = []
+            for batch, (scores, _) in zip(batches, results):
+                order = sorted(batch, key=lambda option: -scores[option])
+                keep = math.ceil(len(batch) / 2)
+                advancing.extend(order[:keep])
+                # グループの大きさが異なるため、満点に対する割合で敗退した選択肢を比べる
+                full_marks = (len(batch) - 1) * self.council.total_weight
+                dropped.extend((scores[option] / full_marks, option) for option in order[keep:])
+            eliminated.append([option for _, option in sorted(dropped, key=lambda d: -d[0])])
+            remaining = advancing
+
+        ranking = sorted(remaining, key=lambda option: -scores[option])
+        for dropped_options in reversed(eliminated):
+            ranking.extend(dropped_options)
+
+        return RankedVoteResult(
+            ranking=ranking,
+            scores=scores,
+            ballots=ballots,
+            rounds=round_no,
+            calls=calls
+        )
+
+    def _rank_batches(
+        self,
+        question: str,
+        batches: List[List[str]],
+        temperature: float,
+        round_no: int,
+        on_progress: Optional[Callable[[str, Dict], None]] = None
+    ) -> List[Tuple[Dict[str, float], Dict[str, List[str]]]]:
+        """
+        全グループ×全ユニットに並列で順位を付けさせ、グループごとにボルダ得点を集計
+
+        k個の選択肢のうちi位（0始まり）の選択肢に (k - 1 - i) × ユニットの重み の得点を与え、
+        順位を読み取れなかった選択肢は0点とする
+
+        Returns:
+            グループごとの (選択肢 -> 得点, ユニット名 -> 順位)
+        """
+        results = [({option: 0.0 for option in batch}, {}) for batch in batches]
+
+        def prompt_for(batch: List[str]) -> str:
+            options_text = "\n".join(f"{i + 1}. {option}" for i, option in enumerate(batch))
+            return f"""{question}
+
+以下の選択肢を、良いと思う順にすべて並べてください。
+番号をカンマ区切りで1行だけ回答してください（例: 3,1,2）。説明は不要です。
+
+{options_text}
+
+回答（番号のカンマ区切り）:"""
+
+        prompts = [prompt_for(batch) for batch in batches]
+        max_workers = min(len(batches) * len(self.models), self.council.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                submit_in_context(
+                    executor,
+                    self.query_model, name, self.models[name], prompts[index], temperature
+                ): (index, name)
+                for index in range(len(batches))
+                for name in self.models
+            }
+            for future in concurrent.futures.as_completed(futures):
+                index, name = futures[future]
+                batch = batches[index]
+                scores, ballots = results[index]
+                _, answer, status = future.result()
+
+                order = parse_ranking(answer, len(batch)).order if status == "success" else ()
+                weight = self.council.unit(name).weight
+                for position, option_index in enumerate(order):
+                    scores[batch[option_index]] += (len(batch) - 1 - position) * weight
+                ballots[name] = [batch[option_index] for option_index in order]
+
+                if on_progress is not None:
+                    on_progress(f"{round_no}-{index + 1}-{name}", {
+                        "round": round_no,
+                        "batch": index + 1,
+                        "unit": name,
+                        "ranking": ballots[name],
+                        "status": status if order else "error"
+                    })
+
+        return results
+
+    def _sample_unit(
+        self,
+        model_name: str,
+        question: str,
+        extract: Callable[[str], str],
+        samples: int,
+        temperature: float
+    ) -> UnitVote:
+        """
+        1ユニットから複数の回答を並列に取得し、多数決で投票を決める
+
+        過半数（samples // 2 + 1）に届く可能性のある最小限のサンプルだけを並列で取得し、
+        いずれかの投票が過半数に達した時点で残りのサンプルは取得しない
+        （全会一致であれば過半数の回数の呼び出しで確定する）
+        """
+        majority = samples // 2 + 1
+        tally = Counter()
+        answers: Dict[str, str] = {}
+        draws = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=majority) as executor:
+            while draws < samples:
+                leader = max((n for v, n in tally.items() if v != "不明"), default=0)
+                if leader >= majority:
+                    break
+
+                batch = min(majority - leader, samples - draws)
+                futures = [
+                    submit_in_context(
+                        executor,
+                        self.query_model,
+                        model_name,
+                        self.models[model_name],
+                        question,
+                        temperature,
+                        draws + i
+                    )
+                    for i in range(batch)
+                ]
+                draws += batch
+
+                for future in concurrent.futures.as_completed(futures):
+                    _, answer, status = future.result()
+                    vote = extract(answer) if status == "success" else "不明"
+                    tally[vote] += 1
+                    answers.setdefault(vote, answer)
+
+        decided = [(v, n) for v, n in tally.most_common() if v != "不明"]
+        vote = decided[0][0] if decided else "不明"
+        return UnitVote(
+            vote=vote,
+            confidence=tally[vote] / draws if draws else 0.0,
+            tally=dict(tally),
+            draws=draws,
+            answer=answers.get(vote, "")
+        )
+
+    def sample_votes(
+        self,
+        question: str,
+        extract: Callable[[str], str],
+        samples: int = 5,
+        temperature: float = 0.7,
+        on_progress: Optional[Callable[[str, Dict], None]] = None
+    ) -> Dict[str, UnitVote]:
+        """
+        各ユニットから複数サンプルを取得し、ユニットごとの投票と確信度を求める（self-consistency）
+
+        Args:
+            question: 投票用のプロンプト
+            extract: 回答から投票を取り出す関数（判別できない場合は「不明」を返す）
+            samples: ユニットごとのサンプル数の上限（奇数を推奨）
+            temperature: 温度パラメータ
+            on_progress: 各ユニットの集計が終わるたびに
+                         (モデル名, {"vote", "confidence", "tally", "answer", "status"}) で呼ばれる
+
+        Returns:
+            モデル名 -> UnitVote
+        """
+        unit_votes = {}
+        max_workers = min(len(self.models), self.council.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                submit_in_context(
+                    executor, self._sample_unit, name, question, extract, samples, temperature
+                ): name
+                for name in self.models
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                unit_vote = future.result()
+                unit_votes[name] = unit_vote
+                if on_progress is not None:
+                    on_progress(name, {
+                        "vote": unit_vote.vote,
+                        "confidence": unit_vote.confidence,
+                        "tally": unit_vote.tally,
+                        "answer": unit_vote.answer,
+                        "status": "success" if unit_vote.vote != "不明" else "error"
+                    })
+        return unit_votes
+
+    def decide(self, votes: Dict[str, str]) -> CouncilDecision:
+        """
+        賛成/反対の投票をユニットの重みと定足数に従って集計
+
+        Args:
+            votes: ユニット名 -> 賛成 / 反対 / 不明
+
+        Returns:
+            CouncilDecision
+        """
+        return self.council.decide(votes)
+
+    @staticmethod
+    def _extract_approve_reject(answer: str) -> str:
+        """回答から賛成/反対を抽出（エラーやタイムアウトなど判別できない場合は「不明」）"""
+        return parse_approve_reject(answer).vote
+
     def vote_approve_reject(
         self,
         proposal: str,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        on_progress: Optional[Callable[[str, Dict[str, str]], None]] = None,
+        samples: int = 1
     ) -> Tuple[Dict[str, str], Dict[str, str]]:
         """
         提案に対して賛成/反対を投票させる（エヴァンゲリオンのMAGI方式）
@@ -287,6 +767,9 @@ class MAGISystem:
         Args:
             proposal: 提案内容
             temperature: 温度パラメータ
+            on_progress: 各モデルの投票が届くたびに (モデル名, {"vote", "answer", "status"}) で呼ばれる
+                         （samplesが2以上の場合は集計後に {"vote", "confidence", "tally", "answer", "status"}）
+            samples: 各モデルから取得するサンプル数の上限（2以上で多数決により各モデルの投票を決める）
 
         Returns:
             (投票結果dict, 理由dict) - 各モデルの投票と理由
@@ -301,49 +784,160 @@ class MAGISystem:
 
 その後に、判断の理由を詳しく説明してください。"""
 
-        # 3つのモデルに並列で投票させる
-        results = {}
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {
-                executor.submit(
-                    self.query_model,
-                    name,
-                    model_id,
-                    voting_prompt,
-                    temperature
-                ): name
-                for name, model_id in self.models.items()
-            }
+        if samples > 1:
+            unit_votes = self.sample_votes(
+                voting_prompt, self._extract_approve_reject, samples, temperature, on_progress
+            )
+            votes = {name: unit_votes[name].vote for name in self.models}
+            reasons = {name: unit_votes[name].answer for name in self.models}
+            return votes, reasons
 
-            try:
-                for future in concurrent.futures.as_completed(futures, timeout=180):
-                    try:
-                        model_name, answer, status = future.result()
-                        results[model_name] = {"answer": answer, "status": status}
-                    except Exception as e:
-                        model_name = futures[future]
-                        results[model_name] = {"answer": f"エラー: {str(e)}", "status": "error"}
-            except concurrent.futures.TimeoutError:
-                for future, model_name in futures.items():
-                    if model_name not in results:
-                        results[model_name] = {"answer": "タイムアウト", "status": "timeout"}
+        def on_result(model_name: str, result: UnitResult):
+            if on_progress is not None:
+                vote = self._extract_approve_reject(result.answer)
+                on_progress(model_name, {"vote": vote, **asdict(result)})
+
+        # 全ユニットに並列で投票させる
+        results = self._fan_out(voting_prompt, temperature, on_result=on_result)
 
         # 投票結果と理由を抽出
         votes = {}
         reasons = {}
 
-        for name in ["MELCHIOR", "BALTHASAR", "CASPER"]:
-            answer = results.get(name, {}).get("answer", "")
-
-            # 賛成/反対を抽出
-            if "【投票】賛成" in answer or "賛成" in answer[:100]:
-                votes[name] = "賛成"
-            elif "【投票】反対" in answer or "反対" in answer[:100]:
-                votes[name] = "反対"
-            else:
-                # エラーやタイムアウトの場合
-                votes[name] = "不明"
-
+        for name in self.models:
+            answer = results[name].answer if name in results else ""
+            # エラー・タイムアウトのユニットは不明（理由にはエラーの内容を表示する）
+            succeeded = name in results and results[name].status == "success"
+            votes[name] = self._extract_approve_reject(answer) if succeeded else "不明"
             reasons[name] = answer
 
         return votes, reasons
+
+    @staticmethod
+    def _summarize_reason(reason: str, max_chars: int) -> str:
+        """投票行を除いた理由の冒頭を、1行に詰めてmax_chars文字以内に要約"""
+        text = " ".join(
+            line.strip() for line in reason.splitlines()
+            if line.strip() and "【投票】" not in line
+        )
+        if len(text) > max_chars:
+            text = text[:max_chars] + "…"
+        return text
+
+    def deliberate(
+        self,
+        proposal: str,
+        rounds: int = 3,
+        temperature: float = 0.7,
+        summary_chars: int = 300,
+        on_progress: Optional[Callable[[str, Dict[str, str]], None]] = None
+    ) -> DeliberationResult:
+        """
+        複数ラウンドの討論で提案の賛成/反対を決める
+
+        2ラウンド目以降、各ユニットには自身と他のユニットの直前ラウンドの立場（投票と要約した理由）
+        だけを渡す。過去ラウンドの全文は送らないため、ラウンドを重ねても入力は一定の大きさに収まる。
+        全ユニットの投票が前ラウンドから変わらない（初回で全会一致の場合を含む）時点で終了する。
+        エラー・タイムアウトになったユニットは前ラウンドの立場を保ち、一度も立場を示していないユニットは
+        他のユニットに渡さない。判別できない投票やそのラウンドで失敗したユニットがある間は終了しない
+
+        Args:
+            proposal: 提案内容
+            rounds: 最大ラウンド数
+            temperature: 温度パラメータ
+            summary_chars: 他のユニットに渡す理由の最大文字数
+            on_progress: 各モデルの投票が届くたびに (モデル名, {"round", "vote", "answer", "status"}) で呼ばれる
+
+        Returns:
+            DeliberationResult
+        """
+        def progress_for(round_no: int):
+            def on_result(model_name: str, result: UnitResult):
+                if on_progress is not None:
+                    vote = self._extract_approve_reject(result.answer)
+                    on_progress(model_name, {"round": round_no, "vote": vote, **asdict(result)})
+            return on_result
+
+        def first_round_progress(model_name: str, info: Dict[str, str]):
+            on_progress(model_name, {"round": 1, **info})
+
+        # 1ラウンド目は通常の賛成/反対投票
+        votes, reasons = self.vote_approve_reject(
+            proposal,
+            temperature=temperature,
+            on_progress=first_round_progress if on_progress else None
+        )
+        history = [DeliberationRound(round=1, votes=votes, reasons=reasons)]
+        previous_votes: Dict[str, str] = {}
+        failed: Set[str] = set()  # 直前のラウンドで失敗したユニット
+
+        def settled() -> bool:
+            # 判別できない投票（全ユニットの失敗を含む）は全会一致・安定の判定に数えない
+            if failed or "不明" in votes.values():
+                return False
+            return len(set(votes.values())) == 1 or votes == previous_votes
+
+        for round_no in range(2, rounds + 1):
+            if settled():
+                converged = True
+                break
+
+            prompts = {}
+            for name in self.models:
+                positions = []
+                for other in self.models:
+                    # エラー・タイムアウトのメッセージは討論の立場として渡さない
+                    if other == name or not is_valid_answer(reasons[other]):
+                        continue
+                    change = ""
+                    if other in previous_votes and previous_votes[other] != votes[other]:
+                        change = f"（前ラウンドの{previous_votes[other]}から変更）"
+                    summary = self._summarize_reason(reasons[other], summary_chars)
+                    positions.append(f"- {other}: {votes[other]}{change} {summary}")
+
+                if is_valid_answer(reasons[name]):
+                    own = (
+                        f"前ラウンドでのあなたの投票: {votes[name]}\n"
+                        f"あなたの前ラウンドの理由（要約）: {self._summarize_reason(reasons[name], summary_chars)}"
+                    )
+                else:
+                    own = "前ラウンドでのあなたの投票: なし（応答を得られませんでした）"
+
+                prompts[name] = f"""{proposal}
+
+この提案について、MAGIシステムで審議中です（第{round_no}ラウンド）。
+{own}
+
+他のシステムの前ラウンドの立場:
+{chr(10).join(positions) or "- （立場を示したシステムはありません）"}
+
+他のシステムの立場を踏まえ、あなたの人格（科学者/母/女性）の観点から改めて判断してください。
+考えを変える場合も変えない場合も、その理由を述べてください。
+
+回答は以下の形式で必ず記載してください：
+【投票】賛成 または 【投票】反対
+
+その後に、判断の理由を詳しく説明してください。"""
+
+            # 各ユニットの次ラウンドを並列で実行
+            results = self._fan_out(prompts, temperature, on_result=progress_for(round_no))
+
+            previous_votes, previous_reasons = votes, reasons
+            votes = {}
+            reasons = {}
+            failed = set()
+            for name in self.models:
+                result = results.get(name)
+                if result is not None and result.status == "success":
+                    votes[name] = self._extract_approve_reject(result.answer)
+                    reasons[name] = result.answer
+                else:
+                    # 失敗したユニットは前ラウンドの立場を保つ
+                    votes[name] = previous_votes[name]
+                    reasons[name] = previous_reasons[name]
+                    failed.add(name)
+            history.append(DeliberationRound(round=round_no, votes=votes, reasons=reasons))
+        else:
+            converged = settled()
+
+        return DeliberationResult(votes=votes, reasons=reasons, rounds=history, converged=converged)
@@ -0,0 +1,104 @@
+"""
+Response Cache - モデル回答のキャッシュ
+同じ(モデル, 人格, プロンプト, パラメータ)への回答を再利用し、エンドポイントの呼び出しを省く
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from shared_state import SharedState, digest
+
+
+class ResponseCache:
+    """
+    query_modelの成功した回答を保持するLRUキャッシュ
+
+    pathを指定するとJSONLファイルに追記して永続化し、次回起動時に読み込む。
+    sharedを指定すると、メモリにない回答を他のプロセスと共有するキャッシュから探す
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        path: Optional[str] = None,
+        shared: Optional[SharedState] = None
+    ):
+        """
+        Args:
+            max_entries: メモリ上に保持する最大件数
+            path: 永続化先のJSONLファイル（Noneの場合はメモリのみ）
+            shared: プロセス間で共有するキャッシュ（Noneの場合はプロセス内のみ）
+        """
+        self._max_entries = max_entries
+        self._path = path
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, str, str]]:
+        """
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            (モデル名, 回答テキスト, ステータス)（キャッシュにない場合はNone）
+        """
+        cache_key = digest(key)
+        with self._lock:
+            value = self._entries.get(cache_key)
+            if value is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return value
+
+        shared_value = self._shared.cache_get(cache_key) if self._shared is not None else None
+        with self._lock:
+            if shared_value is None:
+                self.misses += 1
+                return None
+            value = tuple(shared_value)
+            self._store(cache_key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Tuple[str, str, str]):
+        """
+        Args:
+            key: キャッシュキー
+            value: (モデル名, 回答テキスト, ステータス)
+        """
+        cache_key = digest(key)
+        with self._lock:
+            self._store(cache_key, tuple(value))
+            if self._path:
+                with open(self._path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": cache_key, "value": list(value)}, ensure_ascii=False) + "\n")
+        if self._shared is not None:
+            self._shared.cache_put(cache_key, list(value))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _store(self, cache_key: str, value: Tuple[str, str, str]):
+        self._entries[cache_key] = value
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._store(record["key"], tuple(record["value"]))
+                except (ValueError, KeyError):
+                    # 書き込み途中で中断された行は無視する
+                    continue
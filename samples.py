@@ -0,0 +1,69 @@
+"""
+MAGI System - サンプルの提案・質問・投票
+アプリのサンプルボタンと、起動時のウォームアップ（warmup.py）で共有する
+"""
+from dataclasses import dataclass
+from typing import Tuple
+
+
+@dataclass(frozen=True, slots=True)
+class Sample:
+    """サンプルボタン1つ分の内容"""
+    label: str  # ボタンの表示名
+    text: str  # 入力欄に設定する提案・質問
+    key: str  # ボタンのウィジェットキー
+    options: Tuple[str, ...] = ()  # 選択肢（選択肢投票のみ）
+
+
+# 賛成/反対モードのサンプル提案
+SAMPLE_PROPOSALS = (
+    Sample("💼 リモートワーク全面導入", "全社員を対象にリモートワークを全面導入すべきか？", "proposal_remote"),
+    Sample("🤖 AI採用選考導入", "採用選考プロセスにAIによる一次スクリーニングを導入すべきか？", "proposal_ai"),
+    Sample("📅 週休3日制導入", "従業員の生産性向上のため、週休3日制を試験的に導入すべきか？", "proposal_4day"),
+    Sample("🌱 完全ペーパーレス化", "環境保護のため、社内の紙資料を完全に廃止しペーパーレス化すべきか？", "proposal_paperless"),
+    Sample(
+        "🎓 社内教育プログラム必須化",
+        "全社員に対して月10時間以上の社内教育プログラム受講を必須化すべきか？",
+        "proposal_training"
+    ),
+    Sample(
+        "💰 成果報酬制度導入",
+        "固定給与の一部を成果報酬型に変更し、個人の業績に応じた報酬体系を導入すべきか？",
+        "proposal_pay"
+    ),
+)
+
+# 質問分析モードのサンプル質問
+SAMPLE_QUESTIONS = (
+    Sample("🤖 AIの未来", "人工知能の未来について、技術的・社会的観点から分析してください", "analysis_ai"),
+    Sample("🌍 気候変動", "気候変動に対する最も効果的な対策は何ですか？", "analysis_climate"),
+    Sample("💼 リモートワーク", "リモートワークとオフィスワークのそれぞれの利点と欠点を比較してください", "analysis_remote"),
+    Sample("🏥 医療とテクノロジー", "AIやIoT技術が医療業界にもたらす革新について教えてください", "analysis_health"),
+    Sample("📚 教育改革", "現代の教育システムが抱える課題と、その解決策について論じてください", "analysis_education"),
+    Sample("🚀 宇宙開発", "民間企業による宇宙開発が人類にもたらす影響について分析してください", "analysis_space"),
+)
+
+# 選択肢投票モードのサンプル
+SAMPLE_VOTES = (
+    Sample(
+        "💻 技術選定", "次のWebプロジェクトで使うべきフレームワークは？", "sample_tech",
+        ("React", "Vue.js", "Angular", "Svelte")
+    ),
+    Sample("🍕 ランチ選び", "チームランチで行くべきお店は？", "sample_lunch", ("イタリアン", "和食", "中華", "カフェ")),
+    Sample(
+        "📚 学習言語", "プログラミング初心者が最初に学ぶべき言語は？", "sample_lang",
+        ("Python", "JavaScript", "Java", "Go")
+    ),
+    Sample(
+        "☁️ クラウド選定", "新規プロジェクトで使うべきクラウドプラットフォームは？", "sample_cloud",
+        ("AWS", "Azure", "GCP", "Oracle Cloud")
+    ),
+    Sample(
+        "🎬 週末の過ごし方", "今週末のチームビルディングで何をすべき？", "sample_weekend",
+        ("映画鑑賞", "スポーツ", "BBQ", "ボードゲーム")
+    ),
+    Sample(
+        "🗄️ データベース選定", "新しいアプリケーションで使うべきデータベースは？", "sample_db",
+        ("PostgreSQL", "MongoDB", "MySQL", "Redis")
+    ),
+)
@@ -0,0 +1,183 @@
+"""
+MAGI Scheduler - モデル呼び出しの優先度付きスケジューラー
+対話的な審議（Streamlit・API）をバッチ処理より優先し、同じ優先度の中ではセッションごとに公平に実行する
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, TypeVar, Union
+
+from latency import LatencyHistogram
+
+# 優先度（レーン）
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+T = TypeVar("T")
+
+# 現在の処理が属するレーンとセッション（ジョブや画面ごとに設定する）
+_current_lane: contextvars.ContextVar[Union[str, Callable[[], str]]] = contextvars.ContextVar(
+    "magi_lane", default=INTERACTIVE
+)
+_current_session: contextvars.ContextVar[str] = contextvars.ContextVar("magi_session", default="default")
+
+
+class SchedulerBusy(RuntimeError):
+    """待機中のリクエストが上限に達したため受け付けられない"""
+
+
+@contextmanager
+def scheduling(lane: Union[str, Callable[[], str]] = INTERACTIVE, session: str = "default") -> Iterator[None]:
+    """
+    この中で行うモデル呼び出しのレーンとセッションを設定する
+
+    Args:
+        lane: interactive / batch（レーンを返す関数を渡すと、モデル呼び出しのたびに現在のレーンを求める。
+              実行中のジョブの優先度を途中で上げる場合に使う）
+        session: 公平に扱う単位（Streamlitのセッション、バッチ実行など）
+    """
+    if not callable(lane) and lane not in LANES:
+        raise ValueError(f"未知のレーンです: {lane}")
+    lane_token = _current_lane.set(lane)
+    session_token = _current_session.set(session)
+    try:
+        yield
+    finally:
+        _current_lane.reset(lane_token)
+        _current_session.reset(session_token)
+
+
+def submit_in_context(executor, fn: Callable, *args, **kwargs):
+    """
+    現在のレーンとセッションを引き継いでスレッドプールに投入する
+
+    ThreadPoolExecutorのワーカーには呼び出し元のcontextvarsが引き継がれないため、明示的にコピーする
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class Scheduler:
+    """
+    モデル呼び出しの同時実行数を制限し、実行順を決めるスケジューラー
+
+    - interactiveレーンの待機があれば常にそちらを先に実行する
+    - batchレーンは同時実行数のbatch_shareの割合までしか使わず、対話的な呼び出しのための枠を残す
+    - 同じレーンの中ではセッションごとにラウンドロビンで実行する（1つのセッションが大量に投入しても他を待たせない）
+    - レーンの待機数がmax_queueに達した場合はSchedulerBusyで受け付けを拒否する
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 256, batch_share: float = 0.75):
+        """
+        Args:
+            max_concurrency: モデル呼び出しの同時実行数の上限
+            max_queue: レーンごとの待機数の上限
+            batch_share: batchレーンが使える同時実行数の割合
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.batch_limit = max(1, int(max_concurrency * batch_share))
+
+        self._cond = threading.Condition()
+        # レーン -> セッション -> 待機中のチケット（セッションの並びがラウンドロビンの順番）
+        self._queues: Dict[str, "OrderedDict[str, Deque[object]]"] = {lane: OrderedDict() for lane in LANES}
+        self._queued = {lane: 0 for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+        self._queue_time = {lane: LatencyHistogram() for lane in LANES}
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        """環境変数MAGI_SCHED_MAX_CONCURRENCY / MAGI_SCHED_MAX_QUEUE / MAGI_SCHED_BATCH_SHAREから作る"""
+        return cls(
+            max_concurrency=int(os.environ.get("MAGI_SCHED_MAX_CONCURRENCY", "16")),
+            max_queue=int(os.environ.get("MAGI_SCHED_MAX_QUEUE", "256")),
+            batch_share=float(os.environ.get("MAGI_SCHED_BATCH_SHARE", "0.75"))
+        )
+
+    def run(self, fn: Callable[[], T]) -> T:
+        """
+        実行の順番が来るまで待ってからfnを実行する
+
+        Args:
+            fn: モデル呼び出し
+
+        Returns:
+            fnの戻り値
+        """
+        lane = _current_lane.get()
+        if callable(lane):
+            lane = lane()
+        session = _current_session.get()
+        ticket = object()
+        enqueued = time.monotonic()
+
+        with self._cond:
+            if self._queued[lane] >= self.max_queue:
+                self._rejected[lane] += 1
+                raise SchedulerBusy("MAGIシステムが混雑しています。しばらくしてから再試行してください")
+            self._queues[lane].setdefault(session, deque()).append(ticket)
+            self._queued[lane] += 1
+
+            while self._next() is not ticket:
+                self._cond.wait()
+
+            sessions = self._queues[lane]
+            sessions[session].popleft()
+            if sessions[session]:
+                # 同じセッションの次のチケットは他のセッションの後に回す
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            self._queued[lane] -= 1
+            self._running[lane] += 1
+            self._admitted[lane] += 1
+            # 空きがあれば次のチケットも実行できるよう待機中のスレッドを起こす
+            self._cond.notify_all()
+
+        self._queue_time[lane].record(time.monotonic() - enqueued)
+        try:
+            return fn()
+        finally:
+            with self._cond:
+                self._running[lane] -= 1
+                self._cond.notify_all()
+
+    def _next(self):
+        """次に実行するチケット（空きがない場合はNone）"""
+        if sum(self._running.values()) >= self.max_concurrency:
+            return None
+        for lane in LANES:
+            sessions = self._queues[lane]
+            if not sessions:
+                continue
+            if lane == BATCH and self._running[BATCH] >= self.batch_limit:
+                return None
+            return sessions[next(iter(sessions))][0]
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            レーン -> {"running", "queued", "sessions", "admitted", "rejected",
+                       "queue_p50", "queue_p95", "queue_p99"}（待機時間は秒）
+        """
+        with self._cond:
+            snapshot = {
+                lane: {
+                    "running": self._running[lane],
+                    "queued": self._queued[lane],
+                    "sessions": len(self._queues[lane]),
+                    "admitted": self._admitted[lane],
+                    "rejected": self._rejected[lane],
+                }
+                for lane in LANES
+            }
+        for lane, stats in snapshot.items():
+            for q in (50, 95, 99):
+                stats[f"queue_p{q}"] = self._queue_time[lane].percentile(q)
+        return snapshot
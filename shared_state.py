@@ -0,0 +1,355 @@
+"""
+Shared State - 複数プロセスで共有する状態（SQLiteファイル）
+Databricks Appsなどで複数のワーカープロセスを起動した場合でも、回答キャッシュ・single-flight・
+エンドポイントのレート上限をプロセス間で共有し、プロセス数に比例してエンドポイントの負荷が増えないようにする
+
+環境変数:
+    MAGI_SHARED_STATE_PATH: SQLiteファイルのパス（未設定の場合はプロセス内の状態のみ使う）
+    MAGI_ENDPOINT_RATE: エンドポイントごとの1秒あたりのリクエスト数の上限（未設定の場合は上限なし）
+    MAGI_ENDPOINT_BURST: 上限を超えて連続で送れるリクエスト数（既定: 5）
+
+同じホスト上のプロセス間での共有を想定している（ネットワークファイルシステム上のファイルは使わない）
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+# 古いキャッシュを削除する間隔（書き込み回数）
+_TRIM_EVERY = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at);
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+);
+CREATE TABLE IF NOT EXISTS rates (
+    endpoint TEXT PRIMARY KEY,
+    tat REAL NOT NULL
+);
+"""
+
+
+def digest(key: Hashable) -> str:
+    """任意のキー（JSONに変換できるタプルやdictなど）を固定長の文字列に変換"""
+    raw = json.dumps(key, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _alive(pid: int) -> bool:
+    """同じホスト上のプロセスが生きているか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedState:
+    """
+    SQLiteファイルに置いたプロセス間の共有状態
+
+    - 回答キャッシュ: ResponseCacheの2段目として、他のプロセスが得た回答を再利用する
+    - single-flight: 同じキーの呼び出しを実行中のプロセスがあれば、その完了を待って結果を受け取る
+      （実行中のプロセスが終了した場合やリースの期限が切れた場合は、待っていたプロセスが引き継ぐ）
+    - レート上限: エンドポイントごとのリクエストの予約時刻をプロセス間で共有する
+
+    接続はスレッドごとに作り、WALモードで読み書きを並行させる
+    """
+
+    def __init__(
+        self,
+        path: str,
+        cache_max_entries: int = 100000,
+        lease_ttl: float = 600.0,
+        result_ttl: float = 60.0,
+        poll_interval: float = 0.1
+    ):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            cache_max_entries: キャッシュの最大件数（超えた分は古いものから削除）
+            lease_ttl: single-flightのリースの期限（秒、実行中のプロセスが応答しなくなった場合の保険）
+            result_ttl: 完了した呼び出しの結果を待機中のプロセスのために残す時間（秒）
+            poll_interval: 他のプロセスの呼び出しの完了を確認する間隔（秒）
+        """
+        self.path = path
+        self.cache_max_entries = cache_max_entries
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self._host = socket.gethostname()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.coalesced = 0  # 他のプロセスの呼び出しに相乗りした数
+
+    # ------------------------------------------------------------------
+    # 回答キャッシュ
+    # ------------------------------------------------------------------
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        """
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            保存した値（JSONから復元したもの、ない場合はNone）
+        """
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def cache_put(self, key: str, value: Any):
+        """
+        Args:
+            key: キャッシュキー
+            value: JSONに変換できる値
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            if self._count_write():
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN ("
+                    " SELECT key FROM cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.cache_max_entries,)
+                )
+                conn.execute("DELETE FROM flights WHERE expires_at < ?", (time.time(),))
+
+    # ------------------------------------------------------------------
+    # single-flight
+    # ------------------------------------------------------------------
+
+    def flight(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        他のプロセスで同じキーの呼び出しが実行中であれば完了を待って結果を受け取り、なければfnを実行する
+
+        fnが例外を送出した場合、待機中のプロセスは結果を受け取らずに自分で実行する
+
+        Args:
+            key: 呼び出しを識別するキー
+            fn: 実行する関数（戻り値はJSONに変換できる値）
+
+        Returns:
+            fnの戻り値（他のプロセスから受け取った場合はJSONから復元した値）
+        """
+        seen_token = None
+        while True:
+            state, value = self._try_lease(key, seen_token)
+            if state == "leader":
+                try:
+                    result = fn()
+                except BaseException:
+                    self._release(key, value, None, failed=True)
+                    raise
+                self._release(key, value, result)
+                return result
+            if state == "done":
+                with self._lock:
+                    self.coalesced += 1
+                return value
+            seen_token = value
+            time.sleep(self.poll_interval)
+
+    def _try_lease(self, key: str, seen_token: Optional[str]) -> Tuple[str, Any]:
+        """
+        Returns:
+            ("leader", 自分のトークン) / ("done", 結果) / ("wait", 実行中の呼び出しのトークン)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT token, host, pid, expires_at, done, result FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                token, host, pid, expires_at, done, result = row
+                if done and token == seen_token:
+                    return "done", json.loads(result)
+                running = not done and expires_at > now and (host != self._host or _alive(pid))
+                if running:
+                    return "wait", token
+            # 完了済みの結果は、実行中に待ち始めたプロセスにだけ渡す（後から来た呼び出しは新しく実行する）
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, token, host, pid, expires_at, done, result)"
+                " VALUES (?, ?, ?, ?, ?, 0, NULL)",
+                (key, token, self._host, os.getpid(), now + self.lease_ttl)
+            )
+            return "leader", token
+
+    def _release(self, key: str, token: str, result: Any, failed: bool = False):
+        with self._transaction() as conn:
+            if failed:
+                conn.execute("DELETE FROM flights WHERE key = ? AND token = ?", (key, token))
+            else:
+                conn.execute(
+                    "UPDATE flights SET done = 1, result = ?, expires_at = ? WHERE key = ? AND token = ?",
+                    (json.dumps(result, ensure_ascii=False), time.time() + self.result_ttl, key, token)
+                )
+
+    # ------------------------------------------------------------------
+    # レート上限
+    # ------------------------------------------------------------------
+
+    def reserve(
+        self, endpoint: str, interval: float, tolerance: float, max_wait: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        エンドポイントへのリクエストを1件予約する（GCRA）
+
+        Args:
+            endpoint: エンドポイント名
+            interval: リクエストの平均間隔（秒）
+            tolerance: 連続で送れる分の余裕（秒）
+            max_wait: 待てる時間の上限（秒、Noneの場合は上限なし）
+
+        Returns:
+            送信まで待つ時間（秒、max_wait以上待つ必要がある場合は予約せずにNone）
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tat FROM rates WHERE endpoint = ?", (endpoint,)).fetchone()
+            tat = max(row[0] if row is not None else now, now)
+            wait = max(0.0, tat - tolerance - now)
+            if max_wait is not None and wait >= max_wait:
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO rates (endpoint, tat) VALUES (?, ?)", (endpoint, tat + interval)
+            )
+        return wait
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._conn()
+        return {
+            "cache_entries": conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0],
+            "inflight": conn.execute("SELECT COUNT(*) FROM flights WHERE done = 0").fetchone()[0],
+            "coalesced": self.coalesced,
+        }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みロックを取って読み取りから更新までをまとめて行う"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _count_write(self) -> bool:
+        """古いキャッシュを削除する時期か"""
+        with self._lock:
+            self._writes += 1
+            return self._writes % _TRIM_EVERY == 0
+
+
+class RateBudget:
+    """
+    エンドポイントごとのリクエスト数の上限
+
+    SharedStateを指定した場合は予約をプロセス間で共有し、プロセス数を増やしても合計が上限を超えない
+    """
+
+    def __init__(self, rate: float, burst: int = 5, shared: Optional[SharedState] = None):
+        """
+        Args:
+            rate: 1秒あたりのリクエスト数の上限
+            burst: 上限を超えて連続で送れるリクエスト数
+            shared: 共有状態（Noneの場合はプロセス内のみ）
+        """
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._tat: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["RateBudget"]:
+        """環境変数MAGI_ENDPOINT_RATE / MAGI_ENDPOINT_BURSTから作る（上限が未設定の場合はNone）"""
+        rate = float(os.environ.get("MAGI_ENDPOINT_RATE", "0"))
+        if rate <= 0:
+            return None
+        return cls(rate, burst=int(os.environ.get("MAGI_ENDPOINT_BURST", "5")), shared=get_shared_state())
+
+    def reserve(self, endpoint: str, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        リクエストを1件予約する
+
+        期限までに送れない場合は枠を消費しない（諦めたリクエストの分だけ後続のリクエストを待たせない）
+
+        Args:
+            endpoint: エンドポイント名
+            max_wait: 待てる時間の上限（秒、Noneの場合は上限なし）
+
+        Returns:
+            送信まで待つ時間（秒、max_wait以上待つ必要がある場合は予約せずにNone）
+        """
+        if self.shared is not None:
+            return self.shared.reserve(endpoint, self.interval, self.tolerance, max_wait)
+        now = time.time()
+        with self._lock:
+            tat = max(self._tat.get(endpoint, now), now)
+            wait = max(0.0, tat - self.tolerance - now)
+            if max_wait is not None and wait >= max_wait:
+                return None
+            self._tat[endpoint] = tat + self.interval
+        return wait
+
+
+_default_state: Optional[SharedState] = None
+_default_state_lock = threading.Lock()
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """
+    環境変数MAGI_SHARED_STATE_PATHで指定した共有状態を取得（未設定の場合はNone）
+
+    Returns:
+        SharedState
+    """
+    global _default_state
+    path = os.environ.get("MAGI_SHARED_STATE_PATH")
+    if not path:
+        return None
+    with _default_state_lock:
+        if _default_state is None:
+            _default_state = SharedState(path)
+        return _default_state
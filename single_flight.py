@@ -0,0 +1,87 @@
+"""
+Single-flight - 同一の同時リクエストを1回の呼び出しにまとめる
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from shared_state import SharedState, digest
+
+
+class _Call:
+    """実行中の呼び出し"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    同じキーの呼び出しが実行中であれば、後続の呼び出しはその完了を待って同じ結果を受け取る
+
+    完了した呼び出しの結果は保持しない（キャッシュではなく、同時実行の重複排除のみを行う）。
+    sharedを指定すると、他のプロセスで実行中の同じキーの呼び出しにも相乗りする
+    （その場合キーと戻り値はJSONに変換できる値に限る）
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None):
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0  # 実際に実行された呼び出し数
+        self.coalesced = 0  # 実行中の呼び出しに相乗りした数
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        キーに対応する呼び出しを実行（または実行中の呼び出しの結果を待つ）
+
+        Args:
+            key: 呼び出しを識別するキー
+            fn: 実行する関数
+
+        Returns:
+            fnの戻り値（fnが例外を送出した場合は待機中の全員に同じ例外を送出）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self._shared is not None:
+                call.result = self._shared.flight(digest(key), fn)
+            else:
+                call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            実行数・相乗り数・現在実行中の数
+        """
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "inflight": len(self._calls),
+            }
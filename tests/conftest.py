@@ -0,0 +1,40 @@
+import os
+import sys
+import gzip
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def replay(monkeypatch, tmp_path):
+    """空のカセットの再生モード（DatabricksClientがDatabricksの認証とネットワークを使わない）"""
+    monkeypatch.setenv("MAGI_CASSETTE_MODE", "replay")
+    path = tmp_path / "cassette.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8"):
+        pass
+    monkeypatch.setenv("MAGI_CASSETTE_PATH", str(path))
+
+
+@pytest.fixture
+def magi(replay, monkeypatch):
+    """モデルに問い合わせないMAGISystem"""
+    monkeypatch.delenv("MAGI_SHARED_STATE_PATH", raising=False)
+    monkeypatch.delenv("MAGI_COUNCIL_CONFIG", raising=False)
+    from magi_system import MAGISystem
+    return MAGISystem()
+
+
+def fake_answers(magi, monkeypatch, answers):
+    """
+    ユニットごとの回答を固定する
+
+    Args:
+        answers: ユニット名 -> (回答, ステータス)
+    """
+    def query_model(model_name, model_id, question, temperature=0.7, sample=0, deadline=None):
+        answer, status = answers[model_name]
+        return model_name, answer, status
+
+    monkeypatch.setattr(magi, "query_model", query_model)
@@ -0,0 +1,40 @@
+import json
+from dataclasses import replace
+
+from batch_runner import process_record, run_batch
+from conftest import fake_answers
+
+
+def test_malformed_line_is_recorded_and_batch_continues(magi, monkeypatch, tmp_path):
+    fake_answers(magi, monkeypatch, {
+        "MELCHIOR": ("【投票】賛成\n理由: 妥当です", "success"),
+        "BALTHASAR": ("【投票】賛成\n理由: 妥当です", "success"),
+        "CASPER": ("【投票】反対\n理由: 危険です", "success"),
+    })
+    input_path = tmp_path / "input.jsonl"
+    input_path.write_text(
+        '{"id": "a", "proposal": "提案A"}\n'
+        '{"id": "b", "proposal": \n'
+        '{"id": "c", "proposal": "提案C"}\n',
+        encoding="utf-8"
+    )
+    output_path = tmp_path / "output.jsonl"
+
+    stats = run_batch(magi, str(input_path), str(output_path), concurrency=1)
+
+    outputs = {record["id"]: record for record in map(json.loads, output_path.read_text(encoding="utf-8").splitlines())}
+    assert stats == {"processed": 3, "skipped": 0, "errors": 1}
+    assert outputs["2"]["error"].startswith("2行目のJSONを解析できません")
+    assert outputs["a"]["error"] is None and outputs["c"]["error"] is None
+
+
+def test_exactly_half_of_the_weight_is_not_a_majority(magi, monkeypatch):
+    # MELCHIORの重みを2にして、MELCHIORだけが有効な回答を返すとちょうど半数になる
+    magi.council.units[0] = replace(magi.council.units[0], weight=2)
+    fake_answers(magi, monkeypatch, {
+        "MELCHIOR": ("【投票】賛成\n理由: 妥当です", "success"),
+        "BALTHASAR": ("エラー: 承認されていないトークンです", "error"),
+        "CASPER": ("タイムアウト: 応答時間を超過しました（3秒）", "timeout"),
+    })
+    output = process_record(magi, "a", {"proposal": "提案"}, "vote_approve_reject", temperature=0.7)
+    assert output["error"] == "有効な回答を返したユニットが過半数に達しませんでした（50%）"
@@ -0,0 +1,25 @@
+import time
+
+import pytest
+import requests
+
+from cassette import RECORD, REPLAY, Cassette
+
+
+def test_record_does_not_keep_bodies_in_memory(tmp_path):
+    cassette = Cassette(RECORD, path=str(tmp_path / "cassette.jsonl.gz"))
+    cassette.record("model", {"messages": []}, b'{"choices": []}', 0.1)
+    cassette.record("model", {"messages": []}, b'{"choices": []}', 0.1)
+    assert not cassette._entries
+    assert cassette.stats() == {"requests": 1, "responses": 2}
+
+
+def test_replay_times_out_at_the_deadline(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    Cassette(RECORD, path=path).record("model", {"messages": []}, b'{"choices": []}', 5.0)
+    cassette = Cassette(REPLAY, path=path)
+
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        cassette.play("model", {"messages": []}, deadline=started + 0.05)
+    assert time.monotonic() - started < 1.0
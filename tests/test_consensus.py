@@ -0,0 +1,61 @@
+import itertools
+
+import pytest
+
+from consensus import ConsensusTracker
+
+ANSWERS = {
+    "MELCHIOR": "リモートワークを週3日まで認めるべきです。生産性の調査結果もそれを支持しています。",
+    "BALTHASAR": "リモートワークは週3日まで認めるべきです。",
+    "CASPER": "出社を原則とし、リモートワークは例外的に認めるべきです。",
+}
+
+
+def track(order, answers=ANSWERS, weights=None):
+    tracker = ConsensusTracker(len(answers), weights)
+    for name in order:
+        snapshot = tracker.add(name, answers[name])
+    return snapshot
+
+
+def test_result_does_not_depend_on_arrival_order():
+    results = {
+        (snapshot.winning_model, round(snapshot.agreement_score, 9))
+        for snapshot in map(track, itertools.permutations(ANSWERS))
+    }
+    assert len(results) == 1
+
+
+def test_invalid_answers_are_ignored():
+    answers = dict(ANSWERS, CASPER="タイムアウト: 応答時間を超過しました（3秒）")
+    snapshot = track(answers, answers)
+    assert snapshot.winning_model in ("MELCHIOR", "BALTHASAR")
+    assert snapshot.arrived == 3
+
+    # 有効な回答だけで求めた一致度に、有効な回答の割合を掛ける
+    valid_only = track(["MELCHIOR", "BALTHASAR"], answers)
+    assert snapshot.agreement_score == pytest.approx(valid_only.agreement_score)
+    assert 0 < snapshot.agreement_score < 2 / 3
+
+
+def test_all_invalid_answers():
+    answers = {name: "エラー: 接続できません" for name in ANSWERS}
+    snapshot = track(answers, answers)
+    assert snapshot.winning_model == "NONE"
+    assert snapshot.agreement_score == 0.0
+
+
+def test_replaced_answer_is_recomputed():
+    tracker = ConsensusTracker(2)
+    tracker.add("MELCHIOR", "エラー: 接続できません")
+    tracker.add("BALTHASAR", ANSWERS["BALTHASAR"])
+    snapshot = tracker.add("MELCHIOR", ANSWERS["BALTHASAR"])
+    assert snapshot.agreement_score == pytest.approx(1.0)
+
+
+def test_weights_favour_the_answer_heavy_units_agree_with():
+    answers = {"MELCHIOR": ANSWERS["MELCHIOR"], "BALTHASAR": ANSWERS["BALTHASAR"]}
+    # 重みが同じ場合は同点になり、より長い回答を選ぶ
+    assert track(answers, answers).winning_model == "MELCHIOR"
+    # MELCHIORの重みが大きいと、MELCHIORが支持するBALTHASARの回答が選ばれる
+    assert track(answers, answers, {"MELCHIOR": 3}).winning_model == "BALTHASAR"
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from council import Council, CouncilUnit
+
+
+def council(quorum=0.0, **weights):
+    return Council(
+        [CouncilUnit(name=name, model_id="model", persona="", weight=weight) for name, weight in weights.items()],
+        quorum=quorum
+    )
+
+
+def test_weighted_majority():
+    decision = council(A=3, B=1, C=1).decide({"A": "賛成", "B": "反対", "C": "反対"})
+    assert decision.outcome == "賛成"
+    assert (decision.approve, decision.reject, decision.abstain, decision.total) == (3, 2, 0, 5)
+
+
+def test_tied_weights_are_undecided():
+    decision = council(A=2, B=1, C=1).decide({"A": "賛成", "B": "反対", "C": "反対"})
+    assert decision.outcome == "保留"
+
+
+def test_unknown_and_missing_votes_abstain():
+    decision = council(A=1, B=1, C=1).decide({"A": "反対", "B": "不明"})
+    assert decision.outcome == "反対"
+    assert decision.abstain == 2
+
+
+def test_quorum_counts_weight_of_valid_votes():
+    units = council(quorum=0.5, A=1, B=1, C=2)
+    # 有効票の重み2は全体4の半分なので定足数に達する
+    assert units.decide({"C": "賛成", "A": "不明", "B": "不明"}).outcome == "賛成"
+    decision = units.decide({"A": "賛成", "B": "不明", "C": "不明"})
+    assert decision.outcome == "不成立"
+    assert not decision.quorum_met
+
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError):
+        Council([CouncilUnit("A", "model", ""), CouncilUnit("A", "model", "")])
+
+
+def test_from_config_resolves_personas(tmp_path):
+    path = tmp_path / "council.json"
+    path.write_text(json.dumps({
+        "quorum": 0.5,
+        "units": [
+            {"name": "MELCHIOR-A", "model_id": "databricks-gpt-5", "persona": "MELCHIOR", "weight": 2},
+            {"name": "CUSTOM", "model_id": "databricks-gpt-5", "persona": "あなたは審査員です"},
+        ]
+    }), encoding="utf-8")
+    loaded = Council.from_config(str(path), {"MELCHIOR": "あなたは科学者です"})
+    assert loaded.quorum == 0.5
+    assert loaded.unit("MELCHIOR-A").persona == "あなたは科学者です"
+    assert loaded.unit("CUSTOM").persona == "あなたは審査員です"
+    assert loaded.total_weight == 3
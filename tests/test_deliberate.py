@@ -0,0 +1,50 @@
+APPROVE = "【投票】賛成\n理由: 効果が大きい"
+REJECT = "【投票】反対\n理由: リスクが大きい"
+ERROR = "エラー: HTTPSConnectionPool(host='x'): Read timed out. (read timeout=3.0)"
+
+
+def script(magi, monkeypatch, rounds):
+    """
+    ラウンドごとの回答を固定する（2ラウンド目以降のプロンプトは「第nラウンド」を含む）
+
+    Args:
+        rounds: ラウンドごとの ユニット名 -> (回答, ステータス)
+    """
+    prompts = []
+
+    def query_model(model_name, model_id, question, temperature=0.7, sample=0, deadline=None):
+        round_no = next((n for n in range(len(rounds), 1, -1) if f"第{n}ラウンド" in question), 1)
+        prompts.append((round_no, model_name, question))
+        answer, status = rounds[round_no - 1][model_name]
+        return model_name, answer, status
+
+    monkeypatch.setattr(magi, "query_model", query_model)
+    return prompts
+
+
+def test_failed_unit_keeps_previous_position(magi, monkeypatch):
+    prompts = script(magi, monkeypatch, [
+        {"MELCHIOR": (APPROVE, "success"), "BALTHASAR": (REJECT, "success"), "CASPER": (APPROVE, "success")},
+        {"MELCHIOR": (APPROVE, "success"), "BALTHASAR": (REJECT, "success"), "CASPER": (ERROR, "error")},
+        {"MELCHIOR": (APPROVE, "success"), "BALTHASAR": (APPROVE, "success"), "CASPER": (APPROVE, "success")},
+    ])
+    result = magi.deliberate("提案", rounds=3)
+
+    assert result.rounds[1].votes["CASPER"] == "賛成"
+    assert result.rounds[1].reasons["CASPER"] == APPROVE
+    round3 = [question for round_no, _, question in prompts if round_no == 3]
+    assert len(round3) == 3
+    assert not any("エラー:" in question or "不明" in question for question in round3)
+    assert result.votes == {"MELCHIOR": "賛成", "BALTHASAR": "賛成", "CASPER": "賛成"}
+    assert result.converged
+
+
+def test_all_failed_is_not_converged(magi, monkeypatch):
+    failing = {name: (ERROR, "error") for name in magi.models}
+    prompts = script(magi, monkeypatch, [failing, failing])
+    result = magi.deliberate("提案", rounds=2)
+
+    assert set(result.votes.values()) == {"不明"}
+    assert not result.converged
+    round2 = [question for round_no, _, question in prompts if round_no == 2]
+    assert round2 and not any("エラー:" in question for question in round2)
@@ -0,0 +1,65 @@
+import threading
+
+from job_queue import DONE, JobQueue
+from magi_system import MAGIResponse
+from scheduler import BATCH
+
+
+class BlockingMagi:
+    """「待機」で始まる質問はreleaseされるまで返さないMAGISystemの代わり"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def analyze(self, question, temperature=0.7, on_progress=None):
+        if question.startswith("待機"):
+            self.release.wait(10)
+        return MAGIResponse(answers={}, consensus=question, agreement_score=1.0, winning_model="MELCHIOR")
+
+
+def test_interactive_job_does_not_wait_behind_batch_jobs(tmp_path):
+    magi = BlockingMagi()
+    queue = JobQueue(lambda: magi, max_workers=1, batch_workers=1, store_dir=str(tmp_path))
+    try:
+        batch_jobs = [queue.submit("analyze", lane=BATCH, question=f"待機{i}") for i in range(3)]
+        interactive = queue.submit("analyze", question="対話")
+
+        job = queue.wait(interactive, timeout=5)
+        assert job.status == DONE
+        assert job.result["consensus"] == "対話"
+        assert all(queue.get(job_id).is_active for job_id in batch_jobs)
+        assert queue.active_count() == 3
+        assert queue.active_count("api") == 0
+    finally:
+        magi.release.set()
+    for job_id in batch_jobs:
+        assert queue.wait(job_id, timeout=5).status == DONE
+
+
+def test_interactive_submit_promotes_a_queued_batch_job(tmp_path):
+    magi = BlockingMagi()
+    queue = JobQueue(lambda: magi, max_workers=1, batch_workers=1, store_dir=str(tmp_path))
+    try:
+        blocker = queue.submit("analyze", lane=BATCH, question="待機")
+        queued = queue.submit("analyze", lane=BATCH, question="対話")
+        assert queue.submit("analyze", question="対話") == queued
+
+        job = queue.wait(queued, timeout=5)
+        assert job.status == DONE
+        assert job.lane == "interactive"
+        assert job.attached == 2
+        assert queue.get(blocker).is_active
+    finally:
+        magi.release.set()
+    assert queue.wait(blocker, timeout=5).status == DONE
+    assert queue.get(queued).status == DONE
+
+
+def test_legacy_analysis_result_is_readable():
+    legacy = {
+        "melchior": "回答1", "balthasar": "回答2", "casper": "回答3",
+        "consensus": "回答1", "agreement_score": 0.5, "winning_model": "MELCHIOR",
+    }
+    response = MAGIResponse.from_dict(legacy)
+    assert response.answers == {"MELCHIOR": "回答1", "BALTHASAR": "回答2", "CASPER": "回答3"}
+    assert response.casper == "回答3"
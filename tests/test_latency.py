@@ -0,0 +1,40 @@
+import pytest
+
+from latency import LatencyTracker, size_class
+
+
+def warm(tracker, seconds, input_tokens=0, count=100):
+    for _ in range(count):
+        tracker.record("model", seconds, input_tokens)
+
+
+def test_timeouts_raise_the_next_timeout():
+    tracker = LatencyTracker()
+    warm(tracker, 10.0)
+    first = tracker.timeout_for("model")
+    assert first == pytest.approx(20.0, rel=0.05)
+
+    for _ in range(5):
+        tracker.record_timeout("model", first)
+    assert tracker.timeout_for("model") > first * 1.5
+    assert tracker.stats()["model"][size_class(0)]["timeouts"] == 5
+
+
+def test_histograms_are_split_by_input_size():
+    tracker = LatencyTracker()
+    warm(tracker, 5.0, input_tokens=200)
+    warm(tracker, 60.0, input_tokens=8000)
+    assert tracker.timeout_for("model", 200) == pytest.approx(15.0)
+    assert tracker.timeout_for("model", 8000) == pytest.approx(120.0, rel=0.05)
+    # 観測のない区分は既定のタイムアウト
+    assert tracker.timeout_for("model", 100000) == tracker.default_timeout
+
+
+def test_deadline_leaves_room_for_retries():
+    tracker = LatencyTracker()
+    warm(tracker, 10.0)
+    timeout = tracker.timeout_for("model")
+    assert tracker.deadline_for([("model", 0)], 180.0) == timeout
+    # 1回目のタイムアウトの後、1秒と2秒のバックオフを挟んだ2回のリトライがp99で終わる
+    assert tracker.deadline_for([("model", 0)], 180.0, retries=3) == pytest.approx(timeout + 3 + 2 * 10.0, rel=0.05)
+    assert tracker.deadline_for([("model", 0), ("cold", 0)], 180.0, retries=3) == 180.0
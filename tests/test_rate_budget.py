@@ -0,0 +1,20 @@
+import pytest
+
+from shared_state import RateBudget, SharedState
+
+
+@pytest.fixture(params=["local", "shared"])
+def budget(request, tmp_path):
+    shared = SharedState(str(tmp_path / "state.sqlite")) if request.param == "shared" else None
+    return RateBudget(rate=1.0, burst=1, shared=shared)
+
+
+def test_reservation_beyond_deadline_does_not_consume_a_slot(budget):
+    assert budget.reserve("model") == 0.0
+    wait = budget.reserve("model")
+    assert wait == pytest.approx(1.0, abs=0.1)
+
+    # 期限までに送れない予約は断られ、後続の待ち時間を延ばさない
+    assert budget.reserve("model", max_wait=0.5) is None
+    assert budget.reserve("model", max_wait=0.5) is None
+    assert budget.reserve("model") == pytest.approx(2.0, abs=0.1)
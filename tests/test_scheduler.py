@@ -0,0 +1,79 @@
+import threading
+import time
+
+from scheduler import BATCH, INTERACTIVE, Scheduler, scheduling
+
+
+class Harness:
+    """同時実行数1のスケジューラーで、1件を実行中にしたまま他の呼び出しを待たせる"""
+
+    def __init__(self):
+        self.scheduler = Scheduler(max_concurrency=1)
+        self.order = []
+        self.threads = []
+        self._release = threading.Event()
+        self._started = threading.Event()
+
+        def hold():
+            self._started.set()
+            self._release.wait(5)
+
+        self.submit(INTERACTIVE, "holder", "holder", hold)
+        assert self._started.wait(5)
+
+    def submit(self, lane, session, label, fn=None):
+        def run():
+            with scheduling(lane, session):
+                self.scheduler.run(fn or (lambda: self.order.append(label)))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+
+    def wait_queued(self, count):
+        deadline = time.monotonic() + 5
+        while sum(lane["queued"] for lane in self.scheduler.stats().values()) < count:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+
+    def release(self):
+        self._release.set()
+        for thread in self.threads:
+            thread.join(5)
+        return self.order
+
+
+def test_interactive_runs_before_batch():
+    harness = Harness()
+    for i in range(3):
+        harness.submit(BATCH, "batch", f"batch-{i}")
+        harness.wait_queued(i + 1)
+    harness.submit(INTERACTIVE, "user", "interactive")
+    harness.wait_queued(4)
+    assert harness.release() == ["interactive", "batch-0", "batch-1", "batch-2"]
+
+
+def test_sessions_take_turns_within_a_lane():
+    harness = Harness()
+    queued = 0
+    for label in ["a-0", "a-1", "a-2", "b-0", "b-1", "c-0"]:
+        harness.submit(INTERACTIVE, label[0], label)
+        queued += 1
+        harness.wait_queued(queued)
+    assert harness.release() == ["a-0", "b-0", "c-0", "a-1", "b-1", "a-2"]
+
+
+def test_lane_function_is_read_per_call():
+    harness = Harness()
+    job_lane = [BATCH]
+    harness.submit(BATCH, "batch", "batch")
+    harness.wait_queued(1)
+    harness.submit(lambda: job_lane[0], "job", "promoted")
+    harness.wait_queued(2)
+    assert harness.scheduler.stats()[BATCH]["queued"] == 2
+
+    # すでに待機中の呼び出しは元のレーンのまま、以降の呼び出しは引き上げたレーンで待つ
+    job_lane[0] = INTERACTIVE
+    harness.submit(lambda: job_lane[0], "job", "after")
+    harness.wait_queued(3)
+    assert harness.release() == ["after", "batch", "promoted"]
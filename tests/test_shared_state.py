@@ -0,0 +1,56 @@
+import threading
+import time
+
+from shared_state import SharedState
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    stalled = SharedState(path, lease_ttl=0.2, poll_interval=0.02)
+    waiter = SharedState(path, lease_ttl=0.2, poll_interval=0.02)
+    started, release = threading.Event(), threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return "古い回答"
+
+    thread = threading.Thread(target=stalled.flight, args=("key", stuck))
+    thread.start()
+    try:
+        assert started.wait(5)
+        # リースの期限が切れるまでは待ち、切れたら待っていた側が引き継いで実行する
+        began = time.monotonic()
+        assert waiter.flight("key", lambda: "新しい回答") == "新しい回答"
+        assert time.monotonic() - began >= 0.1
+        assert waiter.coalesced == 0
+    finally:
+        release.set()
+        thread.join()
+
+    # リースを失った呼び出しの完了は、引き継いだ呼び出しの記録を上書きしない
+    row = waiter._conn().execute("SELECT result FROM flights WHERE key = ?", ("key",)).fetchone()
+    assert row[0] == '"新しい回答"'
+
+
+def test_waiter_receives_result_of_running_lease(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    leader = SharedState(path, poll_interval=0.02)
+    waiter = SharedState(path, poll_interval=0.02)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return {"answer": "回答"}
+
+    thread = threading.Thread(target=leader.flight, args=("key", slow))
+    thread.start()
+    assert started.wait(5)
+    threading.Timer(0.1, release.set).start()
+    try:
+        assert waiter.flight("key", lambda: {"answer": "実行されない"}) == {"answer": "回答"}
+        assert waiter.coalesced == 1
+    finally:
+        release.set()
+        thread.join()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from single_flight import SingleFlight
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def run_concurrently(flight, key, fn, n):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "回答"
+
+    threads, results, errors = run_concurrently(flight, "key", fn, 5)
+    wait_until(lambda: flight.coalesced == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["回答"] * 5 and errors == []
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "inflight": 0}
+
+
+def test_error_is_shared_and_not_kept():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("接続できません")
+
+    threads, results, errors = run_concurrently(flight, "key", fail, 3)
+    wait_until(lambda: flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [] and len(errors) == 3
+
+    # 完了した呼び出しは保持しないため、次の呼び出しは新しく実行される
+    assert flight.do("key", lambda: "再実行") == "再実行"
+    assert flight.executed == 2
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats() == {"executed": 2, "coalesced": 0, "inflight": 0}
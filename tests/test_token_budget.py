@@ -0,0 +1,64 @@
+import pytest
+
+from databricks_client import CONTINUE_PROMPT, ChatResult, DatabricksClient
+from token_budget import TRIM_MARKER, TokenBudget
+
+MODEL = "databricks-meta-llama-3-3-70b-instruct"
+
+
+def long_question(chars):
+    return "文書の要約をしてください。\n" + "あ" * chars + "\n以上を踏まえて答えてください。"
+
+
+def test_trim_keeps_system_and_assistant_messages():
+    # 途中までの回答の方が長くても、省略するのはユーザーのメッセージ
+    partial = "い" * 55000
+    messages = [
+        {"role": "system", "content": "あなたは科学者です。"},
+        {"role": "user", "content": long_question(40000)},
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+    plan = TokenBudget().fit(MODEL, messages, 4000)
+
+    assert plan.trimmed_chars > 0
+    assert plan.messages[0] == messages[0]
+    assert plan.messages[2]["content"] == partial
+    assert plan.messages[3]["content"] == CONTINUE_PROMPT
+    assert TRIM_MARKER in plan.messages[1]["content"]
+    assert plan.messages[1]["content"].endswith("以上を踏まえて答えてください。")
+
+
+def test_continuation_sends_the_partial_answer_untrimmed(replay, monkeypatch):
+    client = DatabricksClient()
+    partial = "途中までの回答。" * 7000
+    sent = []
+
+    def chat_completion(model, messages, temperature=0.7, max_tokens=4000, deadline=None):
+        plan = client.token_budget.fit(model, messages, max_tokens)
+        sent.append(plan.messages)
+        if len(sent) == 1:
+            return ChatResult(content=partial, finish_reason="length")
+        return ChatResult(content="続き。", finish_reason="stop")
+
+    monkeypatch.setattr(client, "chat_completion", chat_completion)
+    messages = [
+        {"role": "system", "content": "あなたは科学者です。"},
+        {"role": "user", "content": long_question(40000)},
+    ]
+    result = client.chat_completion_with_continuation(MODEL, messages, max_tokens=4000)
+
+    assert result.content == partial + "続き。"
+    continued = sent[1]
+    assert [message["role"] for message in continued] == ["system", "user", "assistant", "user"]
+    assert continued[2]["content"] == partial
+    assert TRIM_MARKER in continued[1]["content"]
+
+
+def test_fit_fails_when_only_untrimmable_messages_are_too_long():
+    messages = [
+        {"role": "user", "content": "続けてください"},
+        {"role": "assistant", "content": "う" * 100000},
+    ]
+    with pytest.raises(ValueError):
+        TokenBudget().fit(MODEL, messages, 4000)
@@ -0,0 +1,48 @@
+from conftest import fake_answers
+from response_cache import ResponseCache
+from tournament import Tournament
+
+CANDIDATES = ["案A", "案B", "案C", "案D"]
+
+
+def prefer_first_option(magi, monkeypatch):
+    """提示順に関係なく、名前順で先の候補を選ぶユニット"""
+    calls = []
+
+    def query_model(model_name, model_id, question, temperature=0.7, sample=0, deadline=None):
+        calls.append(model_name)
+        first, second = [line[3:] for line in question.splitlines() if line[:3] in ("1. ", "2. ")]
+        return model_name, "1" if first < second else "2", "success"
+
+    monkeypatch.setattr(magi, "query_model", query_model)
+    return calls
+
+
+def test_outcomes_are_reused_by_a_new_instance(magi, monkeypatch):
+    calls = prefer_first_option(magi, monkeypatch)
+    cache = ResponseCache()
+
+    first = Tournament(magi, "どの案が良いですか", cache=cache).run(CANDIDATES)
+    assert first.ranking[0] == "案A"
+    assert first.cached == 0
+    assert first.calls == len(calls) > 0
+
+    calls.clear()
+    second = Tournament(magi, "どの案が良いですか", cache=cache).run(CANDIDATES)
+    assert calls == []
+    assert second.calls == 0
+    assert second.cached == len(second.matches)
+    assert second.ranking == first.ranking
+
+
+def test_failed_answers_are_not_cached(magi, monkeypatch):
+    cache = ResponseCache()
+    fake_answers(magi, monkeypatch, {name: ("エラー: 接続できません", "error") for name in magi.models})
+    failed = Tournament(magi, "どの案が良いですか", cache=cache).run(CANDIDATES[:2])
+    assert failed.matches[0].winner is None
+
+    calls = prefer_first_option(magi, monkeypatch)
+    retried = Tournament(magi, "どの案が良いですか", cache=cache).run(CANDIDATES[:2])
+    assert len(calls) == len(magi.models)
+    assert retried.cached == 0
+    assert retried.matches[0].winner == "案A"
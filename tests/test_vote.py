@@ -0,0 +1,32 @@
+from conftest import fake_answers
+from vote_parser import UNKNOWN, parse_approve_reject, parse_option, parse_ranking
+
+OPTIONS = ["案A", "案B", "案C"]
+
+
+def test_parsers_ignore_error_messages():
+    error = "エラー: HTTPSConnectionPool: Read timed out. (read timeout=3.0)"
+    assert parse_option(error, OPTIONS).vote == UNKNOWN
+    assert parse_approve_reject("エラー: 承認されていないトークンです").vote == UNKNOWN
+    assert parse_ranking("タイムアウト: 応答時間を超過しました（3秒）", 3).order == ()
+    assert parse_option("回答なし（推論トークンが上限に達しました）", OPTIONS).vote == UNKNOWN
+
+
+def test_vote_skips_errored_unit(magi, monkeypatch):
+    fake_answers(magi, monkeypatch, {
+        "MELCHIOR": ("2", "success"),
+        "BALTHASAR": ("2. 案B", "success"),
+        "CASPER": ("エラー: HTTPSConnectionPool: Read timed out. (read timeout=3.0)", "error"),
+    })
+    assert magi.vote("どの案にしますか", OPTIONS) == {"案A": 0, "案B": 2, "案C": 0}
+
+
+def test_approve_reject_errored_unit_is_unknown(magi, monkeypatch):
+    fake_answers(magi, monkeypatch, {
+        "MELCHIOR": ("【投票】賛成\n理由: 妥当です", "success"),
+        "BALTHASAR": ("【投票】反対\n理由: 危険です", "success"),
+        "CASPER": ("エラー: 承認されていないトークンです", "error"),
+    })
+    votes, reasons = magi.vote_approve_reject("提案")
+    assert votes == {"MELCHIOR": "賛成", "BALTHASAR": "反対", "CASPER": UNKNOWN}
+    assert reasons["CASPER"].startswith("エラー:")
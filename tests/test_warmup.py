@@ -0,0 +1,43 @@
+from samples import SAMPLE_QUESTIONS
+from warmup import Warmup, sample_jobs
+
+
+class FakeQueue:
+    """prefetchされたジョブを記録するだけのJobQueueの代わり"""
+
+    def __init__(self, magi):
+        self.magi = magi
+        self.prefetched = []
+
+    def prefetch(self, kind, **params):
+        self.prefetched.append((kind, params))
+        return str(len(self.prefetched))
+
+    def wait(self, job_id, timeout=None):
+        return None
+
+    def get(self, job_id):
+        return None
+
+
+def test_default_budget_prefetches_every_sample(magi, monkeypatch):
+    monkeypatch.setattr(magi.client, "preflight", lambda model_id: 0.01)
+    monkeypatch.delenv("MAGI_WARMUP_BUDGET", raising=False)
+    monkeypatch.setenv("MAGI_WARMUP", "1")
+    queue = FakeQueue(magi)
+
+    warmup = Warmup.from_env(queue)
+    warmup.run()
+
+    assert queue.prefetched == sample_jobs()
+    questions = [params["question"] for kind, params in queue.prefetched if kind == "analyze"]
+    assert questions == [sample.text for sample in SAMPLE_QUESTIONS]
+    assert warmup.calls == len(magi.models) * len(sample_jobs())
+    assert set(warmup.stats()["connections"].values()) == {0.01}
+
+
+def test_explicit_budget_limits_prefetch(magi, monkeypatch):
+    monkeypatch.setattr(magi.client, "preflight", lambda model_id: 0.01)
+    queue = FakeQueue(magi)
+    Warmup(queue, budget=len(magi.models) * 2).run()
+    assert len(queue.prefetched) == 2
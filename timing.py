@@ -0,0 +1,116 @@
+"""
+Timing - 審議ごとの所要時間の内訳（ウォーターフォール）
+MAGISystemとDatabricksClientが各モデル呼び出しの区間（待機・応答待ち・受信・リトライ・解析など）を記録する
+
+計測はジョブごとに有効にし、無効の場合は各区間でcontextvarを1回参照するだけで何も記録しない
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# 区間の種類
+QUEUE = "queue"  # スケジューラーの実行枠を待った時間
+CACHE = "cache"  # 回答キャッシュから返した
+COALESCED = "coalesced"  # 実行中の同一クエリ（single-flight）の完了を待った時間
+RATE_LIMIT = "rate_limit"  # エンドポイントのレート上限で待った時間
+TTFB = "ttfb"  # リクエストの送信からレスポンスヘッダーの受信まで（接続の確立とモデルの生成を含む）
+DOWNLOAD = "download"  # レスポンス本文の受信
+RETRY = "retry"  # 失敗したリクエストとリトライ前の待機
+PARSE = "parse"  # レスポンスの解析
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("magi_trace", default=None)
+_current_call: contextvars.ContextVar[Optional["CallTiming"]] = contextvars.ContextVar("magi_call", default=None)
+
+
+class CallTiming:
+    """1回のquery_modelの区間の記録"""
+
+    __slots__ = ("label", "phases")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.phases: List[tuple] = []  # (区間の種類, 開始, 終了)（time.perf_counter()の時刻）
+
+    def add(self, phase: str, start: float, end: float):
+        self.phases.append((phase, start, end))
+
+
+class Trace:
+    """1回の審議（ジョブ）の全モデル呼び出しの記録"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._calls: List[CallTiming] = []
+
+    def new_call(self, label: str) -> CallTiming:
+        call = CallTiming(label)
+        with self._lock:
+            self._calls.append(call)
+        return call
+
+    def to_dict(self) -> Dict:
+        """
+        Returns:
+            {"total": 審議全体の秒数,
+             "calls": [{"label", "phases": [{"phase", "start", "end"}]}]}（時刻は審議の開始からの秒数）
+        """
+        with self._lock:
+            calls = list(self._calls)
+        return {
+            "total": round(time.perf_counter() - self.started, 4),
+            "calls": [
+                {
+                    "label": call.label,
+                    "phases": [
+                        {
+                            "phase": phase,
+                            "start": round(start - self.started, 4),
+                            "end": round(end - self.started, 4),
+                        }
+                        for phase, start, end in call.phases
+                    ],
+                }
+                for call in calls
+            ],
+        }
+
+
+@contextmanager
+def tracing(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """この中で行うモデル呼び出しの区間をtraceに記録する（Noneの場合は記録しない）"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def timed_call(label: str) -> Iterator[Optional[CallTiming]]:
+    """
+    1回のモデル呼び出しの記録を始める
+
+    Args:
+        label: ウォーターフォールの行の名前（ユニット名など）
+
+    Yields:
+        CallTiming（計測が無効の場合はNone）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    call = trace.new_call(label)
+    token = _current_call.set(call)
+    try:
+        yield call
+    finally:
+        _current_call.reset(token)
+
+
+def current_call() -> Optional[CallTiming]:
+    """実行中のモデル呼び出しの記録（計測が無効の場合はNone）"""
+    return _current_call.get()
@@ -0,0 +1,261 @@
+"""
+Token Budget - 送信前の入力トークン数の見積もりとコンテキストの予算
+モデルファミリーごとの文字種別の係数で入力トークン数を手元で見積もり、
+コンテキスト長に収まるよう入力を詰めてmax_tokensを調整してから送信する
+（収まらない入力を送って400エラーで往復を無駄にしたり、出力の予算を黙って削られたりしない）
+
+レスポンスのusageの実際の入力トークン数と見積もりの比をモデルごとに記録し、以降の見積もりを補正する
+"""
+import re
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+# 1メッセージあたりの役割・区切りのトークン数と、応答の開始に使われるトークン数
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# 入力を詰めた位置に入れる印
+TRIM_MARKER = "\n\n…（入力がコンテキスト長を超えるため中略）…\n\n"
+
+_SPACES = re.compile(r"[ \t　]+")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*\n+")
+
+
+@dataclass(frozen=True, slots=True)
+class ModelFamily:
+    """モデルファミリーのコンテキスト長とトークン化の係数"""
+    name: str
+    context_tokens: int  # 入力と出力を合わせたコンテキスト長
+    max_output_tokens: int  # 出力トークン数の上限
+    chars_per_token: float  # ASCII文字の1トークンあたりの文字数
+    tokens_per_wide_char: float  # 非ASCII文字（日本語など）1文字あたりのトークン数
+
+
+# モデルIDに含まれる文字列 -> ファミリー（先に一致したものを使う）
+# 係数は各トークナイザーで日本語・英語の文章を数えた値よりやや多めに見積もる
+MODEL_FAMILIES: Tuple[Tuple[str, ModelFamily], ...] = (
+    ("gpt-5", ModelFamily("gpt-5", 400_000, 128_000, 4.0, 1.0)),
+    ("gpt", ModelFamily("gpt", 128_000, 16_384, 4.0, 1.0)),
+    ("claude", ModelFamily("claude", 200_000, 32_000, 3.5, 1.3)),
+    ("gemini", ModelFamily("gemini", 1_048_576, 65_536, 4.0, 0.9)),
+    ("llama", ModelFamily("llama", 128_000, 8_192, 3.8, 1.3)),
+)
+
+# どのファミリーにも一致しないモデル
+DEFAULT_FAMILY = ModelFamily("default", 128_000, 16_384, 3.5, 1.5)
+
+
+@dataclass(frozen=True, slots=True)
+class BudgetPlan:
+    """送信前の予算の調整結果"""
+    messages: List[Dict]  # 送信するメッセージ（詰めた場合は短くしたもの）
+    max_tokens: int  # 送信するmax_tokens
+    estimated_tokens: int  # 入力トークン数の見積もり
+    trimmed_chars: int = 0  # 詰めて削った文字数
+    clamped: bool = False  # max_tokensをコンテキストに収まるよう減らしたか
+
+
+def family_for(model: str) -> ModelFamily:
+    """モデルIDからファミリーを決める"""
+    model = model.lower()
+    for pattern, family in MODEL_FAMILIES:
+        if pattern in model:
+            return family
+    return DEFAULT_FAMILY
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    # cache_controlなどを付けたパートのリスト
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def estimate_text(text: str, family: ModelFamily) -> int:
+    """
+    テキストのトークン数を見積もる
+
+    ASCII文字と非ASCII文字の数だけで見積もる（文字列の走査はエンコードの1回のみ）
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    wide_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / family.chars_per_token + wide_chars * family.tokens_per_wide_char)
+
+
+def estimate_messages(messages: List[Dict], family: ModelFamily) -> int:
+    """チャットメッセージ全体の入力トークン数を見積もる"""
+    return REPLY_OVERHEAD + sum(
+        MESSAGE_OVERHEAD + estimate_text(_content_text(message["content"]), family) for message in messages
+    )
+
+
+class TokenBudget:
+    """
+    送信前にモデルのコンテキスト長に収まるよう入力とmax_tokensを調整し、見積もりと実際のトークン数を集計する
+
+    - max_tokensはファミリーの出力上限と、コンテキストの残りに収まるよう減らす
+    - 入力の見積もり + 出力の最低限の予算（min_output_tokens）もコンテキストに収まらない場合は、
+      空白を詰めた上で、最も長いユーザーのメッセージの中央を省略する
+      （システムプロンプトと、続きを書かせる場合の途中までの回答（assistant）は変えない）
+    - 詰めても収まらない場合（システムプロンプトだけで超えるなど）は送信せずにValueErrorを送出する
+    """
+
+    def __init__(self, min_output_tokens: int = 1024, safety_margin: float = 0.05, smoothing: float = 0.2):
+        """
+        Args:
+            min_output_tokens: 入力を詰めてでも確保する出力トークン数（max_tokensがこれより小さい場合はmax_tokens）
+            safety_margin: 見積もりの誤差に備えてコンテキスト長から除く割合
+            smoothing: 見積もりの補正係数を実際のトークン数に近づける割合（指数移動平均）
+        """
+        self.min_output_tokens = min_output_tokens
+        self.safety_margin = safety_margin
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._corrections: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def estimate(self, model: str, messages: List[Dict]) -> int:
+        """
+        入力トークン数を見積もる（実際のトークン数との比で補正する）
+
+        Args:
+            model: モデルのID
+            messages: チャットメッセージのリスト
+
+        Returns:
+            入力トークン数の見積もり
+        """
+        correction = self._corrections.get(model, 1.0)
+        return math.ceil(estimate_messages(messages, family_for(model)) * correction)
+
+    def fit(self, model: str, messages: List[Dict], max_tokens: int) -> BudgetPlan:
+        """
+        入力とmax_tokensをモデルのコンテキスト長に収める
+
+        Args:
+            model: モデルのID
+            messages: チャットメッセージのリスト
+            max_tokens: 指定されたmax_tokens
+
+        Returns:
+            BudgetPlan
+
+        Raises:
+            ValueError: 入力を詰めてもコンテキスト長に収まらない場合
+        """
+        family = family_for(model)
+        limit = int(family.context_tokens * (1 - self.safety_margin))
+        output = min(max_tokens, family.max_output_tokens)
+        reserve = min(output, self.min_output_tokens)
+
+        estimated = self.estimate(model, messages)
+        trimmed_chars = 0
+        if estimated + reserve > limit:
+            # 詰める場合は、指定された出力の予算がすべて収まるところまで詰める
+            messages, trimmed_chars = self._trim(model, messages, estimated + output - limit)
+            estimated = self.estimate(model, messages)
+            if estimated + reserve > limit:
+                raise ValueError(
+                    f"入力がコンテキスト長を超えています（見積もり{estimated}トークン、"
+                    f"{model}の入力の上限は約{limit - reserve}トークン）"
+                )
+
+        output = min(output, limit - estimated)
+        clamped = output < max_tokens
+        if trimmed_chars or clamped:
+            with self._lock:
+                stats = self._model_stats(model)
+                stats["trimmed"] += 1 if trimmed_chars else 0
+                stats["clamped"] += 1 if clamped else 0
+        return BudgetPlan(messages, output, estimated, trimmed_chars, clamped)
+
+    def _trim(self, model: str, messages: List[Dict], excess: int) -> Tuple[List[Dict], int]:
+        """
+        入力の見積もりをexcessトークン分減らす
+
+        Returns:
+            (詰めたメッセージ, 削った文字数)
+        """
+        family = family_for(model)
+        target = self.estimate(model, messages) - excess
+        original = sum(len(_content_text(message["content"])) for message in messages)
+
+        # まず連続する空白と空行を詰める
+        messages = [
+            message if message["role"] != "user" else {
+                **message,
+                "content": _BLANK_LINES.sub("\n\n", _SPACES.sub(" ", _content_text(message["content"])))
+            }
+            for message in messages
+        ]
+
+        # 足りなければ、最も長いユーザーのメッセージの中央を省略する（冒頭と末尾の指示は残す）
+        # 途中までの回答は続きを書かせる起点のため省略しない
+        for _ in range(len(messages) + 2):
+            over = self.estimate(model, messages) - target
+            candidates = [i for i, message in enumerate(messages) if message["role"] == "user"]
+            if over <= 0 or not candidates:
+                break
+            index = max(candidates, key=lambda i: len(messages[i]["content"]))
+            text = messages[index]["content"]
+            if len(text) <= len(TRIM_MARKER):
+                break
+            tokens_per_char = estimate_text(text, family) * self._corrections.get(model, 1.0) / len(text)
+            keep = max(len(text) - math.ceil(over / tokens_per_char) - len(TRIM_MARKER) - 16, 0)
+            head = text[:keep - keep // 2]
+            tail = text[len(text) - keep // 2:] if keep // 2 else ""
+            messages = list(messages)
+            messages[index] = {**messages[index], "content": head + TRIM_MARKER + tail}
+
+        return messages, original - sum(len(_content_text(message["content"])) for message in messages)
+
+    def record(self, model: str, estimated: int, actual: int):
+        """
+        見積もりと実際の入力トークン数を記録し、以降の見積もりの補正係数を更新する
+
+        Args:
+            model: モデルのID
+            estimated: 送信前の見積もり
+            actual: レスポンスのusageの入力トークン数
+        """
+        if estimated <= 0 or actual <= 0:
+            return
+        with self._lock:
+            correction = self._corrections.get(model, 1.0)
+            observed = correction * actual / estimated
+            correction += (observed - correction) * self.smoothing
+            self._corrections[model] = min(max(correction, 0.5), 3.0)
+
+            stats = self._model_stats(model)
+            stats["requests"] += 1
+            stats["estimated_input_tokens"] += estimated
+            stats["actual_input_tokens"] += actual
+
+    def _model_stats(self, model: str) -> Dict[str, int]:
+        return self._stats.setdefault(model, {
+            "requests": 0,
+            "estimated_input_tokens": 0,
+            "actual_input_tokens": 0,
+            "trimmed": 0,
+            "clamped": 0,
+        })
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        モデルごとの見積もりと実際の入力トークン数
+
+        Returns:
+            モデルのID -> {"requests", "estimated_input_tokens", "actual_input_tokens",
+                           "estimate_error"（見積もりの合計の実際との差の割合）, "correction", "trimmed", "clamped"}
+        """
+        with self._lock:
+            snapshot = {model: dict(stats) for model, stats in self._stats.items()}
+            corrections = dict(self._corrections)
+
+        for model, stats in snapshot.items():
+            actual = stats["actual_input_tokens"]
+            stats["estimate_error"] = round(stats["estimated_input_tokens"] / actual - 1, 4) if actual else 0.0
+            stats["correction"] = round(corrections.get(model, 1.0), 4)
+        return snapshot
@@ -0,0 +1,319 @@
+"""
+MAGI Tournament - 1対1の比較による多数の候補の順位付け
+すべての候補を1つのプロンプトに並べる代わりに、スイス式トーナメントで2つずつ比較する
+"""
+import math
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from response_cache import ResponseCache
+from scheduler import submit_in_context
+from shared_state import get_shared_state
+from vote_parser import UNKNOWN, parse_option
+
+# 既定の対戦ごと・ユニットごとの回答のキャッシュ（インスタンスをまたいで、共有状態があればプロセス間でも再利用する）
+_match_cache = ResponseCache(max_entries=4096, shared=get_shared_state())
+
+
+@dataclass(frozen=True, slots=True)
+class Match:
+    """1対1の比較の結果"""
+    a: str
+    b: str
+    winner: Optional[str]  # 勝者（重み付きの票が同数の場合はNoneで引き分け）
+    votes: Dict[str, str]  # ユニット名 -> 選んだ候補（判別できない場合は「不明」）
+
+
+@dataclass(frozen=True, slots=True)
+class TournamentResult:
+    """トーナメントの結果"""
+    ranking: List[str]  # 全候補の順位（上位から）
+    points: Dict[str, float]  # 勝ち点（勝ち1、引き分け0.5、不戦勝1）
+    matches: List[Match]  # 実施した比較（キャッシュから得たものを含む）
+    rounds: int  # 実施したラウンド数
+    calls: int  # モデルの呼び出し回数
+    cached: int  # 全ユニットの回答をキャッシュから得た比較の数
+    capped: bool  # 呼び出し回数の上限で打ち切ったか
+
+
+class Tournament:
+    """
+    スイス式トーナメント
+
+    - 各ラウンドで勝ち点の近い候補同士を、まだ対戦していない組み合わせで対戦させる
+    - ラウンド内の全対戦×全ユニットを並列に問い合わせ、ユニットの重み付き多数決で勝者を決める
+    - ラウンド数は ceil(log2(n)) のため、比較の数は n/2 × log2(n)、つまりO(n log n)に収まる
+    - 各ユニットの回答は (質問, 候補の組, ユニット, 温度) ごとにキャッシュし、別のトーナメント
+      （同じ候補を含む再実行や別のジョブ）でも同じ比較は問い合わせない。勝者は重みで毎回集計し直す
+    """
+
+    def __init__(
+        self,
+        magi,
+        question: str,
+        temperature: float = 0.7,
+        max_calls: Optional[int] = None,
+        rounds: Optional[int] = None,
+        cache: Optional[ResponseCache] = None
+    ):
+        """
+        Args:
+            magi: MAGISystem
+            question: 候補を比べる観点（例: 「新サービスの名前として最も良いものは？」）
+            temperature: 温度パラメータ
+            max_calls: モデルの呼び出し回数の上限（Noneの場合は上限なし）
+            rounds: ラウンド数（Noneの場合は ceil(log2(候補数))）
+            cache: 対戦ごと・ユニットごとの回答のキャッシュ（Noneの場合はトーナメント間で共有する既定のキャッシュ）
+        """
+        self.magi = magi
+        self.question = question
+        self.temperature = temperature
+        self.max_calls = max_calls
+        self.rounds = rounds
+        self.cache = cache if cache is not None else _match_cache
+
+    def run(
+        self,
+        candidates: List[str],
+        on_progress: Optional[Callable[[str, Dict], None]] = None
+    ) -> TournamentResult:
+        """
+        候補の順位を決める
+
+        Args:
+            candidates: 候補のリスト
+            on_progress: 各対戦の結果が出るたびに
+                         ("ラウンド: 候補A vs 候補B", {"round", "a", "b", "winner", "votes", "status"}) で呼ばれる
+
+        Returns:
+            TournamentResult
+        """
+        candidates = list(dict.fromkeys(candidates))
+        if len(candidates) < 2:
+            raise ValueError("最低2つの候補が必要です")
+
+        rounds = self.rounds or math.ceil(math.log2(len(candidates)))
+        units = len(self.magi.models)
+        points = {candidate: 0.0 for candidate in candidates}
+        opponents: Dict[str, List[str]] = {candidate: [] for candidate in candidates}
+        had_bye = set()
+        matches: List[Match] = []
+        calls = cached = 0
+        capped = False
+        round_no = 0
+
+        for round_no in range(1, rounds + 1):
+            pairs, bye = self._pair(candidates, points, opponents, had_bye)
+            if not pairs:
+                round_no -= 1
+                break
+
+            # キャッシュにない回答だけが呼び出しを伴う。上限を超える対戦はこのラウンドで打ち切る
+            hits = {pair: self._lookup(*pair) for pair in pairs}
+            if self.max_calls is not None:
+                budget = self.max_calls - calls
+                affordable = []
+                for pair in pairs:
+                    cost = units - len(hits[pair])
+                    if cost > budget:
+                        capped = True
+                        continue
+                    budget -= cost
+                    affordable.append(pair)
+                pairs = affordable
+                if not pairs:
+                    round_no -= 1
+                    break
+
+            cached += sum(1 for pair in pairs if len(hits[pair]) == units)
+            calls += sum(units - len(hits[pair]) for pair in pairs)
+            results = self._compare(pairs, hits)
+
+            for a, b in pairs:
+                match = results[self._key(a, b)]
+                matches.append(match)
+                opponents[a].append(b)
+                opponents[b].append(a)
+                if match.winner is None:
+                    points[a] += 0.5
+                    points[b] += 0.5
+                else:
+                    points[match.winner] += 1.0
+                if on_progress is not None:
+                    on_progress(f"{round_no}: {a} vs {b}", {
+                        "round": round_no,
+                        "a": a,
+                        "b": b,
+                        "winner": match.winner,
+                        "votes": match.votes,
+                        "status": "success" if match.winner is not None else "draw"
+                    })
+
+            # 打ち切ったラウンドでは不戦勝を与えない
+            if bye is not None and not capped:
+                points[bye] += 1.0
+                had_bye.add(bye)
+
+            if capped:
+                break
+
+        # 勝ち点が同じ場合は対戦相手の勝ち点の合計（ブッフホルツ）が高い方を上位とする
+        def buchholz(candidate: str) -> float:
+            return sum(points[opponent] for opponent in opponents[candidate])
+
+        order = {candidate: i for i, candidate in enumerate(candidates)}
+        ranking = sorted(candidates, key=lambda c: (-points[c], -buchholz(c), order[c]))
+
+        return TournamentResult(
+            ranking=ranking,
+            points=points,
+            matches=matches,
+            rounds=round_no,
+            calls=calls,
+            cached=cached,
+            capped=capped
+        )
+
+    @staticmethod
+    def _key(a: str, b: str) -> Tuple[str, str]:
+        return (a, b) if a <= b else (b, a)
+
+    @staticmethod
+    def _pair(
+        candidates: List[str],
+        points: Dict[str, float],
+        opponents: Dict[str, List[str]],
+        had_bye: Set[str]
+    ) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+        """
+        勝ち点の近い候補同士を、まだ対戦していない組み合わせで組む
+
+        Returns:
+            (対戦の組み合わせ, 不戦勝の候補)
+        """
+        order = {candidate: i for i, candidate in enumerate(candidates)}
+        standings = sorted(candidates, key=lambda c: (-points[c], order[c]))
+
+        bye = None
+        if len(standings) % 2 == 1:
+            # 不戦勝はまだ不戦勝になっていない最下位の候補に与える
+            bye = next((c for c in reversed(standings) if c not in had_bye), standings[-1])
+            standings.remove(bye)
+
+        pairs = []
+        unpaired = list(standings)
+        while len(unpaired) >= 2:
+            top = unpaired.pop(0)
+            partner = next((c for c in unpaired if c not in opponents[top]), None)
+            if partner is None:
+                # 全員と対戦済みの候補はこのラウンドでは対戦させない
+                continue
+            unpaired.remove(partner)
+            pairs.append((top, partner))
+        return pairs, bye
+
+    def _shown(self, a: str, b: str) -> Dict[str, Tuple[str, str]]:
+        """
+        ユニットごとの候補の提示順
+
+        提示順による偏りを打ち消すため、ユニットごとに候補の提示順を交互に入れ替える
+        """
+        a, b = self._key(a, b)
+        return {name: (a, b) if i % 2 == 0 else (b, a) for i, name in enumerate(self.magi.models)}
+
+    def _cache_key(self, name: str, shown: Tuple[str, str]) -> Tuple:
+        return (
+            "tournament", name, self.magi.models[name], self.magi.personas[name],
+            self.question, shown[0], shown[1], self.temperature
+        )
+
+    def _lookup(self, a: str, b: str) -> Dict[str, Tuple[str, str, str]]:
+        """
+        キャッシュにある対戦の回答
+
+        Returns:
+            ユニット名 -> (ユニット名, 回答, ステータス)（キャッシュにあるユニットのみ）
+        """
+        hits = {}
+        for name, shown in self._shown(a, b).items():
+            hit = self.cache.get(self._cache_key(name, shown))
+            if hit is not None:
+                hits[name] = hit
+        return hits
+
+    def _compare(
+        self,
+        pairs: List[Tuple[str, str]],
+        hits: Dict[Tuple[str, str], Dict[str, Tuple[str, str, str]]]
+    ) -> Dict[Tuple[str, str], Match]:
+        """
+        キャッシュにない対戦×ユニットに並列で問い合わせ、ユニットの重み付き多数決で勝者を決める
+
+        Args:
+            pairs: 対戦の組み合わせ
+            hits: 対戦 -> キャッシュにあるユニットの回答（_lookupの結果）
+
+        Returns:
+            (候補, 候補)（名前順） -> Match
+        """
+        if not pairs:
+            return {}
+
+        names = list(self.magi.models)
+        answers: Dict[Tuple[str, str], Dict[str, Tuple[str, str, str]]] = {
+            self._key(a, b): dict(hits[(a, b)]) for a, b in pairs
+        }
+        pending = [
+            (key, name, shown)
+            for key in answers
+            for name, shown in self._shown(*key).items() if name not in answers[key]
+        ]
+
+        if pending:
+            max_workers = min(len(pending), self.magi.council.max_workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    submit_in_context(
+                        executor,
+                        self.magi.query_model,
+                        name,
+                        self.magi.models[name],
+                        self._prompt(*shown),
+                        self.temperature
+                    ): (key, name, shown)
+                    for key, name, shown in pending
+                }
+
+                for future in concurrent.futures.as_completed(futures):
+                    key, name, shown = futures[future]
+                    result = future.result()
+                    answers[key][name] = result
+                    # 成功した回答だけを保存する（エラー・タイムアウトは次回問い合わせ直す）
+                    if result[2] == "success":
+                        self.cache.put(self._cache_key(name, shown), result)
+
+        results = {}
+        for (a, b), unit_answers in answers.items():
+            shown = self._shown(a, b)
+            unit_votes = {}
+            for name in names:
+                _, answer, status = unit_answers[name]
+                unit_votes[name] = parse_option(answer, list(shown[name])).vote if status == "success" else UNKNOWN
+            score = {a: 0, b: 0}
+            for name, vote in unit_votes.items():
+                if vote in score:
+                    score[vote] += self.magi.council.unit(name).weight
+            winner = a if score[a] > score[b] else b if score[b] > score[a] else None
+            results[(a, b)] = Match(a=a, b=b, winner=winner, votes=unit_votes)
+        return results
+
+    def _prompt(self, first: str, second: str) -> str:
+        return f"""{self.question}
+
+以下の2つのうち、より適切なものを選んでください。番号のみで回答してください。
+
+1. {first}
+2. {second}
+
+回答（1 または 2）:"""
@@ -0,0 +1,285 @@
+"""
+Vote Parser - モデルの回答から投票を取り出す
+賛成/反対（承認/否定）の投票と選択肢の投票を、コンパイル済みのパターンで解析し確信度を付けて返す
+
+ベンチマーク:
+    python vote_parser.py
+"""
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from consensus import is_valid_answer
+
+# 判別できない場合の投票
+UNKNOWN = "不明"
+
+APPROVE = "賛成"
+REJECT = "反対"
+
+# 解析する回答の先頭部分の長さ（投票は冒頭に書かれるため、長い理由の全文は見ない）
+HEAD_CHARS = 300
+
+_APPROVE_WORDS = r"賛成|承認|可決|approved?"
+_REJECT_WORDS = r"反対|否定|却下|否決|reject(?:ed)?"
+
+# プロンプトの回答形式をそのまま書き写した行（「【投票】賛成 または 【投票】反対」）
+_ECHOED_FORMAT = re.compile(
+    rf"【投票】\s*(?:{_APPROVE_WORDS}|{_REJECT_WORDS})\s*(?:または|or|/)\s*【投票】\s*(?:{_APPROVE_WORDS}|{_REJECT_WORDS})",
+    re.IGNORECASE
+)
+
+# 明示的な投票の記載（【投票】賛成、投票: 反対、**投票**：承認 など）
+_MARKER = re.compile(
+    rf"(?:【\s*投票\s*】|投票\s*[:：])\s*[*＊]*\s*(?:(?P<approve>{_APPROVE_WORDS})|(?P<reject>{_REJECT_WORDS}))",
+    re.IGNORECASE
+)
+
+# 「反対意見」「賛成派」「否定的」のように投票を表さない複合語
+_NOT_A_VOTE = r"(?!意見|派|者|側|論|票|的|の声)"
+
+# 賛成/反対の語（英語は単語境界で区切る）
+_KEYWORD = re.compile(
+    rf"(?P<approve>(?:賛成|承認|可決){_NOT_A_VOTE}|\bapprove\b)"
+    rf"|(?P<reject>(?:反対|否定|却下|否決){_NOT_A_VOTE}|\breject\b)",
+    re.IGNORECASE
+)
+
+# 語の直後に続く否定（「賛成できない」は反対、「反対しない」は賛成とみなす）
+_NEGATION = re.compile(
+    r"(?:し(?:ない|かねる|ません)|でき(?:ない|ません)|ではない|ではありません|じゃない|には至らない|とは言えない)"
+)
+
+# 回答全体が番号だけ（「2」「(2)」「2.」「回答: 2」など）
+_BARE_NUMBER = re.compile(r"^(?:回答|答え|選択|投票|answer)?\s*[:：]?\s*[(（]?\s*(\d{1,3})\s*[)）.．]?\s*$", re.IGNORECASE)
+
+# 冒頭が番号で始まる回答（「2. 理由は…」「3番です」）
+_LEADING_NUMBER = re.compile(r"^\s*[(（]?\s*(\d{1,3})(?!\d)")
+
+# 回答中の独立した番号
+_NUMBER = re.compile(r"(?<!\d)(\d{1,3})(?!\d)")
+
+# 縦に並べた順位の行（「1位: 3」「1. 3」「1) 3番」）から順位の番号を除く
+_RANK_PREFIX = re.compile(r"^\s*\d{1,3}\s*(?:位\s*[:：.]?|[.)）:：])\s*(?=\d)")
+
+# 否定された番号（「1ではなく」「2番は不適切」など）
+_NEGATED_NUMBER = re.compile(r"(?<!\d)(\d{1,3})\s*番?\s*(?:ではなく|ではない|じゃなく|は(?:不適切|除外|選ばない))")
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedVote:
+    """回答から取り出した投票"""
+    vote: str  # 賛成 / 反対 / 選択肢 / 不明
+    confidence: float  # 解析の確からしさ（0.0〜1.0、不明の場合は0.0）
+    method: str  # marker / negation / keyword / number / label / none
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedRanking:
+    """回答から取り出した順位"""
+    order: Tuple[int, ...]  # 選択肢の番号（0始まり）を上位から並べたもの
+    confidence: float  # 全選択肢のうち順位を読み取れた割合（縦に並べた回答は0.8倍）
+
+
+_NOT_FOUND = ParsedVote(vote=UNKNOWN, confidence=0.0, method="none")
+
+
+def _head(answer: str) -> str:
+    """回答の冒頭を全角数字・全角英字などを正規化して返す"""
+    return unicodedata.normalize("NFKC", answer[:HEAD_CHARS])
+
+
+def parse_approve_reject(answer: str) -> ParsedVote:
+    """
+    回答から賛成/反対を取り出す（承認/否定の表記も同じ意味として扱う）
+
+    1. 【投票】賛成 のような明示的な記載（確信度1.0、複数の記載が食い違う場合は0.5）
+    2. 冒頭に現れる賛成/反対の語（「賛成できない」のように否定が続く場合は逆の投票とみなす）
+       一方の投票だけが読み取れれば確信度0.6、両方が読み取れる場合は先に現れた方を0.3
+
+    Args:
+        answer: モデルの回答
+
+    Returns:
+        ParsedVote（voteは 賛成 / 反対 / 不明、エラー・タイムアウトのメッセージは不明）
+    """
+    if not answer or not is_valid_answer(answer):
+        return _NOT_FOUND
+
+    # 明示的な記載は回答全体から探す（パターン側で全角の記号も受け付ける）
+    text = _ECHOED_FORMAT.sub("", answer)
+    markers = [APPROVE if m.group("approve") else REJECT for m in _MARKER.finditer(text)]
+    if markers:
+        return ParsedVote(markers[0], 1.0 if len(set(markers)) == 1 else 0.5, "marker")
+
+    head = _head(text)
+    found = []
+    first_negated = False
+    for m in _KEYWORD.finditer(head):
+        negated = _NEGATION.match(head, m.end()) is not None
+        if not found:
+            first_negated = negated
+        found.append(APPROVE if bool(m.group("approve")) != negated else REJECT)
+    if not found:
+        return _NOT_FOUND
+    return ParsedVote(
+        found[0],
+        0.6 if len(set(found)) == 1 else 0.3,
+        "negation" if first_negated else "keyword"
+    )
+
+
+def parse_option(answer: str, options: Sequence[str]) -> ParsedVote:
+    """
+    回答から選択肢を取り出す（選択肢の番号は1始まり）
+
+    1. 回答が番号だけ（確信度1.0）
+    2. 回答が番号で始まる（確信度0.9）
+    3. 選択肢の文言がちょうど1つだけ含まれる（確信度0.8、回答が文言そのものなら1.0）
+    4. 冒頭に範囲内の番号が1種類だけ現れる（確信度0.6、複数ある場合は先に現れた方を0.3）
+    「1ではなく」のように否定された番号は候補から除く
+
+    Args:
+        answer: モデルの回答
+        options: 選択肢のリスト
+
+    Returns:
+        ParsedVote（voteは選択肢の文言か 不明、エラー・タイムアウトのメッセージは不明）
+    """
+    if not answer or not options or not is_valid_answer(answer):
+        return _NOT_FOUND
+
+    head = _head(answer).strip()
+
+    def option_at(number: str) -> Optional[str]:
+        index = int(number) - 1
+        return options[index] if 0 <= index < len(options) else None
+
+    first_line = head.split("\n", 1)[0].strip().strip("*＊")
+    match = _BARE_NUMBER.match(first_line)
+    if match and option_at(match.group(1)) is not None:
+        return ParsedVote(option_at(match.group(1)), 1.0, "number")
+
+    negated = {m.group(1) for m in _NEGATED_NUMBER.finditer(head)}
+
+    match = _LEADING_NUMBER.match(first_line)
+    if match and match.group(1) not in negated and option_at(match.group(1)) is not None:
+        return ParsedVote(option_at(match.group(1)), 0.9, "number")
+
+    label = _match_label(head, first_line, options)
+    if label is not None:
+        return label
+
+    numbers: List[str] = []
+    for m in _NUMBER.finditer(head):
+        number = m.group(1)
+        if number not in negated and option_at(number) is not None and number not in numbers:
+            numbers.append(number)
+    if numbers:
+        return ParsedVote(option_at(numbers[0]), 0.6 if len(numbers) == 1 else 0.3, "number")
+
+    return _NOT_FOUND
+
+
+def parse_ranking(answer: str, count: int) -> ParsedRanking:
+    """
+    「3,1,2」のような順位の回答から選択肢の番号を上位から取り出す
+
+    番号が2つ以上並んだ最初の行を順位とみなし、なければ1行に1つずつ並べた回答として読む。
+    範囲外の番号と重複は無視し、読み取れなかった選択肢は順位なしとして扱う
+
+    Args:
+        answer: モデルの回答
+        count: 選択肢の数
+
+    Returns:
+        ParsedRanking
+    """
+    if not answer or count <= 0 or not is_valid_answer(answer):
+        return ParsedRanking(order=(), confidence=0.0)
+
+    def valid(numbers: List[str]) -> Tuple[int, ...]:
+        order = []
+        for number in numbers:
+            index = int(number) - 1
+            if 0 <= index < count and index not in order:
+                order.append(index)
+        return tuple(order)
+
+    lines = [_RANK_PREFIX.sub("", line) for line in _head(answer).splitlines()]
+    for line in lines:
+        order = valid(_NUMBER.findall(line))
+        if len(order) >= 2:
+            return ParsedRanking(order=order, confidence=len(order) / count)
+
+    numbers = []
+    for line in lines:
+        found = _NUMBER.findall(line)
+        if len(found) == 1:
+            numbers.append(found[0])
+    order = valid(numbers)
+    return ParsedRanking(order=order, confidence=0.8 * len(order) / count)
+
+
+def _match_label(head: str, first_line: str, options: Sequence[str]) -> Optional[ParsedVote]:
+    """選択肢の文言で回答を照合（他の選択肢に含まれる短い文言より長い文言を優先）"""
+    folded_head = head.casefold()
+    folded_line = first_line.casefold().rstrip("。.")
+    matched = []
+    for option in sorted(options, key=len, reverse=True):
+        folded = unicodedata.normalize("NFKC", option).casefold().strip()
+        if not folded:
+            continue
+        if folded_line == folded:
+            return ParsedVote(option, 1.0, "label")
+        # 1文字の文言は他の単語の一部と区別できないため、行全体が一致する場合のみ採用する
+        if len(folded) < 2:
+            continue
+        if folded in folded_head and not any(folded in other for other in matched):
+            matched.append(folded)
+            if len(matched) > 1:
+                return None
+            label = option
+    if matched:
+        return ParsedVote(label, 0.8, "label")
+    return None
+
+
+if __name__ == "__main__":
+    import timeit
+
+    approve_reject_samples = [
+        "【投票】賛成\n\n理由: 科学的根拠に基づき、効率性の向上が期待できます。" + "詳細な説明。" * 200,
+        "**【投票】反対**\n\n倫理的な観点から慎重であるべきです。",
+        "この提案には賛成できません。長期的なリスクが大きすぎます。",
+        "【投票】賛成 または 【投票】反対\n\n投票: 承認\n柔軟な運用が可能です。",
+        "Reject. The proposal lacks evidence.",
+        "エラー: 503 Service Unavailable",
+    ]
+    options = [f"選択肢{i}" for i in range(1, 13)]
+    option_samples = [
+        "3",
+        "（１２）",
+        "2. 理由は以下の通りです。" + "説明。" * 200,
+        "選択肢7が最も適切です。",
+        "1ではなく4を選びます。",
+        "回答なし（max_tokensに達しました）",
+    ]
+
+    for answer in approve_reject_samples:
+        print(parse_approve_reject(answer), repr(answer[:30]))
+    for answer in option_samples:
+        print(parse_option(answer, options), repr(answer[:30]))
+    ranking_samples = ["3,1,2,4", "順位: 4 > 2 > 1", "1位: 3\n2位: 1\n3位: 2", "分かりません"]
+    for answer in ranking_samples:
+        print(parse_ranking(answer, 4), repr(answer[:30]))
+
+    rounds = 20000
+    for name, fn, samples in [
+        ("parse_approve_reject", lambda a: parse_approve_reject(a), approve_reject_samples),
+        ("parse_option", lambda a: parse_option(a, options), option_samples),
+        ("parse_ranking", lambda a: parse_ranking(a, 4), ranking_samples),
+    ]:
+        elapsed = timeit.timeit(lambda: [fn(a) for a in samples], number=rounds)
+        print(f"{name}: {elapsed / (rounds * len(samples)) * 1e6:.1f}µs/回答")
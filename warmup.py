@@ -0,0 +1,134 @@
+"""
+MAGI Warmup - 起動時のウォームアップ
+デプロイ直後の最初の審議が接続の確立（DNS・TLS・認証）を待たないよう各エンドポイントへ事前に接続し、
+よく使われるサンプルの審議を呼び出し回数の予算内でバックグラウンドで事前に実行しておく
+
+環境変数:
+    MAGI_WARMUP: 1 でアプリ起動時にウォームアップする（既定: 無効）
+    MAGI_WARMUP_BUDGET: サンプルの事前審議に使うモデル呼び出し回数の上限（既定: すべてのサンプルを審議する回数）
+"""
+import os
+import threading
+import concurrent.futures
+from typing import Dict, List, Optional, Tuple, Union
+
+from job_queue import DONE
+from samples import SAMPLE_PROPOSALS, SAMPLE_QUESTIONS, SAMPLE_VOTES
+
+
+def preflight(magi) -> Dict[str, Union[float, str]]:
+    """
+    全ユニットのエンドポイントへ並列に接続する
+
+    Args:
+        magi: MAGISystem
+
+    Returns:
+        モデルのID -> 所要時間（秒）またはエラーメッセージ
+    """
+    model_ids = list(dict.fromkeys(magi.models.values()))
+    results: Dict[str, Union[float, str]] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(model_ids)) as executor:
+        futures = {executor.submit(magi.client.preflight, model_id): model_id for model_id in model_ids}
+        for future in concurrent.futures.as_completed(futures):
+            model_id = futures[future]
+            try:
+                results[model_id] = future.result()
+            except Exception as e:
+                results[model_id] = f"エラー: {e}"
+    return results
+
+
+def sample_jobs(temperature: float = 0.7) -> List[Tuple[str, Dict]]:
+    """
+    事前に実行するサンプルの審議（優先度の高い順）
+
+    パラメータはアプリの既定の設定（討論1ラウンド・サンプル数1・単一選択）で投入されるものと同じにする。
+    質問分析は回答が長く呼び出しの負荷が大きいため最後に回す
+
+    Args:
+        temperature: アプリで使う温度パラメータ
+
+    Returns:
+        (ジョブ種別, パラメータ) のリスト
+    """
+    jobs = [
+        ("vote_approve_reject", {"proposal": sample.text, "temperature": temperature, "samples": 1})
+        for sample in SAMPLE_PROPOSALS
+    ]
+    jobs += [
+        ("vote", {"question": sample.text, "options": list(sample.options), "temperature": temperature})
+        for sample in SAMPLE_VOTES
+    ]
+    jobs += [("analyze", {"question": sample.text, "temperature": temperature}) for sample in SAMPLE_QUESTIONS]
+    return jobs
+
+
+class Warmup:
+    """
+    バックグラウンドで接続の確立とサンプルの事前審議を行う
+
+    事前審議はJobQueue.prefetchでbatchレーンに1件ずつ投入するため、実行中に来た利用者の審議を待たせない
+    """
+
+    def __init__(self, queue, budget: Optional[int] = None, temperature: float = 0.7):
+        """
+        Args:
+            queue: JobQueue
+            budget: 事前審議に使うモデル呼び出し回数の上限（0で事前審議をしない、
+                    Noneの場合はすべてのサンプル（ユニット数 × サンプル数）を審議する）
+            temperature: アプリで使う温度パラメータ
+        """
+        self.queue = queue
+        self.budget = budget
+        self.temperature = temperature
+        self.connections: Dict[str, Union[float, str]] = {}
+        self.job_ids: List[str] = []
+        self.calls = 0
+        self.finished = False
+
+    @classmethod
+    def from_env(cls, queue, temperature: float = 0.7) -> Optional["Warmup"]:
+        """環境変数MAGI_WARMUP / MAGI_WARMUP_BUDGETから作る（無効の場合はNone）"""
+        if os.environ.get("MAGI_WARMUP", "") not in ("1", "true", "yes"):
+            return None
+        budget = os.environ.get("MAGI_WARMUP_BUDGET")
+        return cls(queue, budget=int(budget) if budget else None, temperature=temperature)
+
+    def start(self) -> "Warmup":
+        threading.Thread(target=self.run, name="magi-warmup", daemon=True).start()
+        return self
+
+    def run(self):
+        try:
+            magi = self.queue.magi
+            # 接続の所要時間はサイドバーの「ウォームアップ」に表示する
+            self.connections = preflight(magi)
+
+            units = len(magi.models)
+            jobs = sample_jobs(self.temperature)
+            budget = self.budget if self.budget is not None else units * len(jobs)
+            for kind, params in jobs:
+                if self.calls + units > budget:
+                    break
+                job_id = self.queue.prefetch(kind, **params)
+                self.job_ids.append(job_id)
+                self.calls += units
+                # ジョブキューのワーカーを1つしか使わないよう、1件ずつ完了を待ってから次を投入する
+                self.queue.wait(job_id)
+        finally:
+            self.finished = True
+
+    def stats(self) -> Dict:
+        """
+        Returns:
+            {"connections", "prefetched", "ready", "calls", "finished"}
+        """
+        jobs = [self.queue.get(job_id) for job_id in self.job_ids]
+        return {
+            "connections": dict(self.connections),
+            "prefetched": len(self.job_ids),
+            "ready": sum(1 for job in jobs if job is not None and job.status == DONE),
+            "calls": self.calls,
+            "finished": self.finished,
+        }